@@ -0,0 +1,665 @@
+import json
+import time
+import zlib
+import random
+import threading
+import urllib.request
+from dataclasses import dataclass
+from collections import defaultdict
+from email.parser import BytesParser
+from email.utils import formatdate
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, quote, unquote, urlencode
+from typing import Any, Dict, List, Optional, Set, Tuple
+from migration.telemetry import endpoint
+
+API_PREFIX = '/api/v4'
+STREAM_CHUNK = 64 * 1024
+# File names of every mock repository, matching the replacement file patterns
+REPOSITORY_FILES = ('.gitlab-ci.yml', 'deploy/values.yaml', 'scripts/build.sh', 'Dockerfile', 'README.md')
+
+
+@dataclass
+class MockConfig:
+    """
+    Behaviour of a mock GitLab instance.
+
+    Args:
+        latency: Seconds added to every response
+        export_seconds: Seconds a group or project export takes to finish
+        import_seconds: Seconds a project import takes to finish
+        archive_mb: Average size in MB of a project export archive, actual sizes vary from half to 1.5 times it
+        download_mbps: Download bandwidth of export archives in MB/s (0 = unlimited)
+        rate_limit: Requests per minute before answering 429 (0 = unlimited)
+        files: Number of files of every repository
+        bulk_import_seconds: Seconds a direct transfer (bulk import) takes to finish
+        bulk_import_failure_rate: Fraction of bulk import entities that fail, picked by their source path
+    """
+    latency: float = 0.0
+    export_seconds: float = 1.0
+    import_seconds: float = 1.0
+    archive_mb: float = 1.0
+    download_mbps: float = 0.0
+    rate_limit: int = 0
+    files: int = 5
+    bulk_import_seconds: float = 1.0
+    bulk_import_failure_rate: float = 0.0
+
+
+class MockGitLab:
+    """
+    In-memory stand-in of the GitLab API parts used by GLARE: groups and projects
+    listings, group and project exports and imports, direct transfers (bulk imports),
+    CI/CD variables, repository tree, raw files, commits and merge requests.
+
+    Export archives are generated on the fly: a JSON header line describing the exported
+    group or project followed by padding up to the archive size, so an import on another
+    mock instance recreates the same structure. Like on GitLab, an imported group exists
+    right away while its subgroups only appear once the import has finished. A bulk
+    import reads its entities from the source instance given in its configuration when
+    it is created, and creates them once it finishes. Every request is counted per
+    endpoint.
+    """
+
+    def __init__(self, config: MockConfig = None):
+        self.config = config or MockConfig()
+        self.url = None
+        # Instance the repositories were migrated from, referenced in their files
+        self.origin = None
+        self.groups: Dict[int, Dict[str, Any]] = {}
+        self.projects: Dict[int, Dict[str, Any]] = {}
+        self.variables: Dict[Tuple[str, int], Dict[Tuple[str, str], Dict[str, Any]]] = defaultdict(dict)
+        # Finish times of the exports of every group, the latest finished one is served
+        self.group_exports: Dict[int, List[float]] = defaultdict(list)
+        self.project_exports: Dict[int, float] = {}
+        # Projects whose export failed, until a new export is requested
+        self.failed_exports: Set[int] = set()
+        self.imports: Dict[int, float] = {}
+        # Subgroups of imported groups, created once their import time has passed
+        self.group_imports: List[Tuple[float, str]] = []
+        self.bulk_imports: Dict[int, Dict[str, Any]] = {}
+        self.merge_requests: List[Dict[str, Any]] = []
+        self.commits = 0
+        self.requests: Dict[Tuple[str, str], int] = defaultdict(int)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.throttled = 0
+        self._ids = iter(range(1, 10 ** 9))
+        self._lock = threading.RLock()
+        self._window = (0, 0)
+        self._server = None
+
+    # State
+
+    def add_group(self, full_path: str, name: Optional[str] = None) -> Dict[str, Any]:
+        """Create a group and its missing parents"""
+        with self._lock:
+            existing = self.group_by_path(full_path)
+            if existing:
+                return existing
+            parent_path, _, path = full_path.rpartition('/')
+            parent = self.add_group(parent_path) if parent_path else None
+            group = {'id': next(self._ids), 'name': name or path, 'path': path, 'full_path': full_path,
+                     'parent_id': parent['id'] if parent else None}
+            self.groups[group['id']] = group
+            return group
+
+    def add_project(self, namespace: str, path: str, size: Optional[int] = None,
+                    files: Optional[int] = None) -> Dict[str, Any]:
+        with self._lock:
+            group = self.add_group(namespace)
+            project_id = next(self._ids)
+            if size is None:
+                size = int(self.config.archive_mb * 1024 ** 2 * random.Random(project_id).uniform(0.5, 1.5))
+            project = {'id': project_id, 'name': path, 'path': path, 'namespace_id': group['id'],
+                       'default_branch': 'main', 'last_activity_at': '2024-01-01T00:00:00.000Z',
+                       'size': size, 'files': self.config.files if files is None else files}
+            self.projects[project_id] = project
+            return project
+
+    def add_variable(self, kind: str, object_id: int, key: str, value: str, environment_scope: str = '*'):
+        with self._lock:
+            self.variables[(kind, object_id)][(key, environment_scope)] = {
+                'key': key, 'value': value, 'protected': False, 'masked': False,
+                'environment_scope': environment_scope, 'variable_type': 'env_var'}
+
+    def group_by_path(self, full_path: str) -> Optional[Dict[str, Any]]:
+        return next((group for group in self.groups.values() if group['full_path'] == full_path), None)
+
+    def _group(self, reference: str) -> Optional[Dict[str, Any]]:
+        if reference.isdigit():
+            return self.groups.get(int(reference))
+        return self.group_by_path(reference)
+
+    def _project(self, reference: str) -> Optional[Dict[str, Any]]:
+        if reference.isdigit():
+            return self.projects.get(int(reference))
+        return next((project for project in self.projects.values()
+                     if self._project_path(project) == reference), None)
+
+    def _project_path(self, project: Dict[str, Any]) -> str:
+        return f"{self.groups[project['namespace_id']]['full_path']}/{project['path']}"
+
+    def _group_json(self, group: Dict[str, Any]) -> Dict[str, Any]:
+        return {**group, 'web_url': f"{self.url}/groups/{group['full_path']}"}
+
+    def _project_json(self, project: Dict[str, Any], statistics: bool = False) -> Dict[str, Any]:
+        namespace = self.groups[project['namespace_id']]
+        path = self._project_path(project)
+        data = {
+            'id': project['id'], 'name': project['name'], 'path': project['path'],
+            'path_with_namespace': path, 'default_branch': project['default_branch'],
+            'last_activity_at': project['last_activity_at'],
+            'namespace': {'id': namespace['id'], 'full_path': namespace['full_path'], 'kind': 'group'},
+            'http_url_to_repo': f'{self.url}/{path}.git', 'web_url': f'{self.url}/{path}'
+        }
+        if statistics:
+            data['statistics'] = {'storage_size': project['size'] * 2, 'repository_size': project['size'],
+                                  'wiki_size': 0, 'lfs_objects_size': 0, 'uploads_size': 0, 'snippets_size': 0}
+        return data
+
+    def _subtree(self, group: Dict[str, Any]) -> List[Dict[str, Any]]:
+        prefix = group['full_path'] + '/'
+        return [g for g in self.groups.values() if g['full_path'].startswith(prefix)]
+
+    def _group_projects(self, group: Dict[str, Any], include_subgroups: bool) -> List[Dict[str, Any]]:
+        ids = {group['id']}
+        if include_subgroups:
+            ids.update(g['id'] for g in self._subtree(group))
+        return [project for project in self.projects.values() if project['namespace_id'] in ids]
+
+    # Archives
+
+    def _group_archive_header(self, group: Dict[str, Any]) -> bytes:
+        subgroups = sorted(g['full_path'][len(group['full_path']) + 1:] for g in self._subtree(group))
+        return json.dumps({'kind': 'group', 'name': group['name'], 'subgroups': subgroups}).encode() + b'\n'
+
+    def _project_archive_header(self, project: Dict[str, Any]) -> bytes:
+        return json.dumps({'kind': 'project', 'size': project['size'], 'files': project['files'],
+                           'default_branch': project['default_branch']}).encode() + b'\n'
+
+    def _file_content(self, project: Dict[str, Any], file_path: str) -> bytes:
+        origin = self.origin or self.url
+        return (f'# {file_path}\nimage: {urlparse(origin).netloc}/{self._project_path(project)}:latest\n'
+                f'repository: {origin}/{self._project_path(project)}.git\n').encode()
+
+    def _repository_files(self, project: Dict[str, Any]) -> List[str]:
+        return [REPOSITORY_FILES[i % len(REPOSITORY_FILES)] if i < len(REPOSITORY_FILES)
+                else f'config/service-{i}.yml' for i in range(project['files'])]
+
+    # Server
+
+    def start(self, host: str = 'localhost', port: int = 0) -> str:
+        """Serve the mock API from a background thread and return its URL"""
+        self._server = ThreadingHTTPServer((host, port), _handler(self))
+        self._server.daemon_threads = True
+        self.url = f'http://{host}:{self._server.server_address[1]}'
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self.url
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'requests': sum(self.requests.values()),
+                    'endpoints': {f'{method} {path}': count for (method, path), count in sorted(self.requests.items())},
+                    'throttled': self.throttled, 'bytes_sent': self.bytes_sent,
+                    'bytes_received': self.bytes_received}
+
+    def _admit(self) -> Tuple[Dict[str, str], Optional[float]]:
+        """Rate limit headers of a request, and the seconds to wait when it is rejected"""
+        limit = self.config.rate_limit
+        if not limit:
+            return {}, None
+        with self._lock:
+            now = time.time()
+            window, used = self._window
+            if now >= window:
+                window, used = int(now) + 60, 0
+            used += 1
+            self._window = (window, used)
+            headers = {'RateLimit-Limit': str(limit), 'RateLimit-Remaining': str(max(limit - used, 0)),
+                       'RateLimit-Reset': str(window)}
+            if used > limit:
+                self.throttled += 1
+                return headers, window - now
+            return headers, None
+
+    def handle(self, request: '_Request'):
+        """Route a request, returning (status, body, headers) or streaming the response itself"""
+        self._finish_group_imports()
+        segments = [unquote(segment) for segment in request.path[len(API_PREFIX):].strip('/').split('/')]
+        method = request.method
+        resource = segments[0] if segments else ''
+        if resource == 'groups':
+            return self._groups(request, method, segments[1:])
+        if resource == 'projects':
+            return self._projects(request, method, segments[1:])
+        if resource == 'bulk_imports':
+            return self._bulk_imports(request, method, segments[1:])
+        return 404, {'message': '404 Not Found'}
+
+    def _finish_group_imports(self):
+        with self._lock:
+            now = time.monotonic()
+            for ready_at, full_path in sorted(self.group_imports):
+                if ready_at <= now:
+                    self.add_group(full_path)
+            self.group_imports = [item for item in self.group_imports if item[0] > now]
+
+    def _groups(self, request: '_Request', method: str, segments: List[str]):
+        if segments == ['import'] and method == 'POST':
+            fields, archive = request.multipart()
+            header = json.loads(archive.split(b'\n', 1)[0])
+            parent = self.groups.get(int(fields['parent_id'])) if fields.get('parent_id') else None
+            full_path = f"{parent['full_path']}/{fields['path']}" if parent else fields['path']
+            with self._lock:
+                if self.group_by_path(full_path):
+                    return 400, {'message': 'Group has already been taken'}
+                group = self.add_group(full_path, fields.get('name') or header['name'])
+                ready_at = time.monotonic() + self.config.import_seconds
+                self.group_imports.extend((ready_at, f'{full_path}/{subgroup}') for subgroup in header['subgroups'])
+            return 201, {'id': group['id'], 'name': group['name'], 'full_path': full_path,
+                         'import_status': 'finished'}
+        group = self._group(segments[0]) if segments else None
+        if group is None:
+            return 404, {'message': '404 Group Not Found'}
+        rest = segments[1:]
+        if not rest:
+            if method == 'PUT':
+                with self._lock:
+                    group['name'] = request.json().get('name', group['name'])
+            return 200, self._group_json(group)
+        if rest == ['projects']:
+            projects = self._group_projects(group, request.flag('include_subgroups'))
+            if request.query.get('order_by') == 'last_activity_at':
+                projects.sort(key=lambda p: (p['last_activity_at'], p['id']),
+                              reverse=request.query.get('sort') == 'desc')
+            else:
+                projects.sort(key=lambda p: p['id'], reverse=request.query.get('sort') == 'desc')
+            statistics = request.flag('statistics')
+            return request.paginate([self._project_json(p, statistics) for p in projects])
+        if rest == ['descendant_groups']:
+            return request.paginate([self._group_json(g) for g in sorted(self._subtree(group), key=lambda g: g['id'])])
+        if rest == ['export'] and method == 'POST':
+            with self._lock:
+                self.group_exports[group['id']].append(time.monotonic() + self.config.export_seconds)
+            return 202, {'message': '202 Accepted'}
+        if rest == ['export', 'download']:
+            now = time.monotonic()
+            ready_at = max((ready_at for ready_at in self.group_exports[group['id']] if ready_at <= now), default=None)
+            if ready_at is None:
+                return 404, {'message': '404 Not Found'}
+            header = self._group_archive_header(group)
+            exported_at = time.time() - (time.monotonic() - ready_at)
+            return request.stream_archive(header, len(header) + 1024,
+                                          {'Last-Modified': formatdate(exported_at, usegmt=True)})
+        if rest[0] == 'variables':
+            return self._variables(request, method, ('group', group['id']), rest[1:])
+        return 404, {'message': '404 Not Found'}
+
+    def _projects(self, request: '_Request', method: str, segments: List[str]):
+        if segments == ['import'] and method == 'POST':
+            fields, archive = request.multipart()
+            header = json.loads(archive.split(b'\n', 1)[0])
+            with self._lock:
+                namespace = self.group_by_path(fields['namespace'])
+                if namespace is None:
+                    return 400, {'message': f"Namespace {fields['namespace']} not found"}
+                if self._project(f"{fields['namespace']}/{fields['path']}"):
+                    return 400, {'message': 'Project namespace name has already been taken'}
+                project = self.add_project(fields['namespace'], fields['path'], header['size'], header['files'])
+                project['name'] = fields.get('name') or fields['path']
+                self.imports[project['id']] = time.monotonic() + self.config.import_seconds
+            return 201, {'id': project['id'], 'name': project['name'], 'import_status': 'scheduled'}
+        project = self._project(segments[0]) if segments else None
+        if project is None:
+            return 404, {'message': '404 Project Not Found'}
+        rest = segments[1:]
+        if not rest:
+            return 200, self._project_json(project, request.flag('statistics'))
+        if rest == ['export']:
+            if method == 'POST':
+                with self._lock:
+                    self.project_exports[project['id']] = time.monotonic() + self.config.export_seconds
+                    self.failed_exports.discard(project['id'])
+                return 202, {'message': '202 Accepted'}
+            ready_at = self.project_exports.get(project['id'])
+            status = 'none' if ready_at is None else 'finished' if time.monotonic() >= ready_at else 'started'
+            if project['id'] in self.failed_exports:
+                status = 'failed'
+            return 200, {'id': project['id'], 'export_status': status}
+        if rest == ['export', 'download']:
+            ready_at = self.project_exports.get(project['id'])
+            if ready_at is None or time.monotonic() < ready_at or project['id'] in self.failed_exports:
+                return 404, {'message': '404 Not Found'}
+            exported_at = time.time() - (time.monotonic() - ready_at)
+            return request.stream_archive(self._project_archive_header(project), project['size'],
+                                          {'Last-Modified': formatdate(exported_at, usegmt=True)})
+        if rest == ['import']:
+            ready_at = self.imports.get(project['id'])
+            status = 'none' if ready_at is None else 'finished' if time.monotonic() >= ready_at else 'started'
+            return 200, {'id': project['id'], 'import_status': status}
+        if rest[0] == 'variables':
+            return self._variables(request, method, ('project', project['id']), rest[1:])
+        if rest == ['repository', 'tree']:
+            return request.paginate([{'id': f'{i:040x}', 'name': path.rsplit('/', 1)[-1], 'type': 'blob',
+                                      'path': path, 'mode': '100644'}
+                                     for i, path in enumerate(self._repository_files(project))])
+        if rest[:2] == ['repository', 'files'] and rest[-1] == 'raw':
+            file_path = '/'.join(rest[2:-1])
+            if file_path not in self._repository_files(project):
+                return 404, {'message': '404 File Not Found'}
+            return 200, self._file_content(project, file_path), {'Content-Type': 'text/plain'}
+        if rest == ['repository', 'commits'] and method == 'POST':
+            with self._lock:
+                self.commits += 1
+            return 201, {'id': f'{self.commits:040x}', 'title': request.json().get('commit_message', '')}
+        if rest == ['merge_requests'] and method == 'POST':
+            with self._lock:
+                iid = len(self.merge_requests) + 1
+                self.merge_requests.append({'project_id': project['id'], **request.json()})
+            return 201, {'iid': iid, 'web_url': f'{self.url}/{self._project_path(project)}/-/merge_requests/{iid}'}
+        return 404, {'message': '404 Not Found'}
+
+    def _bulk_imports(self, request: '_Request', method: str, segments: List[str]):
+        if not segments and method == 'POST':
+            data = request.json()
+            source = _SourceInstance(data['configuration']['url'])
+            entities = []
+            try:
+                for entity in data['entities']:
+                    entities.extend(source.entities(entity))
+            except OSError as e:
+                return 400, {'message': f'Unable to reach the source instance: {e}'}
+            with self._lock:
+                bulk_import = {'id': next(self._ids), 'status': 'started', 'entities': [],
+                               'ready_at': time.monotonic() + self.config.bulk_import_seconds}
+                for entity in entities:
+                    bulk_import['entities'].append({**entity, 'id': next(self._ids),
+                                                    'bulk_import_id': bulk_import['id'], 'status': 'started',
+                                                    'failures': []})
+                self.bulk_imports[bulk_import['id']] = bulk_import
+            return 201, self._bulk_import_json(bulk_import)
+        bulk_import = self.bulk_imports.get(int(segments[0])) if segments and segments[0].isdigit() else None
+        if bulk_import is None:
+            return 404, {'message': '404 Bulk Import Not Found'}
+        self._finish_bulk_import(bulk_import)
+        rest = segments[1:]
+        if not rest:
+            return 200, self._bulk_import_json(bulk_import)
+        if rest == ['entities']:
+            return request.paginate([self._entity_json(entity) for entity in bulk_import['entities']])
+        if len(rest) == 3 and rest[0] == 'entities' and rest[2] == 'failures':
+            entity = next((entity for entity in bulk_import['entities'] if str(entity['id']) == rest[1]), None)
+            if entity is None:
+                return 404, {'message': '404 Entity Not Found'}
+            return request.paginate(entity['failures'])
+        return 404, {'message': '404 Not Found'}
+
+    def _bulk_import_json(self, bulk_import: Dict[str, Any]) -> Dict[str, Any]:
+        return {'id': bulk_import['id'], 'status': bulk_import['status'], 'source_type': 'gitlab'}
+
+    def _entity_json(self, entity: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: entity[key] for key in ('id', 'bulk_import_id', 'status', 'source_type', 'source_full_path',
+                                             'destination_full_path', 'destination_namespace',
+                                             'destination_slug')}
+
+    def _fails(self, source_full_path: str) -> bool:
+        rate = self.config.bulk_import_failure_rate
+        return bool(rate) and random.Random(zlib.crc32(source_full_path.encode())).random() < rate
+
+    def _finish_bulk_import(self, bulk_import: Dict[str, Any]):
+        """Create the entities of a bulk import once its duration has elapsed"""
+        with self._lock:
+            if bulk_import['status'] != 'started' or time.monotonic() < bulk_import['ready_at']:
+                return
+            for entity in bulk_import['entities']:
+                error = None
+                if self._fails(entity['source_full_path']):
+                    error = 'Mock failure'
+                elif entity['destination_namespace'] and not self.group_by_path(entity['destination_namespace']):
+                    error = f"Destination namespace {entity['destination_namespace']} not found"
+                elif entity['source_type'] == 'group_entity':
+                    if self.group_by_path(entity['destination_full_path']):
+                        error = 'Group path has already been taken'
+                    else:
+                        self.add_group(entity['destination_full_path'], entity['name'])
+                elif self._project(entity['destination_full_path']):
+                    error = 'Project path has already been taken'
+                else:
+                    project = self.add_project(entity['destination_namespace'], entity['destination_slug'],
+                                               entity['size'])
+                    project['name'] = entity['name']
+                if error:
+                    entity['status'] = 'failed'
+                    entity['failures'].append({'relation': entity['source_type'].replace('_entity', ''),
+                                               'exception_class': 'BulkImports::Error',
+                                               'exception_message': error,
+                                               'correlation_id_value': str(entity['id'])})
+                else:
+                    entity['status'] = 'finished'
+            failed = all(entity['status'] == 'failed' for entity in bulk_import['entities'])
+            bulk_import['status'] = 'failed' if failed else 'finished'
+
+    def _variables(self, request: '_Request', method: str, owner: Tuple[str, int], rest: List[str]):
+        with self._lock:
+            variables = self.variables[owner]
+            if not rest:
+                if method == 'POST':
+                    data = request.json()
+                    key = (data['key'], data.get('environment_scope', '*'))
+                    if key in variables:
+                        return 400, {'message': {'key': [f"({data['key']}) has already been taken"]}}
+                    self.add_variable(owner[0], owner[1], data['key'], data.get('value', ''), key[1])
+                    variables[key].update(protected=data.get('protected', False), masked=data.get('masked', False))
+                    return 201, variables[key]
+                return request.paginate(list(variables.values()))
+            scope = request.query.get('filter[environment_scope]', '*')
+            variable = variables.get((rest[0], scope))
+            if variable is None:
+                return 404, {'message': '404 Variable Not Found'}
+            if method == 'DELETE':
+                del variables[(rest[0], scope)]
+                return 204, None
+            if method == 'PUT':
+                variable.update({k: v for k, v in request.json().items() if k in variable})
+            return 200, variable
+
+
+class _SourceInstance:
+    """API client the mock uses to read bulk import entities from the source instance"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip('/')
+
+    def _get(self, path: str, query: Optional[Dict[str, Any]] = None) -> Tuple[Any, Dict[str, str]]:
+        url = f"{self.url}{API_PREFIX}{path}{'?' + urlencode(query) if query else ''}"
+        with urllib.request.urlopen(url, timeout=30) as response:
+            return json.load(response), dict(response.headers)
+
+    def _list(self, path: str) -> List[Dict[str, Any]]:
+        items, page = [], 1
+        while True:
+            batch, headers = self._get(path, {'per_page': 100, 'page': page})
+            items.extend(batch)
+            if not headers.get('X-Next-Page'):
+                return items
+            page += 1
+
+    def entities(self, entity: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """The requested entity followed by the entities of its subgroups, read from the source"""
+        source_path = entity['source_full_path']
+        namespace = entity.get('destination_namespace') or ''
+        destination = f"{namespace}/{entity['destination_slug']}".lstrip('/')
+        base = {'source_type': entity['source_type'], 'source_full_path': source_path,
+                'destination_namespace': namespace, 'destination_slug': entity['destination_slug'],
+                'destination_full_path': destination}
+        if entity['source_type'] == 'project_entity':
+            project, _ = self._get(f"/projects/{quote(source_path, safe='')}", {'statistics': 'true'})
+            return [{**base, 'name': project['name'], 'size': project['statistics']['repository_size']}]
+
+        group, _ = self._get(f"/groups/{quote(source_path, safe='')}")
+        entities = [{**base, 'name': group['name']}]
+        subgroups = self._list(f"/groups/{group['id']}/descendant_groups")
+        for subgroup in sorted(subgroups, key=lambda g: g['full_path']):
+            relative = subgroup['full_path'][len(source_path) + 1:]
+            parent, _, slug = f'{destination}/{relative}'.rpartition('/')
+            entities.append({**base, 'name': subgroup['name'], 'source_full_path': subgroup['full_path'],
+                             'destination_namespace': parent, 'destination_slug': slug,
+                             'destination_full_path': f'{parent}/{slug}'})
+        return entities
+
+
+class _Request:
+    def __init__(self, handler: BaseHTTPRequestHandler, mock: MockGitLab):
+        self.handler = handler
+        self.mock = mock
+        self.method = handler.command
+        parsed = urlparse(handler.path)
+        self.path = parsed.path
+        self.query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        self._body = None
+
+    def body(self) -> bytes:
+        if self._body is None:
+            length = int(self.handler.headers.get('Content-Length') or 0)
+            chunks = []
+            while length:
+                chunk = self.handler.rfile.read(min(length, STREAM_CHUNK))
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                length -= len(chunk)
+            self._body = b''.join(chunks)
+            with self.mock._lock:
+                self.mock.bytes_received += len(self._body)
+        return self._body
+
+    def json(self) -> Dict[str, Any]:
+        body = self.body()
+        if not body:
+            return {}
+        if 'json' in self.handler.headers.get('Content-Type', ''):
+            return json.loads(body)
+        return {key: values[-1] for key, values in parse_qs(body.decode()).items()}
+
+    def multipart(self) -> Tuple[Dict[str, str], bytes]:
+        """Form fields and uploaded file of a multipart request"""
+        message = BytesParser().parsebytes(
+            f"Content-Type: {self.handler.headers['Content-Type']}\r\n\r\n".encode() + self.body())
+        fields, archive = {}, b''
+        for part in message.get_payload():
+            name = part.get_param('name', header='content-disposition')
+            if part.get_filename():
+                archive = part.get_payload(decode=True)
+            else:
+                fields[name] = part.get_payload(decode=True).decode()
+        return fields, archive
+
+    def flag(self, name: str) -> bool:
+        return self.query.get(name, '').lower() == 'true'
+
+    def paginate(self, items: List[Any]):
+        """Offset pagination with the headers and `next` link python-gitlab follows"""
+        per_page = min(int(self.query.get('per_page', 20)), 100)
+        page = max(int(self.query.get('page', 1)), 1)
+        total_pages = max((len(items) + per_page - 1) // per_page, 1)
+        headers = {'X-Total': str(len(items)), 'X-Total-Pages': str(total_pages), 'X-Page': str(page),
+                   'X-Per-Page': str(per_page)}
+        if page < total_pages:
+            query = {**self.query, 'page': page + 1, 'per_page': per_page}
+            headers['X-Next-Page'] = str(page + 1)
+            headers['Link'] = f'<{self.mock.url}{self.path}?{urlencode(query)}>; rel="next"'
+        return 200, items[(page - 1) * per_page:page * per_page], headers
+
+    def stream_archive(self, header: bytes, size: int, headers: Optional[Dict[str, str]] = None):
+        """Send an archive of `size` bytes starting with `header`, honouring Range and If-Range requests"""
+        size = max(size, len(header))
+        start = 0
+        status = 200
+        headers = {'Content-Type': 'application/octet-stream', 'Accept-Ranges': 'bytes', **(headers or {})}
+        range_header = self.handler.headers.get('Range')
+        if_range = self.handler.headers.get('If-Range')
+        if if_range is not None and if_range not in (headers.get('ETag'), headers.get('Last-Modified')):
+            # The file changed since the validator was taken, send it whole
+            range_header = None
+        if range_header and range_header.startswith('bytes='):
+            start = int(range_header[6:].split('-', 1)[0] or 0)
+            if start >= size:
+                return 416, {'message': '416 Range Not Satisfiable'}, {'Content-Range': f'bytes */{size}'}
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{size - 1}/{size}'
+        headers['Content-Length'] = str(size - start)
+        self.handler.send_response(status)
+        for name, value in {**headers, **self.handler.extra_headers}.items():
+            self.handler.send_header(name, value)
+        self.handler.end_headers()
+        if self.method == 'HEAD':
+            return None
+
+        bandwidth = self.mock.config.download_mbps * 1024 ** 2
+        padding = bytes(STREAM_CHUNK)
+        position = start
+        while position < size:
+            end = min(position + STREAM_CHUNK, size)
+            if position < len(header):
+                chunk = header[position:end] + padding[:max(end - len(header), 0)]
+            else:
+                chunk = padding[:end - position]
+            self.handler.wfile.write(chunk)
+            position = end
+            if bandwidth:
+                time.sleep(len(chunk) / bandwidth)
+        with self.mock._lock:
+            self.mock.bytes_sent += size - start
+        return None
+
+
+def _handler(mock: MockGitLab):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        extra_headers: Dict[str, str] = {}
+
+        def log_message(self, *args):
+            pass
+
+        def _serve(self):
+            request = _Request(self, mock)
+            with mock._lock:
+                mock.requests[(self.command, endpoint(request.path))] += 1
+            if self.command in ('POST', 'PUT'):
+                request.body()
+            if mock.config.latency:
+                time.sleep(mock.config.latency)
+            self.extra_headers, wait = mock._admit()
+            if wait is not None:
+                self._reply(429, {'message': '429 Too Many Requests'}, {'Retry-After': str(max(int(wait), 1))})
+                return
+            response = mock.handle(request)
+            if response is not None:
+                self._reply(*response)
+
+        def _reply(self, status: int, body: Any, headers: Optional[Dict[str, str]] = None):
+            headers = {**(headers or {}), **self.extra_headers}
+            if isinstance(body, bytes):
+                data = body
+            else:
+                data = b'' if body is None else json.dumps(body).encode()
+                headers.setdefault('Content-Type', 'application/json')
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            if self.command != 'HEAD':
+                self.wfile.write(data)
+                with mock._lock:
+                    mock.bytes_sent += len(data)
+
+        do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = _serve
+
+    return Handler
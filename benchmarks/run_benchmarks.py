@@ -0,0 +1,199 @@
+import os
+import sys
+import json
+import time
+import shlex
+import shutil
+import logging
+import tempfile
+import threading
+import subprocess
+import typer
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List
+from benchmarks.mock_gitlab import MockGitLab, MockConfig
+from migration.mirror_cache import directory_size
+
+GLARE = Path(__file__).resolve().parent.parent / 'glare.py'
+REPORTS_PATH = 'reports'
+SCENARIOS = ('migrate-projects', 'migrate-secrets', 'replace-repositories', 'migrate-all', 'migrate-all-direct')
+# Scenarios running a command with extra options, keyed by scenario name
+SCENARIO_COMMANDS = {'migrate-all-direct': ('migrate-all', ['--engine', 'direct-transfer'])}
+SOURCE_GROUP = 'bench'
+DEST_PARENT = 'target'
+PROJECTS_PER_GROUP = 25
+DISK_SAMPLE_SECONDS = 0.2
+
+app = typer.Typer()
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def populate_source(source: MockGitLab, projects: int, variables: int):
+    """Source group with `projects` projects spread over subgroups, every group and project holding `variables` variables"""
+    source.add_group(SOURCE_GROUP)
+    for index in range(projects):
+        source.add_project(f'{SOURCE_GROUP}/team-{index // PROJECTS_PER_GROUP}', f'service-{index}')
+    owners = [('group', group_id) for group_id in source.groups] + \
+             [('project', project_id) for project_id in source.projects]
+    for kind, object_id in owners:
+        for index in range(variables):
+            source.add_variable(kind, object_id, f'VAR_{index}', f'{source.url}/{SOURCE_GROUP}/registry-{index}')
+
+def populate_destination(source: MockGitLab, destination: MockGitLab, scenario: str):
+    """
+    Destination in the state the scenario starts from: the parent group only for
+    migrate-all, the migrated groups for migrate-projects, groups and projects otherwise.
+    """
+    destination.origin = source.url
+    destination.add_group(DEST_PARENT)
+    if scenario.startswith('migrate-all'):
+        return
+    for group in sorted(source.groups.values(), key=lambda group: group['full_path']):
+        destination.add_group(f"{DEST_PARENT}/{group['full_path']}")
+    if scenario == 'migrate-projects':
+        return
+    for project in source.projects.values():
+        namespace = source.groups[project['namespace_id']]['full_path']
+        destination.add_project(f'{DEST_PARENT}/{namespace}', project['path'], project['size'], project['files'])
+
+def command(scenario: str, extra_args: List[str]) -> List[str]:
+    name, scenario_args = SCENARIO_COMMANDS.get(scenario, (scenario, []))
+    return [name, '--source-path', SOURCE_GROUP, '--dest-path', DEST_PARENT, *scenario_args, *extra_args]
+
+def write_env_file(path: str, source: MockGitLab, destination: MockGitLab):
+    source_host = source.url.split('://', 1)[1]
+    dest_host = destination.url.split('://', 1)[1]
+    with open(path, 'w') as f:
+        f.write(f'GITLAB_SOURCE_URL={source.url}\nGITLAB_SOURCE_TOKEN=benchmark\n'
+                f'GITLAB_TARGET_URL={destination.url}\nGITLAB_TARGET_TOKEN=benchmark\n'
+                f"REPLACEMENTS={{'{source_host}': '{dest_host}'}}\n")
+
+def run_glare(workdir: str, args: List[str]) -> Dict[str, Any]:
+    """
+    Run glare.py in `workdir` and measure its wall time, peak memory (of the process
+    and the git processes it waited for) and the peak size of its working directory.
+    """
+    peak_disk = 0
+    finished = threading.Event()
+
+    def sample_disk():
+        nonlocal peak_disk
+        while not finished.is_set():
+            peak_disk = max(peak_disk, directory_size(workdir))
+            finished.wait(DISK_SAMPLE_SECONDS)
+
+    sampler = threading.Thread(target=sample_disk, daemon=True)
+    with open(os.path.join(workdir, 'glare.log'), 'w') as log:
+        start = time.monotonic()
+        process = subprocess.Popen([sys.executable, str(GLARE), *args], cwd=workdir, stdout=log,
+                                   stderr=subprocess.STDOUT)
+        sampler.start()
+        _, status, usage = os.wait4(process.pid, 0)
+        seconds = time.monotonic() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    finished.set()
+    sampler.join()
+    return {
+        'exit_code': process.returncode,
+        'seconds': round(seconds, 2),
+        'peak_rss_mb': round(usage.ru_maxrss / 1024, 1),
+        'peak_disk_mb': round(max(peak_disk, directory_size(workdir)) / 1024 ** 2, 1)
+    }
+
+def run_scenario(scenario: str, projects: int, config: MockConfig, variables: int,
+                 global_args: List[str], extra_args: List[str], keep: bool) -> Dict[str, Any]:
+    source = MockGitLab(config)
+    destination = MockGitLab(config)
+    source.start()
+    destination.start()
+    workdir = tempfile.mkdtemp(prefix=f'glare-bench-{scenario}-{projects}-')
+    result = None
+    try:
+        populate_source(source, projects, variables)
+        populate_destination(source, destination, scenario)
+        env_file = os.path.join(workdir, 'benchmark.env')
+        write_env_file(env_file, source, destination)
+        logging.info(f'Running {scenario} with {projects} projects in {workdir}')
+        result = run_glare(workdir, ['--env-file', env_file, *global_args, *command(scenario, extra_args)])
+        source_stats = source.stats()
+        dest_stats = destination.stats()
+        result.update({
+            'scenario': scenario,
+            'projects': projects,
+            'api_calls': source_stats['requests'] + dest_stats['requests'],
+            'throttled': source_stats['throttled'] + dest_stats['throttled'],
+            'source': source_stats,
+            'destination': dest_stats,
+            'imported_projects': len(destination.projects) if scenario in ('migrate-projects', 'migrate-all',
+                                                                           'migrate-all-direct') else None,
+            'merge_requests': len(destination.merge_requests)
+        })
+        if result['exit_code']:
+            result['log'] = os.path.join(workdir, 'glare.log')
+            logging.error(f"{scenario} with {projects} projects failed, see {result['log']}")
+        return result
+    finally:
+        source.stop()
+        destination.stop()
+        # The working directory of a failed run is kept with its log
+        if not keep and result is not None and not result['exit_code']:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+def format_results(results: List[Dict[str, Any]]) -> str:
+    lines = [f"{'scenario':<22}  {'projects':>8}  {'seconds':>9}  {'API calls':>9}  {'429':>5}  "
+             f"{'peak RSS MB':>11}  {'peak disk MB':>12}  status"]
+    for result in results:
+        lines.append(f"{result['scenario']:<22}  {result['projects']:>8}  {result['seconds']:>9.2f}  "
+                     f"{result['api_calls']:>9}  {result['throttled']:>5}  {result['peak_rss_mb']:>11.1f}  "
+                     f"{result['peak_disk_mb']:>12.1f}  {'ok' if not result['exit_code'] else 'failed'}")
+    return '\n'.join(lines)
+
+@app.command()
+def main(
+    scenario: List[str] = typer.Option(list(SCENARIOS), help="Scenarios to run (repeat the option for several)"),
+    projects: List[int] = typer.Option([10, 100, 1000], help="Number of projects of the source group (repeat the option for several scales)"),
+    latency_ms: float = typer.Option(20, help="Milliseconds added to every mock API response"),
+    export_seconds: float = typer.Option(1, help="Seconds a group or project export takes to finish"),
+    import_seconds: float = typer.Option(1, help="Seconds a project import takes to finish"),
+    archive_mb: float = typer.Option(1, help="Average size in MB of a project export archive"),
+    download_mbps: float = typer.Option(0, help="Download bandwidth of export archives in MB/s (0 = unlimited)"),
+    rate_limit: int = typer.Option(0, help="Requests per minute allowed by each mock instance before answering 429 (0 = unlimited)"),
+    files: int = typer.Option(5, help="Number of files of every repository"),
+    bulk_import_seconds: float = typer.Option(1, help="Seconds a direct transfer (bulk import) takes to finish"),
+    bulk_import_failure_rate: float = typer.Option(0, help="Fraction of direct transfer entities that fail"),
+    variables: int = typer.Option(3, help="Number of variables of every group and project"),
+    global_args: str = typer.Option("", help="Extra glare.py options given before the command, e.g. '--source-rate 0'"),
+    glare_args: str = typer.Option("", help="Extra options of the benchmarked command, e.g. '--pipeline --import-workers 4'"),
+    output: str = typer.Option(None, help="Path of the JSON results (default reports/benchmark-<timestamp>.json)"),
+    keep: bool = typer.Option(False, help="Keep the working directories of the runs")
+):
+    """Benchmark glare.py commands against local mock GitLab instances"""
+    for name in scenario:
+        if name not in SCENARIOS:
+            raise typer.BadParameter(f"Unknown scenario: {name}, expected one of {', '.join(SCENARIOS)}")
+    config = MockConfig(latency=latency_ms / 1000, export_seconds=export_seconds, import_seconds=import_seconds,
+                        archive_mb=archive_mb, download_mbps=download_mbps, rate_limit=rate_limit, files=files,
+                        bulk_import_seconds=bulk_import_seconds, bulk_import_failure_rate=bulk_import_failure_rate)
+
+    results = []
+    for count in projects:
+        for name in scenario:
+            results.append(run_scenario(name, count, config, variables, shlex.split(global_args),
+                                        shlex.split(glare_args), keep))
+            typer.echo(format_results(results[-1:]).splitlines()[-1])
+
+    typer.echo(format_results(results))
+    output = output or os.path.join(REPORTS_PATH, f"benchmark-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({'config': vars(config), 'variables': variables, 'global_args': global_args,
+                   'glare_args': glare_args, 'results': results}, f, indent=2)
+    typer.echo(f"Results written to {output}")
+    if any(result['exit_code'] for result in results):
+        raise typer.Exit(1)
+
+
+if __name__ == '__main__':
+    app()
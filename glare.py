@@ -1,31 +1,125 @@
 import os
 import typer
-import gitlab
-from dotenv import load_dotenv
 import logging
 
-from migration.repository_manager import repositories_replacement
-from migration.group_manager import export_group, import_group, get_all_projects, get_group_id_by_path
-from migration.projects_manager import export_projects, import_projects
-from migration.secrets_manager import migrate_group_variables, migrate_project_variables
+# Migration modules and python-gitlab are imported by the commands that need them,
+# so that the CLI starts fast
+from migration.inventory import DEFAULT_TTL
 
 app = typer.Typer()
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def get_gitlab_clients():
-    """Initialize GitLab clients from environment variables"""
-    load_dotenv(override=True)
+settings = {'inventory_ttl': DEFAULT_TTL, 'resume': False, 'source_rate': None, 'dest_rate': None, 'env_file': None}
+_inventory = None
+_journal = None
+_clients = None
+
+ENGINES = ('export', 'direct-transfer')
+
+@app.callback()
+def main(
+    ctx: typer.Context,
+    inventory_ttl: int = typer.Option(DEFAULT_TTL, help="Seconds during which cached group/project listings are reused without revalidation (0 disables the inventory)"),
+    resume: bool = typer.Option(False, help="Skip work recorded as done in the journal of a previous run"),
+    source_rate: float = typer.Option(None, help="Maximum requests per second to the source GitLab (default 20, 0 = unlimited)"),
+    dest_rate: float = typer.Option(None, help="Maximum requests per second to the destination GitLab (default 20, 0 = unlimited)"),
+    telemetry: bool = typer.Option(True, help="Write a Chrome trace and Prometheus metrics of the run to the reports directory"),
+    trace: str = typer.Option(None, help="Path of the Chrome trace (default reports/trace-<timestamp>.json)"),
+    metrics: str = typer.Option(None, help="Path of the Prometheus metrics (default reports/metrics-<timestamp>.prom)"),
+    env_file: str = typer.Option(None, help="Configuration file to load instead of the .env file next to glare.py")
+):
+    """GitLab Automated Replication & Export"""
+    settings['inventory_ttl'] = inventory_ttl
+    settings['resume'] = resume
+    settings['source_rate'] = source_rate
+    settings['dest_rate'] = dest_rate
+    settings['env_file'] = env_file
+    if telemetry and ctx.invoked_subcommand:
+        from migration.telemetry import span
+
+        ctx.call_on_close(lambda: write_telemetry(trace, metrics))
+        ctx.with_resource(span(ctx.invoked_subcommand))
+
+def write_telemetry(trace: str = None, metrics: str = None):
+    """Write the spans and API counters of the run once the command is done"""
+    from datetime import datetime
+    from migration.telemetry import get_telemetry
+
+    telemetry = get_telemetry()
+    summary = telemetry.summary()
+    if not summary['requests']:
+        # Usage errors and --help
+        return
+    timestamp = f'{datetime.now():%Y%m%d-%H%M%S}'
+    trace = trace or os.path.join('reports', f'trace-{timestamp}.json')
+    metrics = metrics or os.path.join('reports', f'metrics-{timestamp}.prom')
+    telemetry.write_chrome_trace(trace)
+    telemetry.write_prometheus(metrics)
+    logging.info(f"{summary['requests']} API calls, {summary['sent'] / 1024 ** 2:.1f} MB sent, "
+                 f"{summary['received'] / 1024 ** 2:.1f} MB received. Trace written to {trace}, "
+                 f"metrics to {metrics}")
+
+def get_inventory():
+    """Open the local inventory once per run"""
+    from migration.inventory import Inventory
+
+    global _inventory
+    if _inventory is None:
+        _inventory = Inventory(ttl=settings['inventory_ttl'])
+    return _inventory
+
+def get_journal():
+    """Open the migration journal once per run, loading the previous one with --resume"""
+    from migration.journal import Journal
+
+    global _journal
+    if _journal is None:
+        _journal = Journal(resume=settings['resume'])
+    return _journal
+
+def get_gitlab_clients(workers: int = 1):
+    """Initialize GitLab clients from environment variables
+
+    Clients are created once per process and shared by every command, so `migrate-all`
+    keeps the same keep-alive connections through all its steps. Each client gets its
+    own throttled session, so source and destination are rate limited separately, with
+    a connection pool sized for `workers` threads.
+    """
+    global _clients
+    if _clients is not None:
+        return _clients
+
+    import gitlab
+    from dotenv import load_dotenv
+    from migration.transport import create_session
+
+    load_dotenv(settings['env_file'], override=True)
     
     gl_source = gitlab.Gitlab(
         url=os.getenv("GITLAB_SOURCE_URL"),
-        private_token=os.getenv("GITLAB_SOURCE_TOKEN")
+        private_token=os.getenv("GITLAB_SOURCE_TOKEN"),
+        session=create_session(settings['source_rate'], workers)
     )
     gl_destination = gitlab.Gitlab(
         url=os.getenv("GITLAB_TARGET_URL"),
-        private_token=os.getenv("GITLAB_TARGET_TOKEN")
+        private_token=os.getenv("GITLAB_TARGET_TOKEN"),
+        session=create_session(settings['dest_rate'], workers)
     )
-    return gl_source, gl_destination
+    _clients = (gl_source, gl_destination)
+    return _clients
+
+def get_mirror_cache(max_gb: float):
+    """Open the mirror cache, None when it is disabled"""
+    if not max_gb:
+        return None
+    from migration.mirror_cache import MirrorCache
+
+    return MirrorCache(max_bytes=int(max_gb * 1024 ** 3))
+
+def check_engine(engine: str):
+    if engine not in ENGINES:
+        raise typer.BadParameter(f"Unknown engine: {engine}, expected one of {', '.join(ENGINES)}")
 
 @app.command()
 def migrate_group(
@@ -33,18 +127,46 @@ def migrate_group(
     dest_path: str = typer.Option(None, help="Destination parent group path"),
     new_name: str = typer.Option(None, help="New group name (optional)"),
     new_path: str = typer.Option(None, help="New group path (optional)"),
-    top_level_group: bool = typer.Option(False, help="Create top level group")
+    top_level_group: bool = typer.Option(False, help="Create top level group"),
+    engine: str = typer.Option("export", help="'export' moves export archives through this machine, 'direct-transfer' lets the destination pull from the source (bulk import)")
 ):
     """Export group from source and import to destination"""
+    from migration.group_manager import (export_group, import_group, get_group_id_by_path, group_export_file,
+                                         subgroup_paths, wait_for_group_tree)
+
+    check_engine(engine)
     gl_source, gl_destination = get_gitlab_clients()
-    
+    journal = get_journal()
+    group_key = f"group:{source_path}"
+    if journal.is_done(f"{group_key}:import"):
+        typer.echo(f"Group {source_path} already migrated, skipping")
+        return
+    dest_group_path = dest_path if top_level_group else f"{dest_path}/{new_path or source_path.split('/')[-1]}"
+
+    if engine == "direct-transfer":
+        from migration.direct_transfer import migrate_group_direct
+
+        namespace, _, slug = dest_group_path.rpartition('/')
+        with journal.step(f"{group_key}:import"):
+            migrate_group_direct(gl_source, gl_destination, source_path, namespace, slug, new_name)
+        get_inventory().invalidate(gl_destination.url, dest_group_path)
+        typer.echo("Group migration completed successfully")
+        return
+
     source_id = get_group_id_by_path(gl_source, source_path)
-    export_group(gl_source, source_id)
-    if top_level_group:
-        import_group(gl_destination, gl_source, source_id, None, new_name, dest_path)
+    if journal.is_done(f"{group_key}:export") and os.path.exists(group_export_file(source_id)):
+        logging.info(f"Export of group {source_path} already downloaded, skipping export")
     else:
-        dest_id = get_group_id_by_path(gl_destination, dest_path)
-        import_group(gl_destination, gl_source, source_id, dest_id, new_name, new_path)
+        with journal.step(f"{group_key}:export"):
+            export_group(gl_source, source_id)
+    with journal.step(f"{group_key}:import"):
+        if top_level_group:
+            import_group(gl_destination, gl_source, source_id, None, new_name, dest_path)
+        else:
+            dest_id = get_group_id_by_path(gl_destination, dest_path)
+            import_group(gl_destination, gl_source, source_id, dest_id, new_name, new_path)
+        wait_for_group_tree(gl_destination, dest_group_path, subgroup_paths(gl_source, source_id))
+    get_inventory().invalidate(gl_destination.url, dest_group_path)
     typer.echo("Group migration completed successfully")
 
 @app.command()
@@ -52,26 +174,70 @@ def migrate_projects(
     source_path: str = typer.Option(..., help="Source group path"),
     dest_path: str = typer.Option(..., help="Destination group path"),
     new_path: str = typer.Option(None, help="New group path (optional, defaults to source group path)"),
-    top_level_group: bool = typer.Option(False, help="Create top level group")
+    top_level_group: bool = typer.Option(False, help="Create top level group"),
+    export_workers: int = typer.Option(4, help="Number of project exports processed concurrently"),
+    pipeline: bool = typer.Option(False, help="Import each project as soon as its export is downloaded"),
+    import_workers: int = typer.Option(2, help="Number of concurrent project imports in pipeline mode"),
+    max_staged_gb: float = typer.Option(0, help="Pause exports while staged archives exceed this size in GB (0 = unlimited, pipeline mode)"),
+    stream: bool = typer.Option(False, help="Stream every export straight into its import instead of staging archives under exports/"),
+    spool_mb: int = typer.Option(256, help="Size in MB up to which a streamed archive is kept in memory before spilling to a temporary file"),
+    download_chunk_mb: int = typer.Option(8, help="Size in MB of the chunks export downloads are read and resumed in"),
+    export_cache_gb: float = typer.Option(0, help="Keep export archives of up to this many GB in cache/exports and reuse them while projects are unchanged (0 = disabled)"),
+    largest_first: bool = typer.Option(False, help="Hand projects to the workers largest first, based on their storage statistics"),
+    engine: str = typer.Option("export", help="'export' moves export archives through this machine, 'direct-transfer' lets the destination pull from the source (bulk import)")
 ):
     """Export projects from source and import to destination"""
-    gl_source, gl_destination = get_gitlab_clients()
+    from migration.group_manager import get_all_projects, get_group_id_by_path
+    from migration.projects_manager import (export_projects, import_projects, migrate_projects_pipelined,
+                                            migrate_projects_streamed, destination_project_path)
+
+    check_engine(engine)
+    gl_source, gl_destination = get_gitlab_clients(export_workers + import_workers)
     
+    inventory = get_inventory()
     source_id = get_group_id_by_path(gl_source, source_path)
-    projects = get_all_projects(gl_source, source_id, source_path)
+    projects = get_all_projects(gl_source, source_id, source_path, inventory=inventory)
+    if largest_first:
+        from migration.planner import project_sizes, order_largest_first
+
+        projects = order_largest_first(projects, project_sizes(gl_source, source_id))
     
-    export_projects(gl_source, projects)
     if top_level_group:
         new_path = ""
         logging.info(f"Exporting to top level group: {dest_path}")
-        import_projects(gl_destination, projects, dest_path, new_path)
     elif not new_path:
         new_path = source_path.split('/')[-1]
         logging.info(f"Using source group path as new path: {new_path}")
-        import_projects(gl_destination, projects, dest_path, new_path)
     else: 
         logging.info(f"Using new path as new path: {new_path}")
-        import_projects(gl_destination, projects, dest_path, new_path)
+
+    journal = get_journal()
+    cache = None
+    if export_cache_gb:
+        from migration.export_cache import ExportCache
+
+        cache = ExportCache(max_bytes=int(export_cache_gb * 1024 ** 3))
+    if engine == "direct-transfer":
+        from migration.direct_transfer import migrate_projects_direct
+
+        migrate_projects_direct(gl_source, gl_destination, projects, dest_path, new_path, journal)
+    elif stream:
+        migrate_projects_streamed(gl_source, gl_destination, projects, dest_path, new_path,
+                                  export_workers, spool_mb, journal)
+    elif pipeline:
+        migrate_projects_pipelined(gl_source, gl_destination, projects, dest_path, new_path,
+                                   export_workers, import_workers, max_staged_gb, journal,
+                                   download_chunk_mb * 1024 ** 2, cache)
+    else:
+        export_projects(gl_source, projects, export_workers, journal, download_chunk_mb * 1024 ** 2,
+                        cache)
+        import_projects(gl_destination, projects, dest_path, new_path, journal)
+
+    for project_info in projects:
+        destination = destination_project_path(project_info, dest_path, new_path)
+        inventory.record_mapping(gl_source.url, project_info['path_with_namespace'],
+                                 gl_destination.url, destination)
+    inventory.invalidate(gl_destination.url, os.path.join(dest_path, new_path).rstrip('/'))
     
     typer.echo("Projects migration completed successfully")
 
@@ -80,10 +246,15 @@ def migrate_secrets(
     source_path: str = typer.Option(..., help="Source group path"),
     dest_path: str = typer.Option(..., help="Destination group path"),
     new_path: str = typer.Option(None, help="New group path (optional, defaults to source group path)"),
-    top_level_group: bool = typer.Option(False, help="Create top level group")
+    top_level_group: bool = typer.Option(False, help="Create top level group"),
+    variable_workers: int = typer.Option(8, help="Maximum number of concurrent variable API calls"),
+    sync_variables: bool = typer.Option(False, help="Only create or update variables missing or different on the destination"),
+    delete_extra_variables: bool = typer.Option(False, help="With --sync-variables, delete destination variables missing on the source")
 ):
     """Migrate group and project variables"""
-    gl_source, gl_destination = get_gitlab_clients()
+    from migration.secrets_manager import migrate_group_variables, migrate_project_variables
+
+    gl_source, gl_destination = get_gitlab_clients(variable_workers)
 
     if top_level_group:
         dest_group_path = f"{dest_path}"
@@ -94,8 +265,12 @@ def migrate_secrets(
     else:
         dest_group_path = f"{dest_path}/{new_path}"
 
-    migrate_group_variables(gl_source, gl_destination, source_path, dest_group_path)
-    migrate_project_variables(gl_source, gl_destination, source_path, dest_group_path)
+    inventory = get_inventory()
+    journal = get_journal()
+    migrate_group_variables(gl_source, gl_destination, source_path, dest_group_path, inventory, journal,
+                            variable_workers, sync_variables, delete_extra_variables)
+    migrate_project_variables(gl_source, gl_destination, source_path, dest_group_path, inventory, journal,
+                              variable_workers, sync_variables, delete_extra_variables)
     
     typer.echo("Secrets migration completed successfully")
 
@@ -104,10 +279,17 @@ def replace_repositories(
     source_path: str = typer.Option(..., help="Source group path (e.g. 'group/subgroup')"),
     dest_path: str = typer.Option(..., help="Destination group path, NOT the parent path"),
     new_path: str = typer.Option(None, help="New group path (optional, defaults to source group path)"),
-    top_level_group: bool = typer.Option(False, help="Create top level group")
+    top_level_group: bool = typer.Option(False, help="Create top level group"),
+    replace_engine: str = typer.Option("api", help="'api' edits files through the Commits API without cloning (falls back to clone on failure), 'clone' always clones"),
+    clone_strategy: str = typer.Option("partial", help="'partial' clones only the default branch tip and the files to edit, 'full' clones the whole repository"),
+    replace_workers: int = typer.Option(4, help="Number of repositories processed concurrently"),
+    mirror_cache_gb: float = typer.Option(0, help="Keep bare mirrors of up to this many GB in cache/mirrors, reused by full clones and syncs (0 = disabled)")
 ):
     """Replace repository URLs in all projects"""
-    _, gl_destination = get_gitlab_clients()
+    from migration.group_manager import get_all_projects, get_group_id_by_path
+    from migration.repository_manager import repositories_replacement, BLOB_WORKERS
+
+    _, gl_destination = get_gitlab_clients(replace_workers * BLOB_WORKERS)
 
     if top_level_group:
         logging.info(f"Exporting to top level group: {dest_path}")
@@ -120,25 +302,122 @@ def replace_repositories(
         dest_group_path = f"{dest_path}/{new_path}"
     
     group_id = get_group_id_by_path(gl_destination, dest_group_path)
-    projects = get_all_projects(gl_destination, group_id, dest_group_path)
+    projects = get_all_projects(gl_destination, group_id, dest_group_path, inventory=get_inventory())
     
-    repositories_replacement(projects, gl_destination)
+    repositories_replacement(projects, gl_destination, get_journal(), replace_engine, clone_strategy,
+                             replace_workers, get_mirror_cache(mirror_cache_gb))
     
     typer.echo("Repository replacement completed successfully")
 
+@app.command()
+def sync_repositories(
+    source_path: str = typer.Option(..., help="Source group path"),
+    dest_path: str = typer.Option(..., help="Destination group path"),
+    new_path: str = typer.Option(None, help="New group path (optional, defaults to source group path)"),
+    top_level_group: bool = typer.Option(False, help="Create top level group"),
+    sync_workers: int = typer.Option(8, help="Number of repositories compared and synced concurrently"),
+    force: bool = typer.Option(False, help="Force push refs that cannot be fast-forwarded on the destination"),
+    prune: bool = typer.Option(False, help="Delete destination branches and tags missing on the source"),
+    mirror_cache_gb: float = typer.Option(0, help="Keep bare mirrors of up to this many GB in cache/mirrors, reused by full clones and syncs (0 = disabled)")
+):
+    """Push branches and tags changed on the source since the migration to the destination"""
+    from migration.group_manager import get_all_projects, get_group_id_by_path
+    from migration.repository_sync import sync_repositories as sync
+
+    gl_source, gl_destination = get_gitlab_clients(sync_workers)
+
+    if top_level_group:
+        dest_group_path = f"{dest_path}"
+    elif not new_path:
+        new_path = source_path.split('/')[-1]
+        logging.info(f"Using source group path as new path: {new_path}")
+        dest_group_path = f"{dest_path}/{new_path}"
+    else:
+        dest_group_path = f"{dest_path}/{new_path}"
+
+    inventory = get_inventory()
+    projects = get_all_projects(gl_source, get_group_id_by_path(gl_source, source_path), source_path,
+                                inventory=inventory)
+    dest_urls = {project['path_with_namespace']: project['url']
+                 for project in get_all_projects(gl_destination, get_group_id_by_path(gl_destination, dest_group_path),
+                                                 dest_group_path, inventory=inventory)}
+    for project in projects:
+        relative_path = project['path_with_namespace'].replace(source_path + '/', '', 1)
+        project['dest_path'] = inventory.destination_path(gl_source.url, project['path_with_namespace'],
+                                                          gl_destination.url) or f"{dest_group_path}/{relative_path}"
+        project['dest_url'] = dest_urls.get(project['dest_path'])
+
+    results = sync(gl_source, gl_destination, projects, sync_workers, force, prune,
+                   get_mirror_cache(mirror_cache_gb))
+    if any(result['status'] in ('failed', 'partial', 'missing') for result in results):
+        typer.echo("Repositories sync finished with errors, see the report", err=True)
+        raise typer.Exit(1)
+    typer.echo("Repositories sync completed successfully")
+
+@app.command()
+def plan(
+    source_path: str = typer.Option(..., help="Source group path"),
+    dest_path: str = typer.Option(..., help="Destination group path"),
+    new_path: str = typer.Option(None, help="New group path (optional, defaults to source group path)"),
+    top_level_group: bool = typer.Option(False, help="Create top level group"),
+    export_workers: int = typer.Option(4, help="Number of project exports processed concurrently"),
+    pipeline: bool = typer.Option(False, help="Import each project as soon as its export is downloaded"),
+    import_workers: int = typer.Option(2, help="Number of concurrent project imports in pipeline mode"),
+    execute: bool = typer.Option(False, help="Migrate the projects largest first once the plan is printed")
+):
+    """Estimate project sizes and migration time, optionally run the migration largest first"""
+    from migration.group_manager import get_all_projects, get_group_id_by_path
+    from migration.planner import project_sizes, build_plan, format_plan, write_plan
+
+    gl_source, _ = get_gitlab_clients(export_workers + import_workers)
+    source_id = get_group_id_by_path(gl_source, source_path)
+    projects = get_all_projects(gl_source, source_id, source_path, inventory=get_inventory())
+    migration_plan = build_plan(projects, project_sizes(gl_source, source_id), export_workers,
+                                import_workers, pipeline)
+    typer.echo(format_plan(migration_plan))
+    typer.echo(f"Plan written to {write_plan(migration_plan)}")
+
+    if execute:
+        migrate_projects(source_path=source_path, dest_path=dest_path, new_path=new_path,
+                         top_level_group=top_level_group, export_workers=export_workers, pipeline=pipeline,
+                         import_workers=import_workers, max_staged_gb=0, stream=False, spool_mb=256,
+                         download_chunk_mb=8, export_cache_gb=0, largest_first=True, engine="export")
+
 @app.command()
 def migrate_all(
     source_path: str = typer.Option(..., help="Source group path (e.g. 'group/subgroup')"),
     dest_path: str = typer.Option(..., help="Destination parent group path"),
     new_name: str = typer.Option(None, help="New group name (optional, defaults to source group name)"),
     new_path: str = typer.Option(None, help="New group path (optional, defaults to source group path)"),
-    top_level_group: bool = typer.Option(False, help="Create top level group")
+    top_level_group: bool = typer.Option(False, help="Create top level group"),
+    export_workers: int = typer.Option(4, help="Number of project exports processed concurrently"),
+    pipeline: bool = typer.Option(False, help="Import each project as soon as its export is downloaded"),
+    import_workers: int = typer.Option(2, help="Number of concurrent project imports in pipeline mode"),
+    max_staged_gb: float = typer.Option(0, help="Pause exports while staged archives exceed this size in GB (0 = unlimited, pipeline mode)"),
+    stream: bool = typer.Option(False, help="Stream every export straight into its import instead of staging archives under exports/"),
+    spool_mb: int = typer.Option(256, help="Size in MB up to which a streamed archive is kept in memory before spilling to a temporary file"),
+    download_chunk_mb: int = typer.Option(8, help="Size in MB of the chunks export downloads are read and resumed in"),
+    export_cache_gb: float = typer.Option(0, help="Keep export archives of up to this many GB in cache/exports and reuse them while projects are unchanged (0 = disabled)"),
+    largest_first: bool = typer.Option(False, help="Hand projects to the workers largest first, based on their storage statistics"),
+    replace_engine: str = typer.Option("api", help="'api' edits files through the Commits API without cloning (falls back to clone on failure), 'clone' always clones"),
+    clone_strategy: str = typer.Option("partial", help="'partial' clones only the default branch tip and the files to edit, 'full' clones the whole repository"),
+    replace_workers: int = typer.Option(4, help="Number of repositories processed concurrently"),
+    mirror_cache_gb: float = typer.Option(0, help="Keep bare mirrors of up to this many GB in cache/mirrors, reused by full clones and syncs (0 = disabled)"),
+    variable_workers: int = typer.Option(8, help="Maximum number of concurrent variable API calls"),
+    sync_variables: bool = typer.Option(False, help="Only create or update variables missing or different on the destination"),
+    delete_extra_variables: bool = typer.Option(False, help="With --sync-variables, delete destination variables missing on the source"),
+    engine: str = typer.Option("export", help="'export' moves export archives through this machine, 'direct-transfer' lets the destination pull from the source (bulk import)")
 ):
     """Execute complete migration workflow"""
+    from migration.repository_manager import BLOB_WORKERS
+
+    # Create the clients once, with a connection pool large enough for every step
+    get_gitlab_clients(max(export_workers + import_workers, variable_workers,
+                           replace_workers * BLOB_WORKERS))
     try:
         # Step 1: Migrate group
         typer.echo("Starting group migration...")
-        migrate_group(source_path, dest_path, new_name, new_path, top_level_group)
+        migrate_group(source_path, dest_path, new_name, new_path, top_level_group, engine)
 
         # If new_path not provided, use last part of source_path
         if not new_path:
@@ -147,16 +426,20 @@ def migrate_all(
 
         # Step 2: Migrate projects
         typer.echo("Starting projects migration...")
-        migrate_projects(source_path, dest_path, new_path, top_level_group)
+        migrate_projects(source_path, dest_path, new_path, top_level_group, export_workers,
+                         pipeline, import_workers, max_staged_gb, stream, spool_mb, download_chunk_mb,
+                         export_cache_gb, largest_first, engine)
 
         # Step 3: Migrate secrets
         typer.echo("Starting secrets migration...")
 
-        migrate_secrets(source_path, dest_path, new_path, top_level_group)
+        migrate_secrets(source_path, dest_path, new_path, top_level_group, variable_workers,
+                        sync_variables, delete_extra_variables)
 
         # Step 4: Replace repositories
         typer.echo("Starting repository URL replacement...")
-        replace_repositories(source_path, dest_path, new_path, top_level_group)
+        replace_repositories(source_path, dest_path, new_path, top_level_group, replace_engine,
+                             clone_strategy, replace_workers, mirror_cache_gb)
 
         typer.echo("Complete migration workflow finished successfully!")
         
@@ -164,6 +447,40 @@ def migrate_all(
         typer.echo(f"Migration failed: {str(e)}", err=True)
         raise
 
+@app.command()
+def migrate_batch(
+    manifest: str = typer.Option(..., help="YAML file listing the source to destination group mappings"),
+    workers: int = typer.Option(8, help="Size of the worker pool shared by the group, project, variable and replacement work of all groups"),
+    import_workers: int = typer.Option(2, help="Maximum number of concurrent project imports"),
+    variable_workers: int = typer.Option(8, help="Maximum number of concurrent variable API calls"),
+    download_chunk_mb: int = typer.Option(8, help="Size in MB of the chunks export downloads are read and resumed in"),
+    sync_variables: bool = typer.Option(False, help="Only create or update variables missing or different on the destination"),
+    delete_extra_variables: bool = typer.Option(False, help="With --sync-variables, delete destination variables missing on the source"),
+    replace_engine: str = typer.Option("api", help="'api' edits files through the Commits API without cloning (falls back to clone on failure), 'clone' always clones"),
+    clone_strategy: str = typer.Option("partial", help="'partial' clones only the default branch tip and the files to edit, 'full' clones the whole repository"),
+    mirror_cache_gb: float = typer.Option(0, help="Keep bare mirrors of up to this many GB in cache/mirrors, reused by full clones and syncs (0 = disabled)")
+):
+    """Migrate many groups listed in a manifest through one shared worker pool"""
+    from migration.batch import load_manifest, migrate_batch as run_batch
+    from migration.repository_manager import BLOB_WORKERS
+
+    try:
+        mappings = load_manifest(manifest)
+    except (OSError, ValueError) as e:
+        raise typer.BadParameter(str(e), param_hint='--manifest')
+    gl_source, gl_destination = get_gitlab_clients(workers * BLOB_WORKERS)
+
+    results, report_path = run_batch(
+        gl_source, gl_destination, mappings, journal=get_journal(), inventory=get_inventory(),
+        workers=workers, import_workers=import_workers, variable_workers=variable_workers,
+        chunk_size=download_chunk_mb * 1024 ** 2,
+        sync_variables=sync_variables, delete_variables=delete_extra_variables, replace_engine=replace_engine,
+        clone_strategy=clone_strategy, mirrors=get_mirror_cache(mirror_cache_gb))
+    if any(result['status'] != 'migrated' for result in results):
+        typer.echo(f"Batch migration finished with errors, see {report_path}", err=True)
+        raise typer.Exit(1)
+    typer.echo("Batch migration completed successfully")
+
 if __name__ == "__main__":
     app()
 
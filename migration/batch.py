@@ -0,0 +1,293 @@
+import os
+import time
+import logging
+import threading
+import gitlab
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+from migration.journal import Journal
+from migration.group_manager import (export_group, import_group, get_group_id_by_path, get_all_projects,
+                                     group_export_file, project_record, subgroup_paths, wait_for_group_tree,
+                                     project_entry)
+from migration.projects_manager import export_project, import_project, destination_project_path
+from migration.secrets_manager import (prepare_variables, apply_variable, finish_variables, url_rewriter,
+                                      group_variable_targets, project_variable_target)
+from migration.repository_manager import replace_project, check_replace_options, write_report
+from migration.replacement_engine import ReplacementEngine
+from migration.mirror_cache import MirrorCache
+from migration.downloads import CHUNK_SIZE
+from migration.telemetry import traced
+
+MAPPING_FIELDS = ('source_path', 'dest_path', 'new_name', 'new_path', 'top_level_group')
+
+
+def load_manifest(path: str) -> List[Dict[str, Any]]:
+    """
+    Read the group mappings of a batch manifest.
+
+    The manifest holds a `groups` list of mappings with the options of `migrate-all`
+    (`source_path`, `dest_path`, `new_name`, `new_path`, `top_level_group`), and
+    optional `defaults` applied to every mapping.
+    """
+    import yaml
+
+    try:
+        with open(path) as f:
+            manifest = yaml.safe_load(f) or {}
+    except yaml.YAMLError as e:
+        raise ValueError(f'Invalid manifest {path}: {e}') from e
+    if not isinstance(manifest, dict):
+        raise ValueError(f'Invalid manifest {path}: expected a mapping with a groups list')
+
+    defaults = manifest.get('defaults') or {}
+    mappings = []
+    for position, entry in enumerate(manifest.get('groups') or [], start=1):
+        mapping = {'new_name': None, 'new_path': None, 'top_level_group': False, **defaults, **entry}
+        unknown = sorted(set(mapping) - set(MAPPING_FIELDS))
+        if unknown:
+            raise ValueError(f'Unknown fields {unknown} in group {position} of {path}')
+        for field in ('source_path', 'dest_path'):
+            if not mapping.get(field):
+                raise ValueError(f'Missing {field} in group {position} of {path}')
+        mappings.append(mapping)
+    if not mappings:
+        raise ValueError(f'No groups to migrate in {path}')
+
+    sources = [mapping['source_path'] for mapping in mappings]
+    duplicates = sorted({source for source in sources if sources.count(source) > 1})
+    if duplicates:
+        raise ValueError(f'Groups listed more than once in {path}: {duplicates}')
+    return mappings
+
+def destination_paths(mapping: Dict[str, Any]) -> Tuple[str, str]:
+    """Destination group path of a mapping and the new path its projects are imported under"""
+    if mapping['top_level_group']:
+        return mapping['dest_path'], ''
+    new_path = mapping['new_path'] or mapping['source_path'].split('/')[-1]
+    return f"{mapping['dest_path']}/{new_path}", new_path
+
+
+class BatchMigration:
+    """
+    Migration of many groups through a single worker pool and client pair.
+
+    Work is split into units (group export and import, project export and import,
+    variables of every group and project, repository replacement of every project),
+    and each unit is handed to the pool as soon as the one it depends on is done: the
+    projects of a group once the group is imported, their variables and replacement
+    once they are imported. Groups therefore overlap and the pool never waits for a
+    whole group to finish. At most `import_workers` project imports run at once, so
+    the destination is not flooded with imports, and at most `variable_workers`
+    variable API calls.
+
+    Units are recorded in the journal under the same keys as the single group
+    commands, so a batch can be resumed with `--resume`.
+    """
+
+    def __init__(self, source_gl: gitlab.Gitlab, dest_gl: gitlab.Gitlab, mappings: List[Dict[str, Any]],
+                 journal: Journal = None, inventory: Any = None, workers: int = 8, import_workers: int = 2,
+                 variable_workers: int = 8, chunk_size: int = CHUNK_SIZE, sync_variables: bool = False, delete_variables: bool = False,
+                 replace_engine: str = 'api', clone_strategy: str = 'partial', mirrors: MirrorCache = None):
+        check_replace_options(replace_engine, clone_strategy)
+        self.source_gl = source_gl
+        self.dest_gl = dest_gl
+        self.journal = journal or Journal(None)
+        self.inventory = inventory
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.sync_variables = sync_variables
+        self.delete_variables = delete_variables
+        self.replace_engine = replace_engine
+        self.clone_strategy = clone_strategy
+        self.mirrors = mirrors
+        self.engine = ReplacementEngine.from_env()
+        self.rewrite = url_rewriter()
+        self.file_workers = max(1, (os.cpu_count() or 1) // workers)
+        self.results = []
+        for mapping in mappings:
+            destination, new_path = destination_paths(mapping)
+            self.results.append({'source': mapping['source_path'], 'destination': destination,
+                                 'status': 'pending', 'group': 'pending', 'variables': [], 'projects': [],
+                                 'mapping': mapping, 'new_path': new_path})
+        self._imports = threading.Semaphore(import_workers)
+        self._variable_calls = threading.Semaphore(variable_workers)
+        self._executor = None
+        self._pending = 0
+        self._idle = threading.Condition()
+
+    def _submit(self, func: Callable, *args):
+        with self._idle:
+            self._pending += 1
+        self._executor.submit(self._run, func, *args)
+
+    def _run(self, func: Callable, *args):
+        try:
+            func(*args)
+        except Exception as e:
+            logging.exception(f'Unexpected error in {func.__name__}: {e}')
+        finally:
+            with self._idle:
+                self._pending -= 1
+                if not self._pending:
+                    self._idle.notify_all()
+
+    def run(self) -> List[Dict[str, Any]]:
+        """Migrate every group, wait until all units are done and return the result of each group"""
+        logging.info(f'Migrating {len(self.results)} groups with {self.workers} workers')
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            for group in self.results:
+                self._submit(self._migrate_group, group)
+            with self._idle:
+                while self._pending:
+                    self._idle.wait()
+        finally:
+            self._executor.shutdown()
+
+        for group in self.results:
+            group.pop('mapping')
+            group.pop('new_path')
+            group['status'] = _group_status(group)
+        return self.results
+
+    @traced()
+    def _migrate_group(self, group: Dict[str, Any]):
+        mapping = group['mapping']
+        source_path = mapping['source_path']
+        key = f'group:{source_path}'
+        try:
+            source_id = get_group_id_by_path(self.source_gl, source_path)
+            if self.journal.is_done(f'{key}:import'):
+                logging.info(f'Group {source_path} already migrated, skipping')
+                group['group'] = 'skipped'
+            else:
+                if self.journal.is_done(f'{key}:export') and os.path.exists(group_export_file(source_id)):
+                    logging.info(f'Export of group {source_path} already downloaded, skipping export')
+                else:
+                    with self.journal.step(f'{key}:export'):
+                        export_group(self.source_gl, source_id)
+                with self.journal.step(f'{key}:import'):
+                    if mapping['top_level_group']:
+                        import_group(self.dest_gl, self.source_gl, source_id, None, mapping['new_name'],
+                                     mapping['dest_path'])
+                    else:
+                        dest_id = get_group_id_by_path(self.dest_gl, mapping['dest_path'])
+                        import_group(self.dest_gl, self.source_gl, source_id, dest_id, mapping['new_name'],
+                                     group['new_path'])
+                    # Variables and projects go into the groups the import creates
+                    wait_for_group_tree(self.dest_gl, group['destination'],
+                                        subgroup_paths(self.source_gl, source_id))
+                group['group'] = 'migrated'
+                if self.inventory is not None:
+                    self.inventory.invalidate(self.dest_gl.url, group['destination'])
+            projects = get_all_projects(self.source_gl, source_id, source_path, inventory=self.inventory)
+        except Exception as e:
+            logging.error(f'Failed to migrate group {source_path}: {e}')
+            group.update(group='failed', error=str(e))
+            return
+
+        logging.info(f"Group {source_path} ready, scheduling {len(projects)} projects")
+        self._submit(self._migrate_group_variables, group)
+        for project_info in projects:
+            record = {'id': project_info['id'], 'path': project_info['path_with_namespace'],
+                      'destination': destination_project_path(project_info, mapping['dest_path'],
+                                                              group['new_path']),
+                      'status': 'pending', 'variables': 'pending', 'replacement': 'pending'}
+            group['projects'].append(record)
+            self._submit(self._migrate_project, group, project_info, record)
+
+    def _migrate_group_variables(self, group: Dict[str, Any]):
+        targets = group_variable_targets(self.source_gl, self.dest_gl, group['source'], group['destination'],
+                                         self.inventory)
+        for target in targets:
+            self._submit(self._migrate_group_target, group, target)
+
+    def _migrate_group_target(self, group: Dict[str, Any], target: Dict[str, Any]):
+        self._migrate_variables(target, lambda result: group['variables'].append(
+            {'path': result['source'], 'status': result['status']}))
+
+    def _migrate_variables(self, target: Dict[str, Any], on_done: Callable[[Dict[str, Any]], None]):
+        """List the variables of a target and submit each of its writes to the pool"""
+        with self._variable_calls:
+            result, dest_obj, actions = prepare_variables(self.dest_gl, target, self.journal, self.rewrite,
+                                                          self.sync_variables, self.delete_variables)
+        if not actions:
+            on_done(finish_variables(target, result, self.journal))
+            return
+        left = [len(actions)]
+        lock = threading.Lock()
+
+        def write(action: str, var: Any):
+            with self._variable_calls:
+                outcome = apply_variable(dest_obj, action, var, self.rewrite)
+            with lock:
+                result['variables'].append(outcome)
+                left[0] -= 1
+                last = not left[0]
+            if last:
+                on_done(finish_variables(target, result, self.journal))
+
+        for action, var in actions:
+            self._submit(write, action, var)
+
+    @traced('project_info')
+    def _migrate_project(self, group: Dict[str, Any], project_info: Dict[str, Any], record: Dict[str, Any]):
+        start = time.monotonic()
+        try:
+            if export_project(project_info, self.journal, self.chunk_size):
+                with self._imports:
+                    if not import_project(self.dest_gl, project_info, group['mapping']['dest_path'],
+                                          group['new_path'], self.journal):
+                        raise RuntimeError(f"Failed to import project {project_info['path_with_namespace']}")
+        except Exception as e:
+            logging.error(f"Failed to migrate project {project_info['path_with_namespace']}: {e}")
+            record.update(status='failed', variables='skipped', replacement='skipped', error=str(e))
+            return
+        finally:
+            record['seconds'] = round(time.monotonic() - start, 2)
+
+        record['status'] = 'migrated'
+        if self.inventory is not None:
+            self.inventory.record_mapping(self.source_gl.url, project_info['path_with_namespace'],
+                                          self.dest_gl.url, record['destination'])
+        self._submit(self._migrate_project_variables, project_info, record)
+        self._submit(self._replace_project, group, record)
+
+    def _migrate_project_variables(self, project_info: Dict[str, Any], record: Dict[str, Any]):
+        target = project_variable_target(project_info, record['destination'])
+        self._migrate_variables(target, lambda result: record.update(variables=result['status']))
+
+    def _replace_project(self, group: Dict[str, Any], record: Dict[str, Any]):
+        try:
+            dest_project = self.dest_gl.projects.get(record['destination'])
+            project = project_record(self.dest_gl, project_entry(dest_project), group['destination'])
+        except gitlab.exceptions.GitlabGetError as e:
+            logging.error(f"Project {record['destination']} not found on the destination: {e}")
+            record.update(replacement='failed', replacement_error=str(e))
+            return
+        result = replace_project(self.dest_gl, project, self.journal, self.engine, self.replace_engine,
+                                 self.clone_strategy, self.file_workers, self.mirrors)
+        record.update(replacement=result['status'], mr_url=result['mr_url'])
+        if 'error' in result:
+            record['replacement_error'] = result['error']
+
+
+def _group_status(group: Dict[str, Any]) -> str:
+    if group['group'] == 'failed':
+        return 'failed'
+    statuses = [variables['status'] for variables in group['variables']]
+    for project in group['projects']:
+        statuses += [project['status'], project['variables'], project['replacement']]
+    return 'partial' if any(status in ('failed', 'partial') for status in statuses) else 'migrated'
+
+def migrate_batch(source_gl: gitlab.Gitlab, dest_gl: gitlab.Gitlab, mappings: List[Dict[str, Any]],
+                  **options) -> Tuple[List[Dict[str, Any]], str]:
+    """Run a batch migration and write its consolidated report, returning the results and the report path"""
+    results = BatchMigration(source_gl, dest_gl, mappings, **options).run()
+    report_path = write_report(results, 'batch')
+    summary = {status: sum(1 for r in results if r['status'] == status)
+               for status in ('migrated', 'partial', 'failed')}
+    projects = sum(len(r['projects']) for r in results)
+    logging.info(f"Batch migration of {len(results)} groups and {projects} projects completed: {summary}, "
+                 f"report written to {report_path}")
+    return results, report_path
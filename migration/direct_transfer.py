@@ -0,0 +1,154 @@
+import logging
+import gitlab
+from typing import List, Dict, Any
+from migration.status_poller import get_poller, FINISHED, FAILED
+from migration.journal import Journal
+from migration.projects_manager import destination_project_namespace
+from migration.telemetry import traced
+
+BULK_IMPORT_TIMEOUT = 12 * 3600
+# Bulk import statuses after which GitLab does no more work
+FAILED_STATUSES = ('failed', 'timeout', 'canceled')
+
+
+def group_entity(source_full_path: str, destination_namespace: str, destination_slug: str) -> Dict[str, Any]:
+    """
+    Bulk import entity of a group and its subgroups, without their projects which are
+    migrated by the projects step.
+    """
+    return {
+        'source_type': 'group_entity',
+        'source_full_path': source_full_path,
+        'destination_namespace': destination_namespace,
+        'destination_slug': destination_slug,
+        'migrate_projects': False
+    }
+
+def project_entity(source_full_path: str, destination_namespace: str, destination_slug: str) -> Dict[str, Any]:
+    return {
+        'source_type': 'project_entity',
+        'source_full_path': source_full_path,
+        'destination_namespace': destination_namespace,
+        'destination_slug': destination_slug
+    }
+
+def _bulk_import_status(bulk_import) -> str:
+    bulk_import.refresh()
+    if bulk_import.status in FAILED_STATUSES:
+        return FAILED
+    return bulk_import.status
+
+def _entity_failures(dest_gl: gitlab.Gitlab, bulk_import_id: int, entity_id: int) -> List[Dict[str, Any]]:
+    try:
+        return dest_gl.http_list(f'/bulk_imports/{bulk_import_id}/entities/{entity_id}/failures',
+                                 get_all=True)
+    except gitlab.exceptions.GitlabError as e:
+        logging.warning(f'Failed to get failures of bulk import entity {entity_id}: {e}')
+        return []
+
+@traced()
+def run_bulk_import(source_gl: gitlab.Gitlab, dest_gl: gitlab.Gitlab,
+                    entities: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Migrate entities with a single direct transfer (bulk import) from the source to
+    the destination instance, nothing is downloaded to the local disk.
+
+    The destination pulls the data from the source with the source token, this process
+    only watches the bulk import until it ends. Returns one result per entity with its
+    `source_full_path`, `destination_full_path`, `status` and `failures`.
+    """
+    bulk_import = dest_gl.bulk_imports.create({
+        'configuration': {'url': source_gl.url, 'access_token': source_gl.private_token},
+        'entities': entities
+    })
+    logging.info(f'Started bulk import {bulk_import.id} of {len(entities)} entities')
+
+    try:
+        get_poller().wait_for(f'Bulk import {bulk_import.id}',
+                              lambda: _bulk_import_status(bulk_import), BULK_IMPORT_TIMEOUT)
+    except RuntimeError as e:
+        # Entity statuses below tell which entities were migrated before the failure
+        logging.error(str(e))
+
+    results = []
+    for entity in bulk_import.entities.list(get_all=True):
+        result = {
+            'source_full_path': entity.source_full_path,
+            'destination_full_path': entity.destination_full_path,
+            'status': entity.status,
+            'failures': []
+        }
+        if entity.status != FINISHED:
+            result['failures'] = _entity_failures(dest_gl, bulk_import.id, entity.id)
+        for failure in result['failures']:
+            logging.warning(f"{entity.source_full_path}: {failure.get('relation')} "
+                            f"{failure.get('exception_message')}")
+        results.append(result)
+
+    finished = sum(1 for result in results if result['status'] == FINISHED)
+    logging.info(f'Bulk import {bulk_import.id} ended with status {bulk_import.status}, '
+                 f'{finished}/{len(results)} entities finished')
+    return results
+
+@traced('source_path')
+def migrate_group_direct(source_gl: gitlab.Gitlab, dest_gl: gitlab.Gitlab, source_path: str,
+                         destination_namespace: str, destination_slug: str, name: str = None) -> str:
+    """
+    Migrate a group and its subgroups with direct transfer.
+
+    Returns the full path of the destination group, raises if it was not migrated.
+    """
+    entity = group_entity(source_path, destination_namespace or '', destination_slug)
+    # Subgroups are imported as entities of their own in the same bulk import
+    results = run_bulk_import(source_gl, dest_gl, [entity])
+    failed = [result['source_full_path'] for result in results if result['status'] != FINISHED]
+    result = next((result for result in results if result['source_full_path'] == source_path), None)
+    if result is None or failed:
+        raise RuntimeError(f"Direct transfer of group {source_path} failed for: {failed or [source_path]}")
+
+    if name:
+        group = dest_gl.groups.get(result['destination_full_path'])
+        group.name = name
+        group.save()
+    logging.info(f"Group {source_path} migrated to {result['destination_full_path']}")
+    return result['destination_full_path']
+
+@traced()
+def migrate_projects_direct(source_gl: gitlab.Gitlab, dest_gl: gitlab.Gitlab,
+                            projects: List[Dict[str, Any]], destination_parent_path: str,
+                            new_group_path: str, journal: Journal = None):
+    """
+    Migrate projects with one direct transfer, recording every project in the journal
+    under the same import keys as the export/import engine.
+    """
+    journal = journal or Journal(None)
+    pending = {}
+    for project_info in projects:
+        key = f"project:{project_info['id']}:import"
+        if journal.is_done(key):
+            logging.info(f"Project {project_info['name']} already imported, skipping")
+            continue
+        pending[project_info['path_with_namespace']] = project_info
+    if not pending:
+        return
+
+    entities = []
+    for source_full_path, project_info in pending.items():
+        namespace = destination_project_namespace(project_info, destination_parent_path, new_group_path)
+        entities.append(project_entity(source_full_path, namespace, project_info['path']))
+        journal.start(f"project:{project_info['id']}:import")
+
+    failed = []
+    results = {result['source_full_path']: result for result in run_bulk_import(source_gl, dest_gl, entities)}
+    for source_full_path, project_info in pending.items():
+        key = f"project:{project_info['id']}:import"
+        result = results.get(source_full_path)
+        if result is not None and result['status'] == FINISHED:
+            journal.done(key, destination=result['destination_full_path'])
+        else:
+            status = result['status'] if result else 'missing'
+            journal.fail(key, f"Direct transfer ended with status {status}")
+            failed.append(project_info['id'])
+
+    if failed:
+        raise RuntimeError(f'Failed to migrate projects: {failed}')
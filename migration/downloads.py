@@ -0,0 +1,220 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+import gitlab
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+from migration.journal import atomic_write_json
+
+MANIFEST_PATH = 'cache/downloads.json'
+CHUNK_SIZE = 8 * 1024 ** 2
+EXPORT_NAME_TIME = re.compile(r'(\d{4})-(\d{2})-(\d{2})_(\d{2})-(\d{2})-\d{3}_')
+
+
+def sha256_file(file_path: str, chunk_size: int = CHUNK_SIZE) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DownloadManifest:
+    """
+    Record of the archives downloaded completely, with their size and SHA-256.
+
+    A recorded archive that is still on disk with the same size is never downloaded
+    again, and its checksum is verified before it is imported. Entries may carry extra
+    information about what was downloaded, e.g. the `last_activity_at` of the project.
+    """
+
+    def __init__(self, path: Optional[str] = MANIFEST_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self._entries = json.load(f)
+
+    def get(self, file_path: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._entries.get(file_path)
+
+    def is_complete(self, file_path: str) -> bool:
+        entry = self.get(file_path)
+        return entry is not None and os.path.exists(file_path) and os.path.getsize(file_path) == entry['size']
+
+    def record(self, file_path: str, size: int, sha256: str, **info):
+        with self._lock:
+            self._entries[file_path] = {**info, 'size': size, 'sha256': sha256, 'completed_at': time.time()}
+            self._save()
+
+    def remove(self, file_path: str):
+        with self._lock:
+            if self._entries.pop(file_path, None) is not None:
+                self._save()
+
+    def verify(self, file_path: str) -> bool:
+        """Check the size and checksum of a recorded archive"""
+        entry = self.get(file_path)
+        if entry is None or not self.is_complete(file_path):
+            return False
+        return sha256_file(file_path) == entry['sha256']
+
+    def _save(self):
+        if self.path:
+            atomic_write_json(self.path, self._entries)
+
+
+def server_time(headers: Any) -> datetime:
+    """Time of a response of the server, from its `Date` header"""
+    try:
+        return parsedate_to_datetime(headers['Date'])
+    except (KeyError, TypeError, ValueError):
+        return datetime.now(timezone.utc).replace(microsecond=0)
+
+def export_time(headers: Any) -> Optional[datetime]:
+    """
+    Time the export file was written, from `Last-Modified` or, to the minute, from the
+    time stamp in the file name. None when the server gives neither.
+    """
+    try:
+        return parsedate_to_datetime(headers['Last-Modified'])
+    except (KeyError, TypeError, ValueError):
+        pass
+    match = EXPORT_NAME_TIME.search(headers.get('Content-Disposition') or '')
+    if match is None:
+        return None
+    year, month, day, hour, minute = (int(value) for value in match.groups())
+    # Any time within that minute may be the one of the export request
+    return datetime(year, month, day, hour, minute, 59, tzinfo=timezone.utc)
+
+def _validator_path(part_path: str) -> str:
+    return f'{part_path}.validator'
+
+def _validator(headers: Any) -> Optional[str]:
+    """Strong ETag or Last-Modified of a response, usable in an If-Range header"""
+    etag = headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return headers.get('Last-Modified')
+
+def discard_partial(file_path: str):
+    """Drop the partial download of a file, e.g. when a new export replaces the one it came from"""
+    part_path = f'{file_path}.part'
+    for path in (part_path, _validator_path(part_path)):
+        if os.path.exists(path):
+            os.remove(path)
+
+def _remote_size(gl: gitlab.Gitlab, path: str, validator: Optional[str]) -> Optional[int]:
+    headers = gl.http_head(path)
+    if validator is not None and _validator(headers) != validator:
+        return None
+    length = headers.get('Content-Length')
+    return int(length) if length is not None else None
+
+def _read_validator(part_path: str) -> Optional[str]:
+    try:
+        with open(_validator_path(part_path)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def _write_validator(part_path: str, validator: Optional[str]):
+    if validator is None:
+        if os.path.exists(_validator_path(part_path)):
+            os.remove(_validator_path(part_path))
+        return
+    with open(_validator_path(part_path), 'w') as f:
+        f.write(validator)
+
+def download_resumable(gl: gitlab.Gitlab, path: str, file_path: str, chunk_size: int = CHUNK_SIZE,
+                       manifest: Optional[DownloadManifest] = None, **info) -> Dict[str, Any]:
+    """
+    Download a file of the GitLab API, resuming from the bytes already on disk.
+
+    Data is written to `<file_path>.part` and requested from its current size with an
+    HTTP Range header, so a retry after a broken transfer only fetches the rest. The
+    range is sent with the ETag or Last-Modified of the first response in If-Range, so
+    a file replaced on the server in the meantime (e.g. a regenerated export) comes
+    back whole and the download starts over, as it does when the server ignores the
+    range. A partial file without such a validator is never resumed. Once the size
+    matches the one announced by the server the file is renamed and recorded in the
+    manifest, together with `info`. Returns the manifest entry of the file.
+
+    The recorded SHA-256 is computed from the local file, it detects corruption on
+    disk before import, not a wrong download.
+    """
+    manifest = manifest or get_manifest()
+    if manifest.is_complete(file_path):
+        logging.info(f'{file_path} already downloaded, skipping')
+        return manifest.get(file_path)
+
+    os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+    part_path = f'{file_path}.part'
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    validator = _read_validator(part_path)
+    if offset and validator is None:
+        logging.info(f'Partial download of {file_path} cannot be checked against the server, restarting')
+        offset = 0
+    headers = {'Range': f'bytes={offset}-', 'If-Range': validator} if offset else None
+
+    try:
+        response = gl.http_request('get', path, streamed=True, extra_headers=headers)
+    except gitlab.exceptions.GitlabHttpError as e:
+        if e.response_code != 416:
+            raise
+        # The partial file already holds at least the whole content
+        response = None
+
+    if response is None:
+        total = _remote_size(gl, path, validator)
+        if total != offset:
+            discard_partial(file_path)
+            raise IOError(f'Partial download of {file_path} ({offset} bytes) does not match '
+                          f'the remote file ({total} bytes), restarting')
+    else:
+        if response.status_code == 206:
+            logging.info(f'Resuming download of {file_path} at {offset / 1024 ** 2:.1f} MB')
+            total = int(response.headers['Content-Range'].rsplit('/', 1)[1])
+            mode = 'ab'
+        else:
+            if offset:
+                logging.info(f'{path} changed or does not support ranges, restarting download of {file_path}')
+            offset = 0
+            length = response.headers.get('Content-Length')
+            total = int(length) if length is not None else None
+            mode = 'wb'
+            _write_validator(part_path, _validator(response.headers))
+        with open(part_path, mode) as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+
+    size = os.path.getsize(part_path)
+    if total is not None and size != total:
+        raise IOError(f'Incomplete download of {file_path}: {size} of {total} bytes')
+
+    os.replace(part_path, file_path)
+    _write_validator(part_path, None)
+    manifest.record(file_path, size, sha256_file(file_path, chunk_size), **info)
+    logging.info(f'Downloaded {file_path} ({size / 1024 ** 2:.1f} MB)')
+    return manifest.get(file_path)
+
+_manifest = None
+_manifest_lock = threading.Lock()
+
+
+def get_manifest() -> DownloadManifest:
+    """Return the download manifest shared by the process"""
+    global _manifest
+    with _manifest_lock:
+        if _manifest is None:
+            _manifest = DownloadManifest()
+        return _manifest
@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import shutil
+import logging
+import threading
+from typing import Any, Dict, Optional
+from migration.journal import atomic_write_json
+
+EXPORT_CACHE_PATH = 'cache/exports'
+
+
+def _link_or_copy(source: str, destination: str):
+    """Hard link a file when source and destination share a filesystem, copy it otherwise"""
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+class ExportCache:
+    """
+    Local cache of project export archives, so rehearsals do not export unchanged
+    projects again.
+
+    An archive is valid as long as the project's `last_activity_at` is the one it was
+    exported at. The cache also remembers the exports requested on the server, a
+    finished server export of an unchanged project is downloaded instead of creating a
+    new one. Once the archives take more than `max_bytes`, the least recently used
+    ones are evicted.
+
+    Args:
+        path: Directory holding the archives and their index
+        max_bytes: Maximum total size of the cached archives
+    """
+
+    def __init__(self, path: str = EXPORT_CACHE_PATH, max_bytes: int = 0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._index_path = os.path.join(path, 'index.json')
+        self._lock = threading.Lock()
+        self._archives: Dict[str, Dict[str, Any]] = {}
+        self._server_exports: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(self._index_path):
+            with open(self._index_path) as f:
+                index = json.load(f)
+            self._archives = index.get('archives', {})
+            self._server_exports = index.get('server_exports', {})
+        os.makedirs(path, exist_ok=True)
+
+    @property
+    def size(self) -> int:
+        return sum(entry['size'] for entry in self._archives.values())
+
+    def restore(self, project_info: Dict[str, Any], file_path: str) -> Optional[Dict[str, Any]]:
+        """
+        Put the cached archive of an unchanged project at `file_path`.
+
+        Returns its cache entry, None when there is no valid archive.
+        """
+        key = str(project_info['id'])
+        with self._lock:
+            entry = self._archives.get(key)
+            if entry is None:
+                return None
+            archive = os.path.join(self.path, entry['file'])
+            if entry['last_activity_at'] != project_info['last_activity_at'] or \
+                    not os.path.exists(archive) or os.path.getsize(archive) != entry['size']:
+                logging.info(f"Cached export of project {project_info['id']} is outdated, dropping it")
+                self._drop(key)
+                self._save()
+                return None
+            os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+            _link_or_copy(archive, file_path)
+            entry['used_at'] = time.time()
+            self._save()
+            return dict(entry)
+
+    def store(self, project_info: Dict[str, Any], file_path: str, sha256: str):
+        """Keep a copy of a downloaded archive, evicting older archives to stay below the size limit"""
+        key = str(project_info['id'])
+        size = os.path.getsize(file_path)
+        with self._lock:
+            self._drop(key)
+            if size > self.max_bytes:
+                logging.info(f"Export of project {project_info['id']} is larger than the export cache, "
+                             f"not caching it")
+                self._save()
+                return
+            name = f"{project_info['id']}-{project_info['last_activity_at']}.tgz".replace(':', '')
+            _link_or_copy(file_path, os.path.join(self.path, name))
+            now = time.time()
+            self._archives[key] = {
+                'file': name,
+                'last_activity_at': project_info['last_activity_at'],
+                'size': size,
+                'sha256': sha256,
+                'exported_at': self._server_exports.get(key, {}).get('requested_at', now),
+                'used_at': now
+            }
+            self._evict(keep=key)
+            self._save()
+
+    def server_export(self, project_info: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        The export last requested on the server when it was made of the current
+        project state, with the server time of its request. None otherwise.
+        """
+        with self._lock:
+            entry = self._server_exports.get(str(project_info['id']))
+        if entry is None or entry['last_activity_at'] != project_info['last_activity_at']:
+            return None
+        return dict(entry)
+
+    def record_server_export(self, project_info: Dict[str, Any], requested_at: float):
+        with self._lock:
+            self._server_exports[str(project_info['id'])] = {
+                'last_activity_at': project_info['last_activity_at'],
+                'requested_at': requested_at
+            }
+            self._save()
+
+    def forget_server_export(self, project_info: Dict[str, Any]):
+        """Drop the export requested on the server, e.g. when it failed"""
+        with self._lock:
+            if self._server_exports.pop(str(project_info['id']), None) is not None:
+                self._save()
+
+    def _drop(self, key: str):
+        entry = self._archives.pop(key, None)
+        if entry is not None:
+            archive = os.path.join(self.path, entry['file'])
+            if os.path.exists(archive):
+                os.remove(archive)
+
+    def _evict(self, keep: str):
+        total = self.size
+        for key, entry in sorted(self._archives.items(), key=lambda item: item[1]['used_at']):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            logging.info(f"Evicting cached export of project {key} ({entry['size'] / 1024 ** 2:.1f} MB)")
+            total -= entry['size']
+            self._drop(key)
+
+    def _save(self):
+        atomic_write_json(self._index_path, {'archives': self._archives,
+                                             'server_exports': self._server_exports})
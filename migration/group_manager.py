@@ -1,8 +1,22 @@
 import os
 import time
 import logging
+import itertools
 import gitlab
-from typing import List, Dict
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
+from migration.status_poller import get_poller
+from migration.downloads import download_resumable, discard_partial, get_manifest, server_time, export_time
+from migration.telemetry import traced
+
+GROUP_EXPORT_TIMEOUT = 3600
+GROUP_IMPORT_TIMEOUT = 3600
+# Group export downloads (status checks included) are limited to about one per minute
+GROUP_DOWNLOAD_INTERVAL = 60
+GROUP_EXPORT_FIRST_CHECK = 30
+# Time stamp GitLab puts in export file names, e.g. 2024-05-02_14-07-123_group_export.tar.gz
+PROJECTS_PER_PAGE = 100
 
 def get_group_details(gl: gitlab.Gitlab, group_path: str) -> Dict[str, str]:
     """
@@ -22,22 +36,55 @@ def get_group_details(gl: gitlab.Gitlab, group_path: str) -> Dict[str, str]:
         logging.error(f'Failed to get group details for path {group_path}: {e}')
         raise
 
+def group_export_file(group_id: int) -> str:
+    return os.path.join('exports/group', f'group-{group_id}-export.tgz')
+
+def _group_export_status(gl: gitlab.Gitlab, group_id: int, requested_at: datetime) -> str:
+    """
+    Group exports have no status endpoint, the download endpoint answers 404
+    until the export file has been generated. A file older than the export request
+    belongs to a previous export and is still being replaced.
+    """
+    try:
+        headers = gl.http_head(f'/groups/{group_id}/export/download')
+    except gitlab.exceptions.GitlabHttpError as e:
+        if e.response_code == 404:
+            return 'started'
+        raise
+    exported_at = export_time(headers)
+    if exported_at is not None and exported_at < requested_at:
+        return 'started'
+    return 'finished'
+
+@traced('group_id')
 def export_group(gl: gitlab.Gitlab, group_id: int) -> List[Dict]:
     logging.info(f'Starting export for group {group_id}')
-    group = gl.groups.get(group_id)
-    export = group.exports.create()
+    response = gl.http_request('post', f'/groups/{group_id}/export')
+    requested_at = server_time(response.headers)
     logging.info(f'Export created for group {group_id}, waiting for it to finish')
 
-    # Wait for the export to finish before downloading
-    time.sleep(10)
+    checked_at = [0.0]
+
+    def export_status():
+        checked_at[0] = time.monotonic()
+        return _group_export_status(gl, group_id, requested_at)
 
-    export_path = 'exports/group'
-    os.makedirs(export_path, exist_ok=True)
+    get_poller().wait_for(f'Export of group {group_id}', export_status, GROUP_EXPORT_TIMEOUT,
+                          first_check=GROUP_EXPORT_FIRST_CHECK, min_delay=GROUP_DOWNLOAD_INTERVAL)
+    # The download counts against the same limit as the status checks
+    wait = GROUP_DOWNLOAD_INTERVAL - (time.monotonic() - checked_at[0])
+    if wait > 0:
+        logging.info(f'Waiting {wait:.0f}s before downloading the export of group {group_id}')
+        time.sleep(wait)
 
-    with open(os.path.join(export_path, f'group-{group_id}-export.tgz'), 'wb') as f:
-        export.download(streamed=True, action=f.write)
+    # A new export was created, bytes of a previous one must not be resumed
+    export_file = group_export_file(group_id)
+    discard_partial(export_file)
+    get_manifest().remove(export_file)
+    download_resumable(gl, f'/groups/{group_id}/export/download', export_file)
     logging.info(f'Export for group {group_id} downloaded successfully')
 
+@traced('group_path')
 def import_group(dest_gl: gitlab.Gitlab, source_gl: gitlab.Gitlab, group_path: str, 
                 parent_id: int = None, name: str = None, path: str = None):
     """
@@ -56,50 +103,156 @@ def import_group(dest_gl: gitlab.Gitlab, source_gl: gitlab.Gitlab, group_path: s
         name = name or source_details['name']
         path = path or source_details['path']
 
-    export_file = os.path.join('exports/group', f'group-{group_path}-export.tgz')
+    export_file = group_export_file(group_path)
+    manifest = get_manifest()
+    if manifest.get(export_file) is not None and not manifest.verify(export_file):
+        raise IOError(f'{export_file} does not match the size or checksum of its download')
     
     if not parent_id:
         logging.info(f'Importing top level group from {export_file} as {name} ({path})')
         with open(export_file, 'rb') as f:
             dest_gl.groups.import_group(f, name=name, path=path)
-        logging.info(f'Top level group imported successfully from {export_file}')
+        logging.info(f'Import of top level group started from {export_file}')
     else:
         logging.info(f'Importing subgroup from {export_file} as {name} ({path})')
         with open(export_file, 'rb') as f:
             dest_gl.groups.import_group(f, parent_id=parent_id, name=name, path=path)
-        logging.info(f'Subgroup imported successfully from {export_file}')
+        logging.info(f'Import of subgroup started from {export_file}')
 
-def get_all_projects(gl: gitlab.Gitlab, group_id: int, source_group_path: str) -> List[Dict[str, str]]:
-    logging.info(f'Fetching all projects for group {group_id}')
+def subgroup_paths(gl: gitlab.Gitlab, group_id: int) -> List[str]:
+    """Paths of all descendant groups of a group, relative to it"""
     group = gl.groups.get(group_id)
-    projects = []
-    page = 1
-    per_page = 100
-    while True:
-        group_projects = group.projects.list(include_subgroups=True, page=page, per_page=per_page)
-        if not group_projects:
-            break
-        for project in group_projects:
-            project_details = gl.projects.get(project.id)  # Fetch full project details
-            default_branch = None
-            try:
-                # Attempt to fetch default_branch explicitly
-                default_branch = project_details.default_branch
-            except AttributeError:
-                logging.warning(f"Default branch not found for project {project_details.name}.")
-            
-            full_path = project_details.namespace['full_path']
-            relative_path = full_path.replace(source_group_path, '', 1).lstrip('/')
-            projects.append({
-                'project': project_details,
-                'relative_path': relative_path,
-                'name': project_details.name,
-                'id': project_details.id,
-                'path': project_details.path,
-                'url': project_details.http_url_to_repo,
-                'default_branch': default_branch or "main"  # Use fallback branch if missing
-            })
-        page += 1
+    return sorted(subgroup.full_path[len(group.full_path) + 1:]
+                  for subgroup in group.descendant_groups.list(iterator=True, per_page=PROJECTS_PER_PAGE))
+
+@traced('group_path')
+def wait_for_group_tree(gl: gitlab.Gitlab, group_path: str, subgroups: List[str]):
+    """
+    Block until an imported group and all the given subgroups (relative paths) exist.
+
+    A group import is only queued by the API, the group and its subgroups are created
+    asynchronously, so nothing may be imported into them before they all exist.
+    """
+    expected = {group_path, *(f'{group_path}/{subgroup}' for subgroup in subgroups)}
+
+    def import_status():
+        try:
+            group = gl.groups.get(group_path)
+        except gitlab.exceptions.GitlabGetError as e:
+            if e.response_code == 404:
+                return 'started'
+            raise
+        found = {group_path, *(subgroup.full_path for subgroup in
+                               group.descendant_groups.list(iterator=True, per_page=PROJECTS_PER_PAGE))}
+        return 'finished' if expected <= found else 'started'
+
+    get_poller().wait_for(f'Import of group {group_path}', import_status, GROUP_IMPORT_TIMEOUT)
+    logging.info(f'Group {group_path} and its {len(subgroups)} subgroups imported')
+
+def list_group_projects(group: Any, workers: int, statistics: bool = False) -> List[Any]:
+    """
+    List all projects of a group including subgroups, with their storage statistics
+    when `statistics` is set.
+
+    Keyset pagination is requested; when the server answers with offset pagination and
+    reports the total number of pages, the remaining pages are fetched concurrently.
+    """
+    listing = group.projects.list(include_subgroups=True, iterator=True, pagination='keyset',
+                                  order_by='id', sort='asc', per_page=PROJECTS_PER_PAGE,
+                                  statistics=statistics)
+    total_pages = listing.total_pages
+    if not total_pages or total_pages <= 1:
+        return list(listing)
+
+    projects = list(itertools.islice(listing, PROJECTS_PER_PAGE))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pages = executor.map(
+            lambda page: group.projects.list(include_subgroups=True, order_by='id', sort='asc',
+                                             page=page, per_page=PROJECTS_PER_PAGE,
+                                             statistics=statistics),
+            range(2, total_pages + 1))
+        for page_projects in pages:
+            projects.extend(page_projects)
+    return projects
+
+def project_entry(project: Any) -> Dict[str, Any]:
+    """Keep the fields of a listed project needed to build its record"""
+    return {
+        'id': project.id,
+        'name': project.name,
+        'path': project.path,
+        'path_with_namespace': project.path_with_namespace,
+        'namespace_full_path': project.namespace['full_path'],
+        'http_url_to_repo': project.http_url_to_repo,
+        'default_branch': getattr(project, 'default_branch', None),
+        'last_activity_at': getattr(project, 'last_activity_at', None)
+    }
+
+def _projects_fingerprint(group: Any) -> Dict[str, Any]:
+    """Project count and latest activity of a group, fetched with a single request"""
+    listing = group.projects.list(include_subgroups=True, iterator=True, order_by='last_activity_at',
+                                  sort='desc', per_page=1)
+    latest = next(iter(listing), None)
+    return {
+        'total': listing.total,
+        'latest_activity': getattr(latest, 'last_activity_at', None) or ''
+    }
+
+def _load_project_entries(gl: gitlab.Gitlab, group: Any, group_path: str, workers: int,
+                          inventory: Any = None) -> List[Dict[str, Any]]:
+    if inventory is not None:
+        entries = inventory.get_projects(gl.url, group_path)
+        if entries is not None:
+            if inventory.is_fresh(gl.url, 'projects', group_path):
+                logging.info(f'Using {len(entries)} projects of {group_path} from inventory')
+                return entries
+            cached = inventory.projects_fingerprint(gl.url, group_path)
+            current = _projects_fingerprint(group)
+            if current['latest_activity'] == cached['latest_activity'] and \
+                    current['total'] in (None, cached['total']):
+                logging.info(f'Inventory of {group_path} is unchanged, using {len(entries)} cached projects')
+                inventory.touch(gl.url, 'projects', group_path)
+                return entries
+            logging.info(f'Inventory of {group_path} is outdated, refreshing it')
+
+    entries = [project_entry(project) for project in list_group_projects(group, workers)]
+    if inventory is not None and inventory.enabled:
+        inventory.store_projects(gl.url, group_path, entries)
+    return entries
+
+def project_record(gl: gitlab.Gitlab, entry: Dict[str, Any], group_path: str) -> Dict[str, Any]:
+    """Project record used by the migration steps, built from a listing entry of a project of `group_path`"""
+    default_branch = entry['default_branch']
+    if not default_branch:
+        logging.warning(f"Default branch not found for project {entry['name']}.")
+
+    relative_path = entry['namespace_full_path'].replace(group_path, '', 1).lstrip('/')
+    return {
+        'project': gl.projects.get(entry['id'], lazy=True),
+        'relative_path': relative_path,
+        'name': entry['name'],
+        'id': entry['id'],
+        'path': entry['path'],
+        'path_with_namespace': entry['path_with_namespace'],
+        'url': entry['http_url_to_repo'],
+        'last_activity_at': entry['last_activity_at'],
+        'default_branch': default_branch or "main"  # Use fallback branch if missing
+    }
+
+@traced('source_group_path')
+def get_all_projects(gl: gitlab.Gitlab, group_id: int, source_group_path: str,
+                     workers: int = 8, inventory: Any = None) -> List[Dict[str, Any]]:
+    """
+    Build the project records straight from the group projects listing.
+
+    The 'project' entry is a lazy handle, it does not call the API until its
+    details are explicitly loaded. When an inventory is given the listing is
+    reused from it as long as it is valid.
+    """
+    logging.info(f'Fetching all projects for group {group_id}')
+    group = gl.groups.get(group_id, lazy=True)
+    projects = [project_record(gl, entry, source_group_path)
+                for entry in _load_project_entries(gl, group, source_group_path, workers, inventory)]
     logging.info(f'Found {len(projects)} total projects in group {group_id}')
     return projects
 
@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from typing import List, Dict, Any, Optional
+
+INVENTORY_PATH = 'cache/inventory.sqlite'
+DEFAULT_TTL = 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS listings (
+    host TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    root_path TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    total INTEGER,
+    latest_activity TEXT,
+    PRIMARY KEY (host, kind, root_path)
+);
+CREATE TABLE IF NOT EXISTS projects (
+    host TEXT NOT NULL,
+    root_path TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (host, root_path, id)
+);
+CREATE TABLE IF NOT EXISTS groups (
+    host TEXT NOT NULL,
+    root_path TEXT NOT NULL,
+    full_path TEXT NOT NULL,
+    id INTEGER,
+    data TEXT,
+    PRIMARY KEY (host, root_path, full_path)
+);
+CREATE TABLE IF NOT EXISTS path_mapping (
+    source_host TEXT NOT NULL,
+    source_path TEXT NOT NULL,
+    dest_host TEXT NOT NULL,
+    dest_path TEXT NOT NULL,
+    PRIMARY KEY (source_host, source_path, dest_host)
+);
+"""
+
+
+class Inventory:
+    """
+    Local SQLite inventory of groups, projects and source to destination path mapping.
+
+    Listings younger than `ttl` seconds are used without any API call. Older project
+    listings are revalidated by comparing the project count and the latest
+    `last_activity_at` reported by the server with the cached ones.
+
+    Args:
+        path: Location of the SQLite database
+        ttl: Seconds during which a listing is trusted without revalidation, 0 disables the cache
+    """
+
+    def __init__(self, path: str = INVENTORY_PATH, ttl: int = DEFAULT_TTL):
+        self.ttl = ttl
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def _listing(self, host: str, kind: str, root_path: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute(
+                'SELECT fetched_at, total, latest_activity FROM listings '
+                'WHERE host = ? AND kind = ? AND root_path = ?', (host, kind, root_path)).fetchone()
+        if row is None:
+            return None
+        return {'fetched_at': row[0], 'total': row[1], 'latest_activity': row[2]}
+
+    def _store_listing(self, host: str, kind: str, root_path: str, total: Optional[int] = None,
+                       latest_activity: Optional[str] = None):
+        self._db.execute(
+            'INSERT OR REPLACE INTO listings (host, kind, root_path, fetched_at, total, latest_activity) '
+            'VALUES (?, ?, ?, ?, ?, ?)', (host, kind, root_path, time.time(), total, latest_activity))
+
+    def is_fresh(self, host: str, kind: str, root_path: str) -> bool:
+        """Whether the listing exists and is younger than the TTL"""
+        listing = self._listing(host, kind, root_path)
+        return bool(self.enabled and listing and time.time() - listing['fetched_at'] < self.ttl)
+
+    def projects_fingerprint(self, host: str, root_path: str) -> Optional[Dict[str, Any]]:
+        """Return the project count and latest activity of the cached listing"""
+        listing = self._listing(host, 'projects', root_path)
+        if listing is None:
+            return None
+        return {'total': listing['total'], 'latest_activity': listing['latest_activity']}
+
+    def touch(self, host: str, kind: str, root_path: str):
+        """Mark a listing as revalidated"""
+        with self._lock, self._db:
+            self._db.execute('UPDATE listings SET fetched_at = ? WHERE host = ? AND kind = ? AND root_path = ?',
+                             (time.time(), host, kind, root_path))
+
+    def get_projects(self, host: str, root_path: str) -> Optional[List[Dict[str, Any]]]:
+        """Return cached project entries of a group, None if the group was never listed"""
+        if not self.enabled or self._listing(host, 'projects', root_path) is None:
+            return None
+        with self._lock:
+            rows = self._db.execute('SELECT data FROM projects WHERE host = ? AND root_path = ? ORDER BY id',
+                                    (host, root_path)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def store_projects(self, host: str, root_path: str, entries: List[Dict[str, Any]]):
+        latest = max((entry.get('last_activity_at') or '' for entry in entries), default='')
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM projects WHERE host = ? AND root_path = ?', (host, root_path))
+            self._db.executemany('INSERT INTO projects (host, root_path, id, data) VALUES (?, ?, ?, ?)',
+                                 [(host, root_path, entry['id'], json.dumps(entry)) for entry in entries])
+            self._store_listing(host, 'projects', root_path, len(entries), latest)
+        logging.debug(f'Stored {len(entries)} projects of {host}/{root_path} in inventory')
+
+    def get_groups(self, host: str, root_path: str) -> Optional[List[Dict[str, Any]]]:
+        """Return cached groups of a group tree if the listing is still fresh"""
+        if not self.is_fresh(host, 'groups', root_path):
+            return None
+        with self._lock:
+            rows = self._db.execute('SELECT data FROM groups WHERE host = ? AND root_path = ? ORDER BY full_path',
+                                    (host, root_path)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def store_groups(self, host: str, root_path: str, groups: List[Dict[str, Any]]):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM groups WHERE host = ? AND root_path = ?', (host, root_path))
+            self._db.executemany(
+                'INSERT INTO groups (host, root_path, full_path, id, data) VALUES (?, ?, ?, ?, ?)',
+                [(host, root_path, group['full_path'], group.get('id'), json.dumps(group)) for group in groups])
+            self._store_listing(host, 'groups', root_path, len(groups))
+
+    def invalidate(self, host: str, root_path: str):
+        """Drop every listing of a group tree, e.g. after importing into it"""
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM listings WHERE host = ? AND root_path = ?', (host, root_path))
+
+    def record_mapping(self, source_host: str, source_path: str, dest_host: str, dest_path: str):
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO path_mapping (source_host, source_path, dest_host, dest_path) '
+                'VALUES (?, ?, ?, ?)', (source_host, source_path, dest_host, dest_path))
+
+    def destination_path(self, source_host: str, source_path: str, dest_host: str) -> Optional[str]:
+        """Return the recorded destination path of a source project or group"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT dest_path FROM path_mapping WHERE source_host = ? AND source_path = ? AND dest_host = ?',
+                (source_host, source_path, dest_host)).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+JOURNAL_PATH = 'cache/journal.jsonl'
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def atomic_write_json(path: str, data: Any):
+    """Write JSON so that the file on disk is always either the old or the new version"""
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if hasattr(os, 'O_DIRECTORY'):
+        dir_fd = os.open(directory, os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+class Journal:
+    """
+    Durable record of every unit of work of a migration.
+
+    Every state change is appended to a JSON lines log and synced to disk, so a
+    transition costs one short write whatever the size of the journal. When `resume`
+    is set the previous log is replayed, units recorded as done are skipped and the
+    log is compacted to one line per unit. Otherwise the run starts from an empty state
+    but still appends to the log, so a run without `resume` (e.g. another command)
+    never erases what a later `resume` needs. Without a path the journal is kept in
+    memory only.
+
+    Keys follow the `<kind>:<identifier>:<stage>` pattern, e.g. `project:42:download`.
+    """
+
+    def __init__(self, path: Optional[str] = JOURNAL_PATH, resume: bool = False):
+        self.path = path
+        self.resume = resume
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._file = None
+        if not path:
+            return
+        if resume and os.path.exists(path):
+            self._entries = _replay(path)
+            done = sum(1 for entry in self._entries.values() if entry['state'] == DONE)
+            logging.info(f'Resuming from journal {path}: {done} of {len(self._entries)} units already done')
+            self._compact()
+        else:
+            _terminate_last_line(path)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._file = open(path, 'a')
+
+    def _compact(self):
+        """Rewrite the log with the current state of every unit only"""
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix='.jsonl')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                for key, entry in self._entries.items():
+                    f.write(json.dumps({'key': key, **entry}, sort_keys=True) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _set(self, key: str, state: Optional[str], **info):
+        with self._lock:
+            entry = self._entries.setdefault(key, {'attempts': 0, 'state': PENDING})
+            if state == RUNNING:
+                entry['attempts'] += 1
+            if state is not None:
+                entry.pop('error', None)
+                entry['state'] = state
+            entry.update(info, updated_at=time.time())
+            if self._file is None:
+                return
+            self._file.write(json.dumps({'key': key, **entry}, sort_keys=True) + '\n')
+            self._file.flush()
+            fd = self._file.fileno()
+        # Concurrent transitions append under the lock and sync in parallel
+        os.fsync(fd)
+
+    def state(self, key: str) -> str:
+        with self._lock:
+            return self._entries.get(key, {}).get('state', PENDING)
+
+    def get(self, key: str, field: str, default: Any = None) -> Any:
+        with self._lock:
+            return self._entries.get(key, {}).get(field, default)
+
+    def is_done(self, key: str) -> bool:
+        """Whether the unit was completed by a previous run and can be skipped"""
+        return self.resume and self.state(key) == DONE
+
+    def start(self, key: str):
+        self._set(key, RUNNING)
+
+    def done(self, key: str, **info):
+        self._set(key, DONE, **info)
+
+    def fail(self, key: str, error: Any):
+        self._set(key, FAILED, error=str(error))
+
+    def note(self, key: str, **info):
+        """Record information about a unit without changing its state, e.g. the ID of what it created"""
+        self._set(key, None, **info)
+
+    @contextmanager
+    def step(self, key: str):
+        """Record the outcome of the enclosed unit of work"""
+        self.start(key)
+        try:
+            yield
+        except Exception as e:
+            self.fail(key, e)
+            raise
+        self.done(key)
+
+
+def _terminate_last_line(path: str):
+    """End a line cut short by a crash, so the lines appended next stay readable"""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, 'rb+') as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b'\n':
+            f.write(b'\n')
+
+
+def _replay(path: str) -> Dict[str, Dict[str, Any]]:
+    """Latest state of every unit of a journal log, ignoring a last line cut short by a crash"""
+    entries = {}
+    with open(path) as f:
+        for number, line in enumerate(f, start=1):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logging.warning(f'Ignoring truncated line {number} of journal {path}')
+                continue
+            entries[record.pop('key')] = record
+    return entries
@@ -0,0 +1,118 @@
+import os
+import json
+import time
+import shutil
+import logging
+import threading
+import subprocess
+from contextlib import contextmanager
+from collections import defaultdict
+from urllib.parse import urlparse
+from typing import Any, Dict
+from migration.journal import atomic_write_json
+from migration.telemetry import traced
+
+MIRROR_CACHE_PATH = 'cache/mirrors'
+MIRROR_REFSPECS = ('+refs/heads/*:refs/heads/*', '+refs/tags/*:refs/tags/*')
+
+
+def directory_size(path: str) -> int:
+    """Total size of the files under a directory, links not followed"""
+    size = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return size
+
+
+class MirrorCache:
+    """
+    Persistent bare mirrors of repositories, keyed by GitLab host and project ID.
+
+    A mirror is created on first use and refreshed with an incremental `git fetch`
+    afterwards, so repeated runs only transfer new objects. Clones borrow the mirror
+    objects through `--reference` instead of downloading them again. The remote URL,
+    which holds the token, is never stored in the mirror. Once the mirrors take more
+    than `max_bytes`, the least recently used ones that are not in use are evicted.
+
+    Args:
+        path: Directory holding the mirrors and their index
+        max_bytes: Maximum total size of the mirrors
+    """
+
+    def __init__(self, path: str = MIRROR_CACHE_PATH, max_bytes: int = 0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._index_path = os.path.join(path, 'index.json')
+        self._lock = threading.Lock()
+        self._mirror_locks = defaultdict(threading.Lock)
+        self._in_use = defaultdict(int)
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(self._index_path):
+            with open(self._index_path) as f:
+                self._entries = json.load(f)
+        os.makedirs(path, exist_ok=True)
+
+    def _key(self, host: str, project_id: int) -> str:
+        return f'{urlparse(host).netloc or host}/{project_id}'
+
+    @traced('mirror')
+    def _refresh(self, mirror: str, url: str):
+        if not os.path.exists(os.path.join(mirror, 'HEAD')):
+            subprocess.run(['git', 'init', '--bare', '--quiet', mirror], check=True, capture_output=True, text=True)
+        subprocess.run(
+            ['git', 'fetch', '--quiet', '--prune', '--no-tags', url, *MIRROR_REFSPECS],
+            cwd=mirror,
+            check=True,
+            capture_output=True,
+            text=True
+        )
+
+    @contextmanager
+    def use(self, host: str, project_id: int, url: str):
+        """
+        Yield the path of the up to date mirror of a project.
+
+        The mirror is not evicted while it is in use.
+        """
+        key = self._key(host, project_id)
+        mirror = os.path.join(self.path, f'{key}.git')
+        with self._lock:
+            self._in_use[key] += 1
+        try:
+            with self._mirror_locks[key]:
+                created = not os.path.exists(mirror)
+                logging.info(f"{'Creating' if created else 'Refreshing'} mirror of project {project_id}")
+                try:
+                    self._refresh(mirror, url)
+                except subprocess.CalledProcessError:
+                    if created:
+                        shutil.rmtree(mirror, ignore_errors=True)
+                    raise
+                size = directory_size(mirror)
+            with self._lock:
+                self._entries[key] = {'size': size, 'used_at': time.time()}
+                self._evict()
+                self._save()
+            yield mirror
+        finally:
+            with self._lock:
+                self._in_use[key] -= 1
+
+    def _evict(self):
+        total = sum(entry['size'] for entry in self._entries.values())
+        for key, entry in sorted(self._entries.items(), key=lambda item: item[1]['used_at']):
+            if total <= self.max_bytes:
+                break
+            if self._in_use[key]:
+                continue
+            logging.info(f"Evicting mirror {key} ({entry['size'] / 1024 ** 2:.1f} MB)")
+            shutil.rmtree(os.path.join(self.path, f'{key}.git'), ignore_errors=True)
+            total -= entry['size']
+            del self._entries[key]
+
+    def _save(self):
+        atomic_write_json(self._index_path, self._entries)
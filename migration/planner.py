@@ -0,0 +1,156 @@
+import os
+import json
+import heapq
+import logging
+import gitlab
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
+from migration.group_manager import list_group_projects
+
+REPORTS_PATH = 'reports'
+# Statistics making up the content of a project export archive
+EXPORTED_STATISTICS = ('repository_size', 'wiki_size', 'lfs_objects_size', 'uploads_size', 'snippets_size')
+# Rough throughput of GitLab exports and imports, used to turn sizes into durations
+EXPORT_MB_PER_SECOND = 20.0
+IMPORT_MB_PER_SECOND = 8.0
+# Time every export or import takes regardless of its size (job scheduling, status polling)
+OVERHEAD_SECONDS = 30.0
+
+
+@lru_cache(maxsize=None)
+def project_sizes(gl: gitlab.Gitlab, group_id: int, workers: int = 8) -> Dict[int, Dict[str, int]]:
+    """Storage statistics of every project of a group, fetched once per run"""
+    logging.info(f'Fetching project statistics for group {group_id}')
+    group = gl.groups.get(group_id, lazy=True)
+    sizes = {}
+    for project in list_group_projects(group, workers, statistics=True):
+        statistics = getattr(project, 'statistics', None) or {}
+        sizes[project.id] = {
+            'storage_size': statistics.get('storage_size', 0),
+            'repository_size': statistics.get('repository_size', 0),
+            'export_size': sum(statistics.get(name, 0) for name in EXPORTED_STATISTICS)
+        }
+    return sizes
+
+def estimate_seconds(size: int, mb_per_second: float) -> float:
+    return OVERHEAD_SECONDS + size / 1024 ** 2 / mb_per_second
+
+def order_largest_first(projects: List[Dict[str, Any]], sizes: Dict[int, Dict[str, int]]) -> List[Dict[str, Any]]:
+    """
+    Sort projects by decreasing export size.
+
+    Handing the sorted projects to a worker pool is longest-processing-time-first
+    scheduling: big projects start first and small ones fill the gaps at the end.
+    """
+    return sorted(projects, key=lambda project: sizes.get(project['id'], {}).get('export_size', 0),
+                  reverse=True)
+
+def simulate(order: List[Any], export_seconds: Dict[Any, float], import_seconds: Dict[Any, float],
+             export_workers: int, import_workers: int, pipeline: bool) -> Tuple[float, Dict[Any, int]]:
+    """
+    Replay the migration of projects handed to the pools in the given order.
+
+    Exports run on `export_workers` lanes. Imports start once all exports are done and
+    run one at a time, or with `pipeline` on `import_workers` lanes as soon as their
+    export is downloaded. Returns the total duration and the export lane of every project.
+    """
+    lanes = [(0.0, lane) for lane in range(export_workers)]
+    exported = []
+    assignment = {}
+    for key in order:
+        free_at, lane = heapq.heappop(lanes)
+        finish = free_at + export_seconds[key]
+        heapq.heappush(lanes, (finish, lane))
+        exported.append((finish, key))
+        assignment[key] = lane
+    exported.sort()
+
+    if not pipeline:
+        start = max((finish for finish, _ in exported), default=0.0)
+        return start + sum(import_seconds[key] for _, key in exported), assignment
+
+    importers = [0.0] * import_workers
+    end = 0.0
+    for finish, key in exported:
+        free_at = heapq.heappop(importers)
+        done = max(free_at, finish) + import_seconds[key]
+        heapq.heappush(importers, done)
+        end = max(end, done)
+    return end, assignment
+
+def lower_bound(export_seconds: Dict[Any, float], import_seconds: Dict[Any, float],
+                export_workers: int, import_workers: int, pipeline: bool) -> float:
+    """Duration no schedule can beat: the longest project, or the total work spread over all lanes"""
+    if not export_seconds:
+        return 0.0
+    longest = max(export_seconds[key] + import_seconds[key] for key in export_seconds)
+    exports = sum(export_seconds.values()) / export_workers
+    if not pipeline:
+        return max(exports, max(export_seconds.values())) + sum(import_seconds.values())
+    imports = sum(import_seconds.values()) / import_workers
+    return max(longest, exports, imports)
+
+def build_plan(projects: List[Dict[str, Any]], sizes: Dict[int, Dict[str, int]], export_workers: int,
+               import_workers: int, pipeline: bool) -> Dict[str, Any]:
+    """
+    Estimate the export and import duration of every project and schedule them
+    largest first across the worker pools.
+    """
+    export_seconds = {}
+    import_seconds = {}
+    for project in projects:
+        size = sizes.get(project['id'], {}).get('export_size', 0)
+        export_seconds[project['id']] = estimate_seconds(size, EXPORT_MB_PER_SECOND)
+        import_seconds[project['id']] = estimate_seconds(size, IMPORT_MB_PER_SECOND)
+
+    ordered = order_largest_first(projects, sizes)
+    makespan, lanes = simulate([project['id'] for project in ordered], export_seconds, import_seconds,
+                               export_workers, import_workers, pipeline)
+    listing_makespan, _ = simulate([project['id'] for project in projects], export_seconds,
+                                   import_seconds, export_workers, import_workers, pipeline)
+    return {
+        'export_workers': export_workers,
+        'import_workers': import_workers if pipeline else 1,
+        'pipeline': pipeline,
+        'total_export_size': sum(sizes.get(project['id'], {}).get('export_size', 0) for project in projects),
+        'estimated_seconds': round(makespan),
+        'listing_order_seconds': round(listing_makespan),
+        'lower_bound_seconds': round(lower_bound(export_seconds, import_seconds, export_workers,
+                                                 import_workers, pipeline)),
+        'projects': [{
+            'id': project['id'],
+            'path_with_namespace': project['path_with_namespace'],
+            **sizes.get(project['id'], {'storage_size': 0, 'repository_size': 0, 'export_size': 0}),
+            'export_seconds': round(export_seconds[project['id']]),
+            'import_seconds': round(import_seconds[project['id']]),
+            'export_worker': lanes[project['id']]
+        } for project in ordered]
+    }
+
+def _duration(seconds: float) -> str:
+    hours, rest = divmod(int(seconds), 3600)
+    return f'{hours}h{rest // 60:02d}m{rest % 60:02d}s'
+
+def format_plan(plan: Dict[str, Any]) -> str:
+    lines = [f"{'#':>4}  {'export MB':>10}  {'storage MB':>10}  {'export':>9}  {'import':>9}  {'worker':>6}  project"]
+    for position, project in enumerate(plan['projects'], start=1):
+        lines.append(f"{position:>4}  {project['export_size'] / 1024 ** 2:>10.1f}  "
+                     f"{project['storage_size'] / 1024 ** 2:>10.1f}  {_duration(project['export_seconds']):>9}  "
+                     f"{_duration(project['import_seconds']):>9}  {project['export_worker']:>6}  "
+                     f"{project['path_with_namespace']}")
+    lines.append('')
+    lines.append(f"{len(plan['projects'])} projects, {plan['total_export_size'] / 1024 ** 3:.2f} GB to export "
+                 f"with {plan['export_workers']} export workers and {plan['import_workers']} import workers"
+                 f"{' (pipeline)' if plan['pipeline'] else ''}")
+    lines.append(f"Estimated duration largest first: {_duration(plan['estimated_seconds'])}, "
+                 f"in listing order: {_duration(plan['listing_order_seconds'])}, "
+                 f"lower bound: {_duration(plan['lower_bound_seconds'])}")
+    return '\n'.join(lines)
+
+def write_plan(plan: Dict[str, Any]) -> str:
+    os.makedirs(REPORTS_PATH, exist_ok=True)
+    plan_path = os.path.join(REPORTS_PATH, f"plan-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(plan_path, 'w') as f:
+        json.dump(plan, f, indent=2)
+    return plan_path
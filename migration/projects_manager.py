@@ -1,79 +1,540 @@
 import os
-import time
+import queue
 import logging
+import tempfile
+import threading
 import gitlab
-from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Any, Callable, Optional, Tuple
 from retry import retry
+from gitlab.v4.objects import ProjectExport
+from migration.status_poller import get_poller, FAILED
+from migration.journal import Journal, PENDING
+from migration.downloads import (CHUNK_SIZE, download_resumable, discard_partial, get_manifest, server_time,
+                                 export_time)
+from migration.export_cache import ExportCache
+from migration.telemetry import traced
 
-@retry(tries=3, delay=10)
-def download_project(export: Any, project_id: int):
+EXPORT_PATH = 'exports/projects'
+EXPORT_TIMEOUT = 6 * 3600
+IMPORT_TIMEOUT = 6 * 3600
+# Archives up to this size are streamed from the export to the import in memory
+SPOOL_MB = 256
+# Export statuses of a server export that is finished or still being generated
+REUSABLE_EXPORT_STATUSES = {'finished', 'queued', 'started', 'regeneration_in_progress'}
+
+def _export_file(project_id: int) -> str:
+    return os.path.join(EXPORT_PATH, f'{project_id}-export.tgz')
+
+def destination_project_namespace(project_info: Dict[str, Any], destination_parent_path: str,
+                                  new_group_path: str) -> str:
+    """Namespace a project is imported into at the destination"""
+    return os.path.join(destination_parent_path, new_group_path,
+                        project_info['relative_path']).rstrip('/')
+
+def destination_project_path(project_info: Dict[str, Any], destination_parent_path: str,
+                             new_group_path: str) -> str:
+    """Full path of a project once imported to the destination"""
+    namespace = destination_project_namespace(project_info, destination_parent_path, new_group_path)
+    return f"{namespace}/{project_info['path']}"
+
+@traced('project_id')
+def _wait_for_export(export: Any, project_id: int):
     logging.info(f'Waiting for export to finish for project {project_id}')
-    export.refresh()
-    while export.export_status != 'finished':
-        time.sleep(1)
+
+    def export_status():
         export.refresh()
+        return export.export_status
 
-    export_path = 'exports/projects'
-    os.makedirs(export_path, exist_ok=True)
+    get_poller().wait_for(f'Export of project {project_id}', export_status, EXPORT_TIMEOUT)
 
-    with open(os.path.join(export_path, f'{project_id}-export.tgz'), 'wb') as f:
-        export.download(streamed=True, action=f.write)
+@traced('project_id')
+@retry(tries=3, delay=10)
+def download_project(export: Any, project_id: int, chunk_size: int = CHUNK_SIZE,
+                     last_activity_at: str = None):
+    """
+    Download a finished export, every retry resumes from the bytes already downloaded.
+    The archive is recorded with the `last_activity_at` of the project it was made of.
+    """
+    _wait_for_export(export, project_id)
+
+    download_resumable(export.manager.gitlab, f'/projects/{project_id}/export/download',
+                       _export_file(project_id), chunk_size, last_activity_at=last_activity_at)
     logging.info(f'Export for project {project_id} downloaded successfully')
 
-def export_projects(gl: gitlab.Gitlab, projects: List[Dict[str, str]]):
+def _discard_download(export_file: str):
+    """Forget the archive of a previous export, so a later download is never matched to it"""
+    get_manifest().remove(export_file)
+    discard_partial(export_file)
+    if os.path.exists(export_file):
+        os.remove(export_file)
+
+def _download_reusable(project_info: Dict[str, Any], journal: Journal, export_file: str) -> bool:
+    """
+    Whether the archive on disk can be imported: it was downloaded by the run being
+    resumed, or it was made of the current state of the project.
+    """
+    if journal.is_done(f"project:{project_info['id']}:download") and os.path.exists(export_file):
+        return True
+    manifest = get_manifest()
+    if not manifest.is_complete(export_file) or project_info.get('last_activity_at') is None:
+        return False
+    return manifest.get(export_file).get('last_activity_at') == project_info['last_activity_at']
+
+def _export_reusable(project: Any, export: Any, requested_at: Optional[float]) -> bool:
+    """
+    Whether a server export can be downloaded instead of creating a new one. Failed
+    (or unknown) exports never are. A finished export must have been written after the
+    recorded export request, an older file was made by another export.
+    """
+    if export.export_status not in REUSABLE_EXPORT_STATUSES:
+        return False
+    if export.export_status != 'finished' or requested_at is None:
+        return True
+    try:
+        headers = export.manager.gitlab.http_head(f'/projects/{project.id}/export/download')
+    except gitlab.exceptions.GitlabHttpError:
+        return False
+    exported_at = export_time(headers)
+    return exported_at is None or exported_at.timestamp() >= requested_at
+
+def _create_export(project: Any) -> Tuple[Any, float]:
+    """Request an export of a project, returns it with the server time of the request"""
+    response = project.manager.gitlab.http_request('post', f'/projects/{project.id}/export')
+    return ProjectExport(project.exports, {'export_status': 'queued'}), server_time(response.headers).timestamp()
+
+def _start_export(project_info: Dict[str, Any], journal: Journal, cache: ExportCache = None) -> Any:
+    """
+    Create an export of a project, or reuse the one created by a previous run when
+    the journal or the export cache shows it was made of the current project state.
+    """
+    project = project_info['project']
+    key = f'project:{project.id}:export'
+    server_export = cache.server_export(project_info) if cache is not None else None
+    if journal.is_done(key) or server_export is not None:
+        export = project.exports.get()
+        if _export_reusable(project, export, server_export and server_export['requested_at']):
+            logging.info(f'Reusing export of project {project.id} created by a previous run')
+            # A partial download of this export is resumed, an older archive is not used
+            get_manifest().remove(_export_file(project.id))
+            return export
+        logging.info(f'Export of project {project.id} created by a previous run is '
+                     f'{export.export_status}, not reusing it')
+        if cache is not None:
+            cache.forget_server_export(project_info)
+    logging.info(f'Creating export for project {project.id}')
+    _discard_download(_export_file(project.id))
+    with journal.step(key):
+        export, requested_at = _create_export(project)
+    if cache is not None:
+        cache.record_server_export(project_info, requested_at)
+    return export
+
+@traced('project_info')
+def export_project(project_info: Dict[str, Any], journal: Journal, chunk_size: int = CHUNK_SIZE,
+                   cache: ExportCache = None) -> bool:
+    """
+    Create an export for a single project and download it once it has finished.
+
+    Returns False when the journal shows the project is already imported and
+    there is nothing left to export.
+    """
+    project = project_info['project']
+    key = f'project:{project.id}'
+    export_file = _export_file(project.id)
+    manifest = get_manifest()
+    if journal.is_done(f'{key}:import'):
+        logging.info(f'Project {project.id} already imported, skipping export')
+        return False
+    if _download_reusable(project_info, journal, export_file):
+        logging.info(f'Export of project {project.id} already downloaded, skipping export')
+        return True
+    if cache is not None:
+        entry = cache.restore(project_info, export_file)
+        if entry is not None:
+            logging.info(f'Using cached export of project {project.id}, unchanged since '
+                         f"{project_info['last_activity_at']}")
+            manifest.record(export_file, entry['size'], entry['sha256'],
+                            last_activity_at=project_info['last_activity_at'])
+            return True
+
+    export = _start_export(project_info, journal, cache)
+    with journal.step(f'{key}:download'):
+        download_project(export, project.id, chunk_size, project_info.get('last_activity_at'))
+    if cache is not None:
+        cache.store(project_info, export_file, manifest.get(export_file)['sha256'])
+    return True
+
+@traced()
+def export_projects(gl: gitlab.Gitlab, projects: List[Dict[str, str]], workers: int = 4,
+                    journal: Journal = None, chunk_size: int = CHUNK_SIZE, cache: ExportCache = None):
     """
     Export all projects to local files.
+
+    Exports are handled by a bounded pool of workers: each worker creates an export,
+    waits for it to finish and downloads it, so at most `workers` exports are in flight.
+    Downloads are read in chunks of `chunk_size` bytes and resumed after a failure.
+    Unchanged projects are taken from the export `cache` when one is given.
     """
-    exports = []
-    logging.info(f'Starting export for {len(projects)} projects')
+    journal = journal or Journal(None)
+    total = len(projects)
+    failed = []
+    logging.info(f'Starting export for {total} projects with {workers} workers')
 
-    for project_info in projects:
-        project = project_info['project']
-        logging.info(f'Creating export for project {project.id}')
-        export = project.exports.create()
-        exports.append((project.id, export))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(export_project, project_info, journal, chunk_size, cache): project_info
+                   for project_info in projects}
+        for done, future in enumerate(as_completed(futures), start=1):
+            project_info = futures[future]
+            try:
+                future.result()
+                logging.info(f'[{done}/{total}] Exported project {project_info["name"]} '
+                             f'({project_info["id"]})')
+            except Exception as e:
+                logging.error(f'[{done}/{total}] Failed to export project {project_info["name"]} '
+                              f'({project_info["id"]}): {e}')
+                failed.append(project_info['id'])
 
-    for project_id, export in exports:
-        download_project(export, project_id)
+    if failed:
+        raise RuntimeError(f'Failed to export projects: {failed}')
 
+def _start_import(gl: gitlab.Gitlab, archive: Any, project_path: str, project_name: str,
+                  namespace: str) -> int:
+    """Upload an export archive, returning the ID of the project being imported"""
+    output = gl.projects.import_project(archive, path=project_path, name=project_name,
+                                        namespace=namespace)
+    return output['id']
+
+def _wait_for_import(gl: gitlab.Gitlab, project_id: int, project_name: str):
+    project_import = gl.projects.get(project_id, lazy=True).imports.get()
+
+    def import_status():
+        project_import.refresh()
+        # Nothing is being imported into the project, it was not created by an upload
+        if project_import.import_status == 'none':
+            return FAILED
+        return project_import.import_status
+
+    get_poller().wait_for(f'Import of project {project_name}', import_status, IMPORT_TIMEOUT)
+    logging.info(f'Project {project_name} imported successfully')
+
+@traced('project_path')
+def _import_archive(gl: gitlab.Gitlab, archive: Any, project_path: str, project_name: str,
+                    namespace: str):
+    """Upload an export archive and wait until the project is imported"""
+    project_id = _start_import(gl, archive, project_path, project_name, namespace)
+    _wait_for_import(gl, project_id, project_name)
+
+@traced('project_id')
 @retry(tries=3, delay=10)
 def upload_project(gl: gitlab.Gitlab, project_id: int, project_path: str, 
-                   project_name: str, namespace: str):
+                   project_name: str, namespace: str) -> bool:
     """
     Upload a project to GitLab.
+
+    Returns True if the project was imported.
     """
 
-    export_file = os.path.join('exports/projects', f'{project_id}-export.tgz')
+    export_file = _export_file(project_id)
     logging.info(f'Uploading project from {export_file} to path "{project_path}", '
                  f'namespace "{namespace}"')
 
     try:
+        manifest = get_manifest()
+        if manifest.get(export_file) is not None and not manifest.verify(export_file):
+            manifest.remove(export_file)
+            os.remove(export_file)
+            raise IOError(f'{export_file} does not match the size or checksum of its download')
         with open(export_file, 'rb') as f:
-            output = gl.projects.import_project(f, path=project_path, name=project_name, 
-                                                namespace=namespace)
-
-        project_import = gl.projects.get(output['id'], lazy=True).imports.get()
-        while project_import.import_status != 'finished':
-            time.sleep(1)
-            project_import.refresh()
-
-        logging.info(f'Project {project_name} imported successfully')
+            _import_archive(gl, f, project_path, project_name, namespace)
         os.remove(export_file)
+        manifest.remove(export_file)
         logging.info(f'Deleted exported file: {export_file}')
+        return True
     except Exception as e:
         logging.error(f"Failed to upload project {project_name}: {e}")
+        return False
+
+
+def import_project(gl: gitlab.Gitlab, project_info: Dict[str, Any], destination_parent_path: str,
+                   new_group_path: str, journal: Journal) -> bool:
+    """
+    Upload the downloaded export of a project, recording the import in the journal.
+
+    Returns True if the project is imported, including by a previous run.
+    """
+    key = f"project:{project_info['id']}:import"
+    if journal.is_done(key):
+        logging.info(f"Project {project_info['name']} already imported, skipping")
+        return True
 
+    destination_namespace = destination_project_namespace(project_info, destination_parent_path,
+                                                          new_group_path)
+    journal.start(key)
+    if upload_project(gl, project_info['id'], project_info['path'], project_info['name'],
+                      destination_namespace):
+        journal.done(key, destination=f"{destination_namespace}/{project_info['path']}")
+        return True
+    journal.fail(key, f'Failed to upload project {project_info["name"]}')
+    return False
 
+@traced()
 def import_projects(gl: gitlab.Gitlab, projects: List[Dict[str, str]], 
-                   destination_parent_path: str, new_group_path: str):
+                   destination_parent_path: str, new_group_path: str, journal: Journal = None):
     """
     Import projects to destination GitLab instance.
     """
+    journal = journal or Journal(None)
     for project_info in projects:
-        project_id = project_info['id']
-        project_name = project_info['name']
-        project_path = project_info['path']
-        relative_path = project_info['relative_path']
-        destination_namespace = os.path.join(destination_parent_path, new_group_path, 
-                                           relative_path).rstrip('/')
-        upload_project(gl, project_id, project_path, project_name, destination_namespace)
\ No newline at end of file
+        import_project(gl, project_info, destination_parent_path, new_group_path, journal)
+
+
+class _StagingLimit:
+    """
+    Keeps track of the size of downloaded archives waiting for import and blocks
+    new exports while it is above the configured limit (0 means unlimited).
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.staged = 0
+        self._condition = threading.Condition()
+
+    def wait(self):
+        with self._condition:
+            while self.max_bytes and self.staged >= self.max_bytes:
+                self._condition.wait()
+
+    def add(self, size: int):
+        with self._condition:
+            self.staged += size
+
+    def release(self, size: int):
+        with self._condition:
+            self.staged -= size
+            self._condition.notify_all()
+
+
+@traced()
+def migrate_projects_pipelined(source_gl: gitlab.Gitlab, dest_gl: gitlab.Gitlab,
+                               projects: List[Dict[str, Any]], destination_parent_path: str,
+                               new_group_path: str, export_workers: int = 4,
+                               import_workers: int = 2, max_staged_gb: float = 0,
+                               journal: Journal = None, chunk_size: int = CHUNK_SIZE,
+                               cache: ExportCache = None):
+    """
+    Export and import projects as a pipeline.
+
+    Export workers push every downloaded archive onto a queue and import workers upload
+    it as soon as it lands, so the destination starts importing while other projects are
+    still exporting. New exports are paused while the archives waiting for import take
+    more than `max_staged_gb` GB of disk.
+    """
+    journal = journal or Journal(None)
+    total = len(projects)
+    staged = queue.Queue()
+    limit = _StagingLimit(int(max_staged_gb * 1024 ** 3))
+    failed = []
+    counter_lock = threading.Lock()
+    counters = {'exported': 0, 'imported': 0}
+
+    logging.info(f'Starting pipelined migration for {total} projects with {export_workers} '
+                 f'export workers and {import_workers} import workers')
+
+    def export_worker(project_info: Dict[str, Any]):
+        limit.wait()
+        try:
+            if not export_project(project_info, journal, chunk_size, cache):
+                return
+        except Exception as e:
+            logging.error(f'Failed to export project {project_info["name"]} '
+                          f'({project_info["id"]}): {e}')
+            failed.append(project_info['id'])
+            return
+        size = os.path.getsize(_export_file(project_info['id']))
+        limit.add(size)
+        with counter_lock:
+            counters['exported'] += 1
+            logging.info(f'[{counters["exported"]}/{total}] Exported project '
+                         f'{project_info["name"]} ({project_info["id"]}), '
+                         f'{limit.staged / 1024 ** 3:.2f} GB staged')
+        staged.put((project_info, size))
+
+    def import_worker():
+        while True:
+            item = staged.get()
+            if item is None:
+                return
+            project_info, size = item
+            try:
+                import_project(dest_gl, project_info, destination_parent_path, new_group_path,
+                               journal)
+            finally:
+                limit.release(size)
+            with counter_lock:
+                counters['imported'] += 1
+                logging.info(f'[{counters["imported"]}/{total}] Processed import of project '
+                             f'{project_info["name"]} ({project_info["id"]})')
+
+    with ThreadPoolExecutor(max_workers=import_workers) as importers:
+        for _ in range(import_workers):
+            importers.submit(import_worker)
+
+        with ThreadPoolExecutor(max_workers=export_workers) as exporters:
+            for project_info in projects:
+                exporters.submit(export_worker, project_info)
+
+        for _ in range(import_workers):
+            staged.put(None)
+
+    if failed:
+        raise RuntimeError(f'Failed to export projects: {failed}')
+
+
+class _SpooledUpload:
+    """
+    Read-only view of a spooled archive for the multipart upload.
+
+    The multipart encoder sizes file objects through `fileno()`, which would roll a
+    `SpooledTemporaryFile` over to disk, so only `read()` and the number of bytes
+    left (`len`) are exposed.
+    """
+
+    def __init__(self, archive: Any, size: int):
+        self.archive = archive
+        self.size = size
+
+    @property
+    def len(self) -> int:
+        return self.size - self.archive.tell()
+
+    def read(self, length: int = -1) -> bytes:
+        return self.archive.read(length)
+
+
+def _existing_project(gl: gitlab.Gitlab, project: Any) -> Any:
+    """The destination project with this ID or path, None when there is none"""
+    try:
+        return gl.projects.get(project)
+    except gitlab.exceptions.GitlabGetError:
+        return None
+
+def _answered(error: Exception) -> bool:
+    """Whether the server rejected an upload, as opposed to an upload whose outcome is unknown"""
+    return isinstance(error, gitlab.exceptions.GitlabError) and error.response_code is not None \
+        and error.response_code < 500
+
+@traced('project_id')
+@retry(tries=3, delay=10)
+def _stream_upload(export: Any, gl: gitlab.Gitlab, project_info: Dict[str, Any], namespace: str,
+                   spool_mb: int, unanswered: List[str]) -> int:
+    """
+    Download a finished export into a spool and upload it, returning the ID of the
+    imported project.
+
+    An upload that got no answer from the server may still have created the project,
+    it is recorded in `unanswered` so a retry of the same call uses that project
+    instead of colliding with it. A project found at the destination otherwise is
+    never taken for this one.
+    """
+    destination = f"{namespace}/{project_info['path']}"
+    if unanswered:
+        existing = _existing_project(gl, destination)
+        if existing is not None:
+            logging.info(f'Project {destination} created by an unanswered upload, skipping upload')
+            return existing.id
+
+    os.makedirs(EXPORT_PATH, exist_ok=True)
+    with tempfile.SpooledTemporaryFile(max_size=spool_mb * 1024 ** 2, dir=EXPORT_PATH) as archive:
+        export.download(streamed=True, action=archive.write)
+        size = archive.tell()
+        archive.seek(0)
+        logging.info(f'Streaming export of project {project_info["id"]} ({size / 1024 ** 2:.1f} MB) '
+                     f'to namespace "{namespace}"')
+        try:
+            return _start_import(gl, _SpooledUpload(archive, size), project_info['path'],
+                                 project_info['name'], namespace)
+        except Exception as e:
+            if not _answered(e):
+                unanswered.append(destination)
+            raise
+
+@traced('project_info')
+def stream_project(export: Any, gl: gitlab.Gitlab, project_info: Dict[str, Any], namespace: str,
+                   spool_mb: int = SPOOL_MB, on_upload: Callable[[int], None] = None):
+    """
+    Download a finished export and upload it to the destination without staging it
+    under the exports directory.
+
+    The archive is buffered in memory up to `spool_mb` MB and only spills to a temporary
+    file once it grows past that, since the multipart upload needs the size of the
+    archive up front. Only the download and upload are retried, never the export or
+    the wait for the import. `on_upload` is called with the ID of the project being
+    imported once the upload is accepted.
+    """
+    _wait_for_export(export, project_info['id'])
+    project_id = _stream_upload(export, gl, project_info, namespace, spool_mb, [])
+    if on_upload is not None:
+        on_upload(project_id)
+    _wait_for_import(gl, project_id, project_info['name'])
+
+def _stream_project(dest_gl: gitlab.Gitlab, project_info: Dict[str, Any], destination_parent_path: str,
+                    new_group_path: str, spool_mb: int, journal: Journal):
+    key = f"project:{project_info['id']}:import"
+    if journal.is_done(key):
+        logging.info(f"Project {project_info['name']} already imported, skipping")
+        return
+
+    namespace = destination_project_namespace(project_info, destination_parent_path, new_group_path)
+    destination = f"{namespace}/{project_info['path']}"
+    # An import started by the run being resumed is waited for instead of exported again
+    project_id = journal.get(key, 'project_id') if journal.state(key) != PENDING else None
+    existing = _existing_project(dest_gl, project_id) if project_id is not None else None
+    journal.start(key)
+    try:
+        if existing is not None:
+            logging.info(f'Import of project {destination} started by a previous run, waiting for it')
+            _wait_for_import(dest_gl, existing.id, project_info['name'])
+        else:
+            export = _start_export(project_info, journal)
+            stream_project(export, dest_gl, project_info, namespace, spool_mb,
+                           on_upload=lambda project_id: journal.note(key, project_id=project_id))
+    except Exception as e:
+        journal.fail(key, e)
+        raise
+    journal.done(key, destination=destination)
+
+@traced()
+def migrate_projects_streamed(source_gl: gitlab.Gitlab, dest_gl: gitlab.Gitlab,
+                              projects: List[Dict[str, Any]], destination_parent_path: str,
+                              new_group_path: str, workers: int = 4, spool_mb: int = SPOOL_MB,
+                              journal: Journal = None):
+    """
+    Export and import projects one by one per worker, streaming every archive from the
+    source download to the destination upload.
+
+    At most `workers` archives are in flight, so memory use stays below
+    `workers * spool_mb` MB and larger archives are the only ones touching the disk.
+    """
+    journal = journal or Journal(None)
+    total = len(projects)
+    failed = []
+    logging.info(f'Starting streamed migration for {total} projects with {workers} workers')
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_stream_project, dest_gl, project_info, destination_parent_path,
+                                   new_group_path, spool_mb, journal): project_info
+                   for project_info in projects}
+        for done, future in enumerate(as_completed(futures), start=1):
+            project_info = futures[future]
+            try:
+                future.result()
+                logging.info(f'[{done}/{total}] Migrated project {project_info["name"]} '
+                             f'({project_info["id"]})')
+            except Exception as e:
+                logging.error(f'[{done}/{total}] Failed to migrate project {project_info["name"]} '
+                              f'({project_info["id"]}): {e}')
+                failed.append(project_info['id'])
+
+    if failed:
+        raise RuntimeError(f'Failed to migrate projects: {failed}')
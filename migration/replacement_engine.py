@@ -0,0 +1,155 @@
+import os
+import re
+import ast
+import logging
+import threading
+import multiprocessing
+from typing import Dict, Iterable, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+
+FILE_PATTERNS = {
+    '.yaml',
+    '.yml',
+    '.toml',
+    '.ini',
+    '.sh',
+    'Dockerfile',
+    '.gitlab-ci.yml',
+    'build.gradle',
+    'pom.xml'
+}
+
+SKIP_DIRS = {'.git'}
+
+# Below this number of candidate files a process pool costs more than it saves
+PARALLEL_THRESHOLD = 64
+
+
+class ReplacementEngine:
+    """
+    Replacement rules compiled once per run.
+
+    All strings are matched in a single pass by one alternation regex over bytes.
+    Alternatives are ordered longest first, so at every position the longest
+    string wins (leftmost-longest semantics). Replaced text is never matched again,
+    so chained rules (a -> b, b -> c) do not cascade as they would when applied one
+    after the other. Files without any match are never decoded, files that are not
+    UTF-8 are left unchanged.
+
+    Args:
+        replacements: Mapping of strings to replace to their replacement
+        file_patterns: File name suffixes (case insensitive) of the files to process
+    """
+
+    def __init__(self, replacements: Dict[str, str], file_patterns: Iterable[str] = FILE_PATTERNS):
+        self.replacements = {old: new for old, new in replacements.items() if old}
+        self.file_patterns = sorted(file_patterns)
+        self._suffixes = tuple(pattern.lower() for pattern in self.file_patterns)
+        self._table = {old.encode('utf-8'): new.encode('utf-8') for old, new in self.replacements.items()}
+        keys = sorted(self._table, key=len, reverse=True)
+        self._pattern = re.compile(b'|'.join(re.escape(key) for key in keys)) if keys else None
+
+    @classmethod
+    def from_env(cls) -> 'ReplacementEngine':
+        """Build the engine from the REPLACEMENTS environment variable"""
+        return cls(ast.literal_eval(os.environ["REPLACEMENTS"]))
+
+    def matches_file(self, file_name: str) -> bool:
+        return file_name.lower().endswith(self._suffixes)
+
+    def replace_bytes(self, content: bytes) -> Tuple[bytes, Dict[str, int]]:
+        """
+        Replace all occurrences in UTF-8 encoded content.
+
+        Returns the new content and the number of replacements per string. Content
+        that is not valid UTF-8 is returned unchanged.
+        """
+        if self._pattern is None or self._pattern.search(content) is None:
+            return content, {}
+        try:
+            content.decode('utf-8')
+        except UnicodeDecodeError:
+            return content, {}
+
+        counts = {}
+
+        def substitute(match: re.Match) -> bytes:
+            old = match.group(0)
+            counts[old] = counts.get(old, 0) + 1
+            return self._table[old]
+
+        new_content = self._pattern.sub(substitute, content)
+        return new_content, {old.decode('utf-8'): count for old, count in counts.items()}
+
+    def replace_file(self, file_path: str) -> Dict[str, int]:
+        """Apply the replacements to a file in place, return the number of replacements per string"""
+        with open(file_path, 'rb') as f:
+            content = f.read()
+        new_content, counts = self.replace_bytes(content)
+        if counts:
+            with open(file_path, 'wb') as f:
+                f.write(new_content)
+        return counts
+
+    def candidate_files(self, directory: str) -> List[str]:
+        files = []
+        for root, dirs, names in os.walk(directory):
+            dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+            files.extend(os.path.join(root, name) for name in names if self.matches_file(name))
+        return files
+
+
+def _replace_file(engine: ReplacementEngine, file_path: str) -> Tuple[str, Optional[Dict[str, int]], Optional[str]]:
+    try:
+        return file_path, engine.replace_file(file_path), None
+    except Exception as e:
+        return file_path, None, str(e)
+
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Return the process pool shared by all replacements of the process.
+
+    The workers are spawned rather than forked: the pool is created from worker
+    threads, and forking a multithreaded process can copy locks held by other threads.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1,
+                                                mp_context=multiprocessing.get_context('spawn'))
+        return _process_pool
+
+
+def replace_in_directory(engine: ReplacementEngine, directory: str,
+                         workers: Optional[int] = None) -> Dict[str, Dict[str, int]]:
+    """
+    Apply the replacements to every matching file of a directory.
+
+    Files are spread across the shared process pool when there are enough of them,
+    `workers` sets how many of its processes a directory is split for.
+    Returns the replacement counts of every changed file.
+    """
+    files = engine.candidate_files(directory)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers > 1 and len(files) >= PARALLEL_THRESHOLD:
+        results = list(get_process_pool().map(_replace_file, [engine] * len(files), files,
+                                               chunksize=max(1, len(files) // (workers * 4))))
+    else:
+        results = [_replace_file(engine, file_path) for file_path in files]
+
+    changed = {}
+    for file_path, counts, error in results:
+        if error:
+            logging.error(f"Error processing {file_path}: {error}")
+        elif counts:
+            for old, count in counts.items():
+                logging.info(f"Replaced '{old}' with '{engine.replacements[old]}' in {file_path} ({count}x)")
+            changed[file_path] = counts
+    return changed
@@ -1,26 +1,122 @@
 import os
+import time
+import shutil
+import base64
 import subprocess
 import gitlab
 import tempfile
 import logging
 import json 
 from pathlib import Path
-import ast
+from datetime import datetime
+from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from migration.journal import Journal
+from migration.replacement_engine import ReplacementEngine, replace_in_directory
+from migration.mirror_cache import MirrorCache
+from migration.telemetry import traced
 
+REPLACEMENT_BRANCH = 'replace-gitlab-url'
+COMMIT_MESSAGE = 'Replace references in repository code (gitlab migration)'
+MR_TITLE = 'Replace strings occurrences'
+MR_DESCRIPTION = 'This MR replaces all strings defined in REPLACEMENTS variable used in migration script'
+BLOB_WORKERS = 8
+REPORTS_PATH = 'reports'
 
-def clone_repository(project, gl: gitlab.Gitlab) -> str:
-    base_path = Path(os.getcwd())
-    repositories_path = base_path / 'repositories'
-    project_path = repositories_path / project['path']
-    
+
+def _sparse_patterns(file_patterns) -> List[str]:
+    """Sparse checkout patterns matching the file name suffixes in any directory"""
+    patterns = set()
+    for pattern in file_patterns:
+        for variant in (pattern, pattern.lower(), pattern.upper()):
+            patterns.add(f'*{variant}')
+    return sorted(patterns)
+
+def _partial_clone(repo_url: str, project_path: Path, branch: str, file_patterns):
+    """
+    Blobless, depth-1 clone of a single branch with a sparse checkout, so only the
+    blobs of files matching the patterns are downloaded.
+    """
+    subprocess.run(
+        ['git', 'clone', '--filter=blob:none', '--depth', '1', '--single-branch',
+         '--branch', branch, '--no-checkout', repo_url, str(project_path)],
+        check=True,
+        capture_output=True,
+        text=True
+    )
+    subprocess.run(
+        ['git', 'sparse-checkout', 'set', '--no-cone', *_sparse_patterns(file_patterns)],
+        cwd=project_path,
+        check=True,
+        capture_output=True,
+        text=True
+    )
+    subprocess.run(
+        ['git', 'checkout', branch],
+        cwd=project_path,
+        check=True,
+        capture_output=True,
+        text=True
+    )
+
+def _reference_clone(repo_url: str, project_path: Path, branch: str, mirror: str):
+    """Single branch clone borrowing all objects from a local mirror"""
+    subprocess.run(
+        ['git', 'clone', '--reference', mirror, '--single-branch', '--branch', branch, repo_url,
+         str(project_path)],
+        check=True,
+        capture_output=True,
+        text=True
+    )
+
+def _repository_url(project, gl: gitlab.Gitlab) -> str:
+    return project['url'].replace('https://', f'https://oauth2:{gl.private_token}@')
+
+def _project_workspace(project) -> Path:
+    """Unique temporary workspace of a project, keyed by its ID"""
+    repositories_path = Path(os.getcwd()) / 'repositories'
     os.makedirs(repositories_path, exist_ok=True)
+    return Path(tempfile.mkdtemp(prefix=f"{project['id']}-", dir=repositories_path))
+
+@traced('project')
+def clone_repository(project, gl: gitlab.Gitlab, file_patterns=None, workspace: Path = None,
+                     mirror: str = None) -> str:
+    """
+    Clone a repository, fetching only what is needed to edit files matching
+    `file_patterns` when they are given, or the full repository otherwise.
+
+    Without file patterns, a local `mirror` of the repository provides the objects of
+    the full clone so that nothing else is downloaded. Partial clones never use the
+    mirror, which holds the full history.
+    """
+    workspace = workspace or _project_workspace(project)
+    project_path = workspace / project['path']
     
     if os.path.exists(project_path):
         logging.warning(f"Directory {project_path} already exists, removing it")
         subprocess.run(['rm', '-rf', str(project_path)], check=True)
     
-    repo_url = project['url'].replace('https://', f'https://oauth2:{gl.private_token}@')
-    
+    repo_url = _repository_url(project, gl)
+
+    if file_patterns:
+        logging.info(f"Partially cloning repository {project['path']} to {project_path}")
+        try:
+            _partial_clone(repo_url, project_path, project['default_branch'], file_patterns)
+            logging.info(f"Successfully cloned {project['path']} to {project_path}")
+            return str(project_path)
+        except subprocess.CalledProcessError as e:
+            logging.warning(f"Partial clone of {project['path']} failed, falling back to full clone: {e.stderr}")
+            subprocess.run(['rm', '-rf', str(project_path)], check=True)
+    elif mirror:
+        logging.info(f"Cloning repository {project['path']} to {project_path} from mirror {mirror}")
+        try:
+            _reference_clone(repo_url, project_path, project['default_branch'], mirror)
+            logging.info(f"Successfully cloned {project['path']} to {project_path}")
+            return str(project_path)
+        except subprocess.CalledProcessError as e:
+            logging.warning(f"Clone of {project['path']} from mirror failed, cloning without it: {e.stderr}")
+            subprocess.run(['rm', '-rf', str(project_path)], check=True)
+
     logging.info(f"Cloning repository {project['path']} to {project_path}")
     
     try:
@@ -37,53 +133,14 @@ def clone_repository(project, gl: gitlab.Gitlab) -> str:
         logging.error(f"Failed to clone {project['path']}: {e.stderr}")
         raise
 
-def search_and_replace(directory: str) -> None:
-    file_patterns = {
-        '.yaml',    
-        '.yml',     
-        '.toml',    
-        '.ini',     
-        '.sh',      
-        'Dockerfile',  
-        '.gitlab-ci.yml',
-        'build.gradle',
-        'pom.xml'
-    }
+def search_and_replace(directory: str, engine: ReplacementEngine = None, workers: int = None) -> None:
+    engine = engine or ReplacementEngine.from_env()
 
-    replacements = ast.literal_eval(os.environ["REPLACEMENTS"])
+    logging.info(f"Starting search and replace in {directory}")
 
-    skip_dirs = {'.git'}
+    changed = replace_in_directory(engine, directory, workers)
 
-    logging.info(f"Starting search and replace in {directory}")
-    
-    for root, dirs, files in os.walk(directory):
-        dirs[:] = [d for d in dirs if d not in skip_dirs]
-        
-        for file in files:
-            if any(file.lower().endswith(pat.lower()) for pat in file_patterns):
-                file_path = os.path.join(root, file)
-                
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                    
-                    new_content = content
-                    for old, new in replacements.items():
-                        if old in new_content:
-                            new_content = new_content.replace(old, new)
-                            logging.info(f"Replaced '{old}' with '{new}' in {file_path}")
-                    
-                    if new_content != content:
-                        with open(file_path, 'w', encoding='utf-8') as f:
-                            f.write(new_content)
-                            
-                except UnicodeDecodeError:
-                    logging.debug(f"Skipping binary file: {file_path}")
-                except Exception as e:
-                    logging.error(f"Error processing {file_path}: {str(e)}")
-                    continue
-
-    logging.info("Completed search and replace operation")
+    logging.info(f"Completed search and replace operation, {len(changed)} files changed")
 
 def create_branch_and_commit(directory: str, branch_name: str) -> bool:
     """
@@ -116,7 +173,7 @@ def create_branch_and_commit(directory: str, branch_name: str) -> bool:
         # Add and commit changes
         subprocess.run(['git', 'add', '.'], cwd=directory, check=True)
         subprocess.run(
-            ['git', 'commit', '--no-gpg-sign', '-m', 'Replace references in repository code (gitlab migration)'],
+            ['git', 'commit', '--no-gpg-sign', '-m', COMMIT_MESSAGE],
             cwd=directory,
             check=True
         )
@@ -127,9 +184,11 @@ def create_branch_and_commit(directory: str, branch_name: str) -> bool:
         logging.error(f"Git operation failed: {e.stderr if hasattr(e, 'stderr') else str(e)}")
         raise
 
+@traced('branch_name')
 def push_branch(directory, branch_name):
     subprocess.run(['git', 'push', '--set-upstream', 'origin', branch_name], cwd=directory, check=True)
 
+@traced('project')
 def create_merge_request(gl, project, source_branch, target_branch ,title, description):
     mr = project.mergerequests.create({
         'source_branch': source_branch,
@@ -139,36 +198,183 @@ def create_merge_request(gl, project, source_branch, target_branch ,title, descr
         'labels': ['gitlab-migration']
     })
     logging.info(f'Merge request created: {mr.web_url}')
+    return mr
+
+def replace_repository_code(gl, project, engine: ReplacementEngine = None, clone_strategy: str = 'partial',
+                            file_workers: int = None, mirrors: MirrorCache = None):
+    """
+    Clone the repository into its own workspace, replace strings and open a MR.
 
-def replace_repository_code(gl, project):
-    project_path = clone_repository(project, gl)
-    search_and_replace(project_path)
+    The workspace is removed once the project is done, it is kept for inspection
+    when something fails. With a mirror cache, full clones borrow the objects of the
+    project's mirror. Returns the MR URL, None when nothing changed.
+    """
+    if mirrors is not None and clone_strategy == 'full':
+        with mirrors.use(gl.url, project['id'], _repository_url(project, gl)) as mirror:
+            return _replace_in_clone(gl, project, engine, clone_strategy, file_workers, mirror)
+    return _replace_in_clone(gl, project, engine, clone_strategy, file_workers)
+
+def _replace_in_clone(gl, project, engine: ReplacementEngine, clone_strategy: str, file_workers: int,
+                      mirror: str = None):
+    engine = engine or ReplacementEngine.from_env()
+    file_patterns = engine.file_patterns if clone_strategy == 'partial' else None
+    workspace = _project_workspace(project)
+    project_path = clone_repository(project, gl, file_patterns, workspace, mirror)
+    search_and_replace(project_path, engine, file_workers)
     
-    if create_branch_and_commit(project_path, 'replace-gitlab-url'):
-        push_branch(project_path, 'replace-gitlab-url')
-        create_merge_request(
+    mr_url = None
+    if create_branch_and_commit(project_path, REPLACEMENT_BRANCH):
+        push_branch(project_path, REPLACEMENT_BRANCH)
+        mr = create_merge_request(
             gl, 
             project['project'], 
-            'replace-gitlab-url',
+            REPLACEMENT_BRANCH,
             project['default_branch'], 
-            'Replace strings occurrences', 
-            'This MR replaces all strings defined in REPLACEMENTS variable used in migration script'
+            MR_TITLE, 
+            MR_DESCRIPTION
         )
+        mr_url = mr.web_url
     else:
         logging.info(f"No changes needed for {project['path']}")
 
-def repositories_replacement(projects, gl):
+    shutil.rmtree(workspace, ignore_errors=True)
+    return mr_url
+
+@traced('project')
+def replace_repository_code_api(gl, project, engine: ReplacementEngine):
+    """
+    Replace strings without cloning the repository.
+
+    Candidate files are found through the repository tree API, only their blobs are
+    fetched, and all changes are committed on a new branch with a single Commits API
+    call before the MR is opened.
+    """
+    gl_project = project['project']
+    ref = project['default_branch']
+
+    logging.info(f"Listing repository tree of {project['path']} at {ref}")
+    tree = gl_project.repository_tree(recursive=True, ref=ref, iterator=True,
+                                      pagination='keyset', per_page=100)
+    candidates = [item['path'] for item in tree
+                  if item['type'] == 'blob' and engine.matches_file(item['name'])]
+    logging.info(f"Found {len(candidates)} candidate files in {project['path']}")
+
+    def replace_blob(file_path):
+        content = gl_project.files.raw(file_path=file_path, ref=ref)
+        new_content, counts = engine.replace_bytes(content)
+        for old, count in counts.items():
+            logging.info(f"Replaced '{old}' with '{engine.replacements[old]}' in {file_path} ({count}x)")
+        return file_path, new_content if counts else None
+
+    with ThreadPoolExecutor(max_workers=BLOB_WORKERS) as executor:
+        results = list(executor.map(replace_blob, candidates))
+
+    actions = [{
+        'action': 'update',
+        'file_path': file_path,
+        'content': base64.b64encode(new_content).decode('ascii'),
+        'encoding': 'base64'
+    } for file_path, new_content in results if new_content is not None]
+
+    if not actions:
+        logging.info(f"No changes needed for {project['path']}")
+        return None
+
+    gl_project.commits.create({
+        'branch': REPLACEMENT_BRANCH,
+        'start_branch': ref,
+        'commit_message': COMMIT_MESSAGE,
+        'actions': actions
+    })
+    logging.info(f"Created branch '{REPLACEMENT_BRANCH}' with changes in {len(actions)} files")
+    mr = create_merge_request(gl, gl_project, REPLACEMENT_BRANCH, ref, MR_TITLE, MR_DESCRIPTION)
+    return mr.web_url
+
+@traced('project')
+def _replace_project(gl, project, engine: ReplacementEngine, replace_engine: str, clone_strategy: str,
+                     file_workers: int, mirrors: MirrorCache = None):
+    if replace_engine == 'clone':
+        return replace_repository_code(gl, project, engine, clone_strategy, file_workers, mirrors)
+    try:
+        return replace_repository_code_api(gl, project, engine)
+    except gitlab.exceptions.GitlabError as e:
+        logging.warning(f"API replacement failed for {project['path']}, falling back to clone: {e}")
+        return replace_repository_code(gl, project, engine, clone_strategy, file_workers, mirrors)
+
+def check_replace_options(replace_engine: str, clone_strategy: str):
+    if replace_engine not in ('api', 'clone'):
+        raise ValueError(f"Unknown replace engine: {replace_engine}")
+    if clone_strategy not in ('partial', 'full'):
+        raise ValueError(f"Unknown clone strategy: {clone_strategy}")
+
+def replace_project(gl, project, journal: Journal, engine: ReplacementEngine, replace_engine: str = 'api',
+                    clone_strategy: str = 'partial', file_workers: int = 1,
+                    mirrors: MirrorCache = None) -> Dict[str, Any]:
+    """Replace strings in one repository unless the journal shows it was done, and return its result"""
+    key = f"destination-project:{project['id']}:replacement"
+    result = {'id': project['id'], 'path': project['path'], 'status': 'skipped', 'mr_url': None}
+    start = time.monotonic()
+    if journal.is_done(key):
+        logging.info(f"Skipping {project['path']}, replacement already done")
+        result['mr_url'] = journal.get(key, 'mr_url')
+    else:
+        journal.start(key)
+        try:
+            mr_url = _replace_project(gl, project, engine, replace_engine, clone_strategy, file_workers,
+                                      mirrors)
+            journal.done(key, mr_url=mr_url)
+            result.update(status='changed' if mr_url else 'unchanged', mr_url=mr_url)
+        except Exception as e:
+            journal.fail(key, e)
+            logging.error(f"Error processing repository {project['path']}: {e}")
+            result.update(status='failed', error=str(e))
+    result['seconds'] = round(time.monotonic() - start, 2)
+    return result
+
+def write_report(results: List[Dict[str, Any]], name: str = 'replacements') -> str:
+    """Write the results of a run to `reports/<name>-<timestamp>.json`, returning its path"""
+    os.makedirs(REPORTS_PATH, exist_ok=True)
+    report_path = os.path.join(REPORTS_PATH, f"{name}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(report_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    return report_path
+
+@traced()
+def repositories_replacement(projects, gl, journal: Journal = None, replace_engine: str = 'api',
+                             clone_strategy: str = 'partial', workers: int = 4, mirrors: MirrorCache = None):
     """Replace strings in all repositories
 
+    Projects are processed concurrently, each one in its own workspace. A summary
+    report of every project is written to the reports directory at the end.
+
     Args:
         projects (_type_): _description_
         gl (_type_): _description_
+        journal (Journal): Records replaced projects so a resumed run skips them
+        replace_engine (str): 'api' to edit files through the API without cloning,
+            falling back to a clone when it fails, or 'clone' to always clone
+        clone_strategy (str): 'partial' for a blobless, shallow, sparse clone of the
+            default branch or 'full' for a complete clone
+        workers (int): Number of projects processed concurrently
+        mirrors (MirrorCache): Local mirrors the clones borrow their objects from (optional)
     """
-    for project in projects:
-        try:
-            replace_repository_code(gl, project)
-        except Exception as e:
-            logging.error(f"Error processing repository {project['path']}: {e}")
-            continue
+    check_replace_options(replace_engine, clone_strategy)
+    journal = journal or Journal(None)
+    engine = ReplacementEngine.from_env()
+    file_workers = max(1, (os.cpu_count() or 1) // workers)
+
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(replace_project, gl, project, journal, engine, replace_engine, clone_strategy,
+                                   file_workers, mirrors) for project in projects]
+        for done, future in enumerate(as_completed(futures), start=1):
+            result = future.result()
+            results.append(result)
+            logging.info(f"[{done}/{len(projects)}] {result['path']}: {result['status']} "
+                         f"in {result['seconds']}s")
 
-    logging.info('Replacements completed')
\ No newline at end of file
+    summary = {status: sum(1 for r in results if r['status'] == status)
+               for status in ('changed', 'unchanged', 'failed', 'skipped')}
+    report_path = write_report(results)
+    logging.info(f"Replacements completed: {summary}, report written to {report_path}")
+    return results
@@ -0,0 +1,127 @@
+import time
+import shutil
+import logging
+import tempfile
+import subprocess
+import gitlab
+from typing import Any, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from migration.repository_manager import write_report
+from migration.mirror_cache import MirrorCache
+from migration.telemetry import traced
+
+SYNC_REF_PREFIXES = ('refs/heads/', 'refs/tags/')
+
+
+def authenticated_url(url: str, token: str) -> str:
+    return url.replace('://', f'://oauth2:{token}@', 1)
+
+def list_refs(url: str) -> Dict[str, str]:
+    """Branch and tag heads of a remote repository"""
+    output = subprocess.run(
+        ['git', 'ls-remote', '--heads', '--tags', url],
+        check=True,
+        capture_output=True,
+        text=True
+    ).stdout
+    refs = {}
+    for line in output.splitlines():
+        sha, ref = line.split('\t', 1)
+        if ref.startswith(SYNC_REF_PREFIXES) and not ref.endswith('^{}'):
+            refs[ref] = sha
+    return refs
+
+def diff_refs(source_refs: Dict[str, str], dest_refs: Dict[str, str], prune: bool) -> Dict[str, Optional[str]]:
+    """
+    Refs to update on the destination, mapped to their source head, or to None for
+    refs to delete when `prune` is set.
+    """
+    updates = {ref: sha for ref, sha in source_refs.items() if dest_refs.get(ref) != sha}
+    if prune:
+        updates.update({ref: None for ref in dest_refs if ref not in source_refs})
+    return updates
+
+@traced()
+def push_refs(repository: str, dest_url: str, updates: Dict[str, Optional[str]],
+              force: bool = False) -> List[str]:
+    """
+    Push the given refs from a local mirror of the source to the destination repository.
+
+    The push sends just the objects the destination does not have yet. Returns the refs
+    the destination rejected.
+    """
+    refspecs = [f"{'+' if force else ''}{sha}:{ref}" if sha else f':{ref}' for ref, sha in updates.items()]
+    result = subprocess.run(
+        ['git', 'push', '--porcelain', dest_url, *refspecs],
+        cwd=repository,
+        capture_output=True,
+        text=True
+    )
+    rejected = [line.split('\t')[1].split(':')[-1] for line in result.stdout.splitlines()
+                if line.startswith('!\t')]
+    if result.returncode != 0 and not rejected:
+        raise subprocess.CalledProcessError(result.returncode, 'git push', result.stdout, result.stderr)
+    return rejected
+
+@traced('project')
+def _sync_project(source_gl: gitlab.Gitlab, dest_gl: gitlab.Gitlab, project: Dict[str, Any],
+                  mirrors: MirrorCache, force: bool, prune: bool) -> Dict[str, Any]:
+    result = {'id': project['id'], 'path': project['path_with_namespace'],
+              'destination': project['dest_path'], 'status': 'in-sync', 'refs': {}}
+    if not project.get('dest_url'):
+        logging.warning(f"{project['path_with_namespace']} not found on the destination at {project['dest_path']}")
+        result['status'] = 'missing'
+        return result
+    start = time.monotonic()
+    source_url = authenticated_url(project['url'], source_gl.private_token)
+    dest_url = authenticated_url(project['dest_url'], dest_gl.private_token)
+    try:
+        updates = diff_refs(list_refs(source_url), list_refs(dest_url), prune)
+        if updates:
+            logging.info(f"{project['path_with_namespace']} diverged on {len(updates)} refs, syncing")
+            with mirrors.use(source_gl.url, project['id'], source_url) as mirror:
+                rejected = push_refs(mirror, dest_url, updates, force)
+            result['refs'] = {ref: sha or 'deleted' for ref, sha in updates.items()}
+            result['status'] = 'partial' if rejected else 'synced'
+            if rejected:
+                result['rejected'] = rejected
+                logging.warning(f"{project['path_with_namespace']}: destination rejected {rejected}")
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Failed to sync {project['path_with_namespace']}: {e.stderr}")
+        result.update(status='failed', error=e.stderr)
+    result['seconds'] = round(time.monotonic() - start, 2)
+    return result
+
+@traced()
+def sync_repositories(source_gl: gitlab.Gitlab, dest_gl: gitlab.Gitlab, projects: List[Dict[str, Any]],
+                      workers: int = 8, force: bool = False, prune: bool = False,
+                      mirrors: MirrorCache = None) -> List[Dict[str, Any]]:
+    """
+    Bring destination repositories up to date with their source.
+
+    Every project carries its `dest_path` and `dest_url`. Branch and tag heads of both
+    sides are compared with `git ls-remote`, and only the projects that diverged are
+    fetched into their mirror and pushed. Non fast-forward updates are rejected by the
+    destination unless `force` is set, destination refs missing on the source are
+    deleted with `prune`. Without a mirror cache, mirrors are kept in a temporary
+    directory for the run only. A report of every project is written to the reports
+    directory.
+    """
+    temporary = None
+    if mirrors is None:
+        temporary = tempfile.mkdtemp(prefix='mirrors-')
+        mirrors = MirrorCache(temporary)
+    logging.info(f'Comparing {len(projects)} repositories with {workers} workers')
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(
+                lambda project: _sync_project(source_gl, dest_gl, project, mirrors, force, prune), projects))
+    finally:
+        if temporary:
+            shutil.rmtree(temporary, ignore_errors=True)
+
+    summary = {status: sum(1 for r in results if r['status'] == status)
+               for status in ('in-sync', 'synced', 'partial', 'failed', 'missing')}
+    report_path = write_report(results, 'sync')
+    logging.info(f"Repositories sync completed: {summary}, report written to {report_path}")
+    return results
@@ -1,109 +1,297 @@
 import logging
 import gitlab
 import re
-from typing import List, Any
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Any, Callable, Tuple
 import os 
+from migration.group_manager import get_all_projects
+from migration.journal import Journal
+from migration.telemetry import traced
 
-def _get_variables(obj) -> List[Any]:
-    """Get all variables from a GitLab object (group or project)"""
-    try:
-        return obj.variables.list(all=True)
-    except gitlab.exceptions.GitlabGetError as e:
-        logging.error(f"Failed to get variables: {e}")
-        return []
+def url_rewriter() -> Callable[[str], str]:
+    """Compile the source to destination host rewrite once per run"""
+    source = os.getenv("GITLAB_SOURCE_URL").replace("https://", "")
+    dest = os.getenv("GITLAB_TARGET_URL").replace("https://", "")
+    pattern = re.compile(re.escape(source))
+    return lambda value: pattern.sub(dest, value) if value else value
 
-def _create_variable(obj, var):
+@traced('obj', 'var')
+def _create_variable(obj, var, rewrite: Callable[[str], str] = None) -> Dict[str, Any]:
     """Create a variable in a GitLab object (group or project)"""
+    rewrite = rewrite or url_rewriter()
+    result = {'key': var.key, 'environment_scope': var.environment_scope}
     try:
-        source=os.getenv("GITLAB_SOURCE_URL").replace("https://", "")
-        dest=os.getenv("GITLAB_TARGET_URL").replace("https://", "")
-        var.value = re.sub(source, dest, var.value)
-        
         obj.variables.create({
             'key': var.key,
-            'value': var.value,
+            'value': rewrite(var.value),
             'protected': var.protected,
             'masked': var.masked,
             'environment_scope': var.environment_scope
         })
         logging.info(f"Created variable {var.key}")
+        result['status'] = 'created'
     except gitlab.exceptions.GitlabCreateError as e:
         logging.error(f"Failed to create variable {var.key}: {e}")
+        result.update(status='failed', error=str(e))
+    return result
+
+@traced('obj', 'var')
+def _update_variable(obj, var, rewrite: Callable[[str], str]) -> Dict[str, Any]:
+    """Update an existing variable of a GitLab object, matching it by key and environment scope"""
+    result = {'key': var.key, 'environment_scope': var.environment_scope}
+    try:
+        obj.variables.update(var.key, {
+            'value': rewrite(var.value),
+            'protected': var.protected,
+            'masked': var.masked,
+            'environment_scope': var.environment_scope
+        }, **{'filter[environment_scope]': var.environment_scope})
+        logging.info(f"Updated variable {var.key}")
+        result['status'] = 'updated'
+    except gitlab.exceptions.GitlabUpdateError as e:
+        logging.error(f"Failed to update variable {var.key}: {e}")
+        result.update(status='failed', error=str(e))
+    return result
+
+@traced('obj', 'var')
+def _delete_variable(obj, var) -> Dict[str, Any]:
+    """Delete a variable of a GitLab object, matching it by key and environment scope"""
+    result = {'key': var.key, 'environment_scope': var.environment_scope}
+    try:
+        obj.variables.delete(var.key, **{'filter[environment_scope]': var.environment_scope})
+        logging.info(f"Deleted variable {var.key}")
+        result['status'] = 'deleted'
+    except gitlab.exceptions.GitlabDeleteError as e:
+        logging.error(f"Failed to delete variable {var.key}: {e}")
+        result.update(status='failed', error=str(e))
+    return result
+
+def _diff_variables(source_vars: List[Any], dest_vars: List[Any], rewrite: Callable[[str], str],
+                    delete: bool) -> List[tuple]:
+    """
+    Compare source and destination variables by (key, environment_scope) and return
+    the ('create' | 'update' | 'delete', variable) actions needed to sync them.
+    """
+    existing = {(var.key, var.environment_scope): var for var in dest_vars}
+    actions = []
+    for var in source_vars:
+        current = existing.pop((var.key, var.environment_scope), None)
+        if current is None:
+            actions.append(('create', var))
+        elif (current.value, current.protected, current.masked) != \
+                (rewrite(var.value), var.protected, var.masked):
+            actions.append(('update', var))
+    if delete:
+        actions.extend(('delete', var) for var in existing.values())
+    return actions
+
+def _get_group_tree(gl: gitlab.Gitlab, group_path: str, inventory: Any = None) -> List[Dict[str, Any]]:
+    """
+    Get a group and all its descendant groups as `id`/`full_path` records, sorted by path.
+
+    The whole subtree is fetched with the paginated descendant groups listing, or taken
+    from the inventory when it holds a fresh listing.
+    """
+    if inventory is not None:
+        cached = inventory.get_groups(gl.url, group_path)
+        if cached is not None and all(group.get('id') for group in cached):
+            logging.info(f"Using {len(cached)} groups of {group_path} from inventory")
+            return cached
 
-def _get_all_subgroups(gl: gitlab.Gitlab, group_path: str) -> List[str]:
-    """Recursively get all subgroups paths"""
     try:
         group = gl.groups.get(group_path)
-        subgroups = group.subgroups.list(all=True)
-        
-        all_groups = {group_path}
-        
-        for subgroup in subgroups:
-            full_path = subgroup.full_path
-            
-            all_groups.add(full_path)
-            
-            all_groups.update(_get_all_subgroups(gl, full_path))
-            
-        return sorted(list(all_groups))
-    except gitlab.exceptions.GitlabGetError as e:
+        descendants = group.descendant_groups.list(get_all=True, per_page=100)
+    except (gitlab.exceptions.GitlabGetError, gitlab.exceptions.GitlabListError) as e:
         logging.error(f"Failed to get subgroups for {group_path}: {e}")
         return []
 
-def migrate_group_variables(source_gl: gitlab.Gitlab, dest_gl: gitlab.Gitlab, 
-                          source_group_path: str, dest_group_path: str):
-    """Migrate variables from source group and all its subgroups"""
+    groups = [{'id': group.id, 'full_path': group_path}]
+    groups.extend({'id': subgroup.id, 'full_path': subgroup.full_path} for subgroup in descendants)
+    groups.sort(key=lambda record: record['full_path'])
+    if inventory is not None and inventory.enabled:
+        inventory.store_groups(gl.url, group_path, groups)
+    return groups
+
+def prepare_variables(dest_gl: gitlab.Gitlab, target: Dict[str, Any], journal: Journal,
+                      rewrite: Callable[[str], str], sync: bool = False,
+                      delete: bool = False) -> Tuple[Dict[str, Any], Any, List[tuple]]:
+    """
+    List the source variables of a target and resolve its destination object.
+
+    Returns the result of the target, the destination object and the `(action, variable)`
+    writes to apply. The result already holds its `status` when there is nothing to write
+    because the target was skipped or failed.
+    """
+    result = {'kind': target['kind'], 'source': target['source_path'],
+              'destination': target['dest_path'], 'variables': []}
+    key = f"{target['kind']}:{target['journal_id']}:variables"
+    if journal.is_done(key):
+        logging.info(f"Variables of {target['kind']} {target['source_path']} already migrated, skipping")
+        result['status'] = 'skipped'
+        return result, None, []
+    journal.start(key)
     try:
+        if 'dest' in target:
+            dest_obj = target['dest']
+        elif target['kind'] == 'group':
+            dest_obj = dest_gl.groups.get(target['dest_path'])
+        else:
+            dest_obj = dest_gl.projects.get(target['dest_path'])
+        variables = target['source'].variables.list(get_all=True)
+        if sync:
+            actions = _diff_variables(variables, dest_obj.variables.list(get_all=True), rewrite, delete)
+            result['unchanged'] = len(variables) - sum(1 for action, _ in actions if action != 'delete')
+        else:
+            actions = [('create', var) for var in variables]
+    except gitlab.exceptions.GitlabError as e:
+        logging.error(f"Failed to access {target['kind']} {target['source_path']} "
+                      f"or {target['dest_path']}: {e}")
+        journal.fail(key, e)
+        result.update(status='failed', error=str(e))
+        return result, None, []
+    logging.info(f"Migrating variables from {target['kind']} {target['source_path']} to "
+                 f"{target['dest_path']}: {len(actions)} changes for {len(variables)} variables")
+    return result, dest_obj, actions
 
-        source_groups = _get_all_subgroups(source_gl, source_group_path)
-        top_parent_group = source_groups[0]
-
-        for source_group_path in source_groups:
-
-            relative_path = source_group_path.replace(top_parent_group, '', 1).lstrip('/')
-            dest_group_full_path = f"{dest_group_path}/{relative_path}" if relative_path else dest_group_path
-            
-            try:
-                source_group = source_gl.groups.get(source_group_path)
-                dest_group = dest_gl.groups.get(dest_group_full_path)
-                
-                logging.info(f"Migrating variables from group {source_group_path} to {dest_group_full_path}")
-                group_vars = _get_variables(source_group)
-                
-                for var in group_vars:
-                    _create_variable(dest_group, var)
-                    
-            except gitlab.exceptions.GitlabGetError as e:
-                logging.error(f"Failed to access group {source_group_path} or {dest_group_full_path}: {e}")
-                continue
-                
-    except gitlab.exceptions.GitlabGetError as e:
-        logging.error(f"Failed to access group: {e}")
+def apply_variable(dest_obj: Any, action: str, var: Any, rewrite: Callable[[str], str]) -> Dict[str, Any]:
+    """Apply one write returned by `prepare_variables`, returning its outcome"""
+    if action == 'update':
+        return _update_variable(dest_obj, var, rewrite)
+    if action == 'delete':
+        return _delete_variable(dest_obj, var)
+    return _create_variable(dest_obj, var, rewrite)
+
+def finish_variables(target: Dict[str, Any], result: Dict[str, Any], journal: Journal) -> Dict[str, Any]:
+    """Set the status of a target once all its writes are applied and record it in the journal"""
+    if 'status' in result:
+        return result
+    failed = [var for var in result['variables'] if var['status'] == 'failed']
+    key = f"{target['kind']}:{target['journal_id']}:variables"
+    if failed:
+        result['status'] = 'partial'
+        journal.fail(key, f"{len(failed)} variables failed")
+    else:
+        result['status'] = 'migrated'
+        journal.done(key)
+    return result
+
+@traced()
+def migrate_variables(dest_gl: gitlab.Gitlab, targets: List[Dict[str, Any]], workers: int = 8,
+                      journal: Journal = None, sync: bool = False,
+                      delete: bool = False) -> List[Dict[str, Any]]:
+    """
+    Migrate the variables of many groups and projects concurrently.
+
+    Every target holds its `kind` ('group' or 'project'), the `source` object, its
+    `source_path` and the `dest_path` to migrate to. A target may also carry the already
+    resolved `dest` object, otherwise it is fetched by path. Source variables are listed and
+    destination objects resolved in parallel first, then all variables are written in
+    parallel. A single pool of `workers` threads caps the concurrency of both phases.
+
+    Without `sync` every source variable is created. With `sync` the destination
+    variables are listed as well and only the missing or changed ones are created or
+    updated, variables missing on the source are deleted when `delete` is set.
+
+    Returns one result per target with the status of each of its variables.
+    """
+    journal = journal or Journal(None)
+    rewrite = url_rewriter()
+    results = []
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        prepared = list(executor.map(
+            lambda target: prepare_variables(dest_gl, target, journal, rewrite, sync, delete), targets))
+
+        futures = {}
+        for result, dest_obj, actions in prepared:
+            results.append(result)
+            for action, var in actions:
+                futures[executor.submit(apply_variable, dest_obj, action, var, rewrite)] = result
+        for future in as_completed(futures):
+            futures[future]['variables'].append(future.result())
+
+    for target, result in zip(targets, results):
+        finish_variables(target, result, journal)
+
+    summary = {status: sum(1 for r in results if r['status'] == status)
+               for status in ('migrated', 'partial', 'failed', 'skipped')}
+    writes = sum(len(r['variables']) for r in results)
+    logging.info(f"Variables migrated for {len(results)} objects with {writes} writes: {summary}")
+    return results
+
+def group_variable_targets(source_gl: gitlab.Gitlab, dest_gl: gitlab.Gitlab, source_group_path: str,
+                           dest_group_path: str, inventory: Any = None) -> List[Dict[str, Any]]:
+    """Variable migration targets of a source group and all its subgroups"""
+    source_groups = _get_group_tree(source_gl, source_group_path, inventory)
+    if not source_groups:
+        return []
+    dest_groups = {group['full_path']: group['id']
+                   for group in _get_group_tree(dest_gl, dest_group_path, inventory)}
+    top_parent_group = source_groups[0]['full_path']
+
+    targets = []
+    for group in source_groups:
+        relative_path = group['full_path'].replace(top_parent_group, '', 1).lstrip('/')
+        dest_path = f"{dest_group_path}/{relative_path}" if relative_path else dest_group_path
+        target = {
+            'kind': 'group',
+            'journal_id': group['full_path'],
+            'source': source_gl.groups.get(group['id'], lazy=True),
+            'source_path': group['full_path'],
+            'dest_path': dest_path
+        }
+        if dest_path in dest_groups:
+            target['dest'] = dest_gl.groups.get(dest_groups[dest_path], lazy=True)
+        targets.append(target)
+    return targets
+
+def project_variable_target(source_project: Dict[str, Any], dest_project_path: str,
+                            dest_project: Any = None) -> Dict[str, Any]:
+    """Variable migration target of a source project record"""
+    target = {
+        'kind': 'project',
+        'journal_id': source_project['id'],
+        'source': source_project['project'],
+        'source_path': source_project['path_with_namespace'],
+        'dest_path': dest_project_path
+    }
+    if dest_project is not None:
+        target['dest'] = dest_project
+    return target
+
+def migrate_group_variables(source_gl: gitlab.Gitlab, dest_gl: gitlab.Gitlab, 
+                          source_group_path: str, dest_group_path: str, inventory: Any = None,
+                          journal: Journal = None, workers: int = 8, sync: bool = False,
+                          delete: bool = False) -> List[Dict[str, Any]]:
+    """Migrate variables from source group and all its subgroups"""
+    targets = group_variable_targets(source_gl, dest_gl, source_group_path, dest_group_path, inventory)
+    if not targets:
+        return []
+    return migrate_variables(dest_gl, targets, workers, journal, sync, delete)
 
 def migrate_project_variables(source_gl: gitlab.Gitlab, dest_gl: gitlab.Gitlab,
-                            source_group_path: str, dest_group_path: str):
+                            source_group_path: str, dest_group_path: str, inventory: Any = None,
+                            journal: Journal = None, workers: int = 8, sync: bool = False,
+                            delete: bool = False) -> List[Dict[str, Any]]:
     """Migrate variables from all projects in source group to destination group"""
     try:
-        source_group = source_gl.groups.get(source_group_path)
-        source_projects = source_group.projects.list(all=True, include_subgroups=True)
-        
-        for source_project in source_projects:
-            source_project = source_gl.projects.get(source_project.id)
-            
-            try:
-                relative_path = source_project.path_with_namespace.replace(source_group_path + '/', '')
-                dest_project_path = f"{dest_group_path}/{relative_path}"
-                dest_project = dest_gl.projects.get(dest_project_path)
-                
-                logging.info(f"Migrating variables from project {source_project.path_with_namespace}")
-                project_vars = _get_variables(source_project)
-                
-                for var in project_vars:
-                    _create_variable(dest_project, var)
-                    
-            except gitlab.exceptions.GitlabGetError as e:
-                logging.error(f"Failed to find destination project {dest_project_path}: {e}")
-                continue
-                
-    except gitlab.exceptions.GitlabGetError as e:
-        logging.error(f"Failed to access group: {e}")
\ No newline at end of file
+        source_projects = get_all_projects(source_gl, source_group_path, source_group_path,
+                                           inventory=inventory)
+        dest_projects = {project['path_with_namespace']: project['project']
+                         for project in get_all_projects(dest_gl, dest_group_path, dest_group_path,
+                                                         inventory=inventory)}
+    except (gitlab.exceptions.GitlabGetError, gitlab.exceptions.GitlabListError) as e:
+        logging.error(f"Failed to access group: {e}")
+        return []
+
+    targets = []
+    for source_project in source_projects:
+        source_full_path = source_project['path_with_namespace']
+        relative_path = source_full_path.replace(source_group_path + '/', '')
+        dest_project_path = f"{dest_group_path}/{relative_path}"
+        if inventory is not None:
+            dest_project_path = inventory.destination_path(source_gl.url, source_full_path,
+                                                           dest_gl.url) or dest_project_path
+        targets.append(project_variable_target(source_project, dest_project_path,
+                                               dest_projects.get(dest_project_path)))
+    return migrate_variables(dest_gl, targets, workers, journal, sync, delete)
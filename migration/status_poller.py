@@ -0,0 +1,170 @@
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from typing import Callable, Optional
+
+FINISHED = 'finished'
+FAILED = 'failed'
+TIMED_OUT = 'timed_out'
+
+
+class PollJob:
+    """A single export/import job watched by the poller"""
+
+    def __init__(self, name: str, refresh: Callable[[], str], deadline: Optional[float],
+                 on_complete: Optional[Callable[['PollJob'], None]], delay: float, min_delay: float = 0):
+        self.name = name
+        self.refresh = refresh
+        self.deadline = deadline
+        self.on_complete = on_complete
+        self.delay = delay
+        self.min_delay = min_delay
+        self.status = None
+        self.error = None
+        self.polls = 0
+        self.errors = 0
+        self.done = threading.Event()
+
+
+class StatusPoller:
+    """
+    Watches many export and import jobs from a single background thread.
+
+    Every job is polled with its own exponential backoff plus jitter, so jobs that
+    finish quickly are noticed early while long running ones cost few status calls.
+    A status check that raises (e.g. a 502 or a reset connection) is retried with the
+    same backoff, only a `failed` status, the deadline or `max_errors` failed checks
+    in a row end a job early.
+
+    Args:
+        initial_delay: Seconds before the first status check of a job
+        max_delay: Upper bound for the delay between two checks of a job
+        factor: Multiplier applied to the delay after every check
+        jitter: Relative random spread applied to every delay
+        max_errors: Consecutive failed status checks after which a job is reported as failed
+    """
+
+    def __init__(self, initial_delay: float = 1.0, max_delay: float = 30.0,
+                 factor: float = 1.5, jitter: float = 0.2, max_errors: int = 10):
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.jitter = jitter
+        self.max_errors = max_errors
+        self._queue = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def watch(self, name: str, refresh: Callable[[], str], timeout: Optional[float] = None,
+              on_complete: Optional[Callable[[PollJob], None]] = None, first_check: float = 0,
+              min_delay: float = 0) -> PollJob:
+        """
+        Start watching a job.
+
+        Args:
+            name: Name of the job used in log messages
+            refresh: Callable refreshing the job and returning its current status
+            timeout: Seconds after which the job is reported as timed out (optional)
+            on_complete: Callable invoked with the job once it finished, failed or timed out
+            first_check: Seconds before the first status check, 0 checks right away
+            min_delay: Lower bound for the delay between two checks, e.g. to stay within
+                the rate limit of the status endpoint
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        job = PollJob(name, refresh, deadline, on_complete, max(self.initial_delay, min_delay), min_delay)
+        with self._condition:
+            self._schedule(job, first_check)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='status-poller', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return job
+
+    def wait(self, job: PollJob) -> str:
+        """Block until the job is finished, raise if it failed or timed out"""
+        job.done.wait()
+        if job.status == FINISHED:
+            return job.status
+        if job.status == TIMED_OUT:
+            raise TimeoutError(f'{job.name} did not finish before its deadline')
+        raise RuntimeError(f'{job.name} ended with status {job.status}: {job.error}')
+
+    def wait_for(self, name: str, refresh: Callable[[], str], timeout: Optional[float] = None,
+                 first_check: float = 0, min_delay: float = 0) -> str:
+        """Watch a job and block until it is finished"""
+        return self.wait(self.watch(name, refresh, timeout, first_check=first_check, min_delay=min_delay))
+
+    def _schedule(self, job: PollJob, delay: float):
+        heapq.heappush(self._queue, (time.monotonic() + delay, next(self._counter), job))
+
+    def _next_delay(self, job: PollJob) -> float:
+        delay = job.delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+        job.delay = max(min(job.delay * self.factor, self.max_delay), job.min_delay)
+        return max(delay, job.min_delay)
+
+    def _complete(self, job: PollJob, status: str, error: Optional[str] = None):
+        job.status = status
+        job.error = error
+        logging.debug(f'{job.name} completed with status {status} after {job.polls} status checks')
+        if job.on_complete:
+            try:
+                job.on_complete(job)
+            except Exception as e:
+                logging.error(f'Completion callback for {job.name} failed: {e}')
+        job.done.set()
+
+    def _poll(self, job: PollJob):
+        job.polls += 1
+        try:
+            status = job.refresh()
+        except Exception as e:
+            job.errors += 1
+            if job.errors >= self.max_errors:
+                self._complete(job, FAILED, f'{job.errors} status checks failed in a row, last one: {e}')
+                return
+            logging.warning(f'Status check {job.errors} of {job.name} failed, retrying: {e}')
+            status = job.status
+        else:
+            job.errors = 0
+
+        if status == FINISHED or status == FAILED:
+            self._complete(job, status)
+        elif job.deadline is not None and time.monotonic() >= job.deadline:
+            self._complete(job, TIMED_OUT)
+        else:
+            job.status = status
+            with self._condition:
+                delay = self._next_delay(job)
+                if job.deadline is not None:
+                    delay = min(delay, max(job.deadline - time.monotonic(), 0))
+                self._schedule(job, delay)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                due, _, job = self._queue[0]
+                now = time.monotonic()
+                if due > now:
+                    self._condition.wait(due - now)
+                    continue
+                heapq.heappop(self._queue)
+            self._poll(job)
+
+
+_poller = None
+_poller_lock = threading.Lock()
+
+
+def get_poller() -> StatusPoller:
+    """Return the poller shared by all export and import jobs of the process"""
+    global _poller
+    with _poller_lock:
+        if _poller is None:
+            _poller = StatusPoller()
+        return _poller
@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import inspect
+import functools
+import threading
+from contextlib import contextmanager
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+
+_API_PREFIX = '/api/v4'
+# Resources followed by the ID, path or key of one of their items, replaced by a
+# placeholder so that API calls are counted per endpoint
+_COLLECTIONS = {'groups', 'projects', 'variables', 'files', 'branches', 'merge_requests',
+                'bulk_imports', 'entities', 'namespaces', 'users'}
+_ACTIONS = {'import', 'export'}
+
+
+def endpoint(path: str) -> str:
+    """API endpoint of a request path, e.g. /projects/:id/export for /api/v4/projects/42/export"""
+    path = path.split('?', 1)[0]
+    if path.startswith(_API_PREFIX):
+        path = path[len(_API_PREFIX):]
+    segments = path.split('/')
+    for index in range(1, len(segments)):
+        previous, segment = segments[index - 1], segments[index]
+        if segment.isdigit() or '%2F' in segment or (previous in _COLLECTIONS and segment not in _ACTIONS):
+            segments[index] = ':id'
+    return '/'.join(segments) or '/'
+
+def _label(value: Any) -> Any:
+    if isinstance(value, dict):
+        return value.get('id', value.get('key'))
+    for attribute in ('id', 'key'):
+        if hasattr(value, attribute):
+            return getattr(value, attribute)
+    if value is None or isinstance(value, (int, float, str, bool)):
+        return value
+    return str(value)
+
+def _escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Telemetry:
+    """
+    In-memory spans and counters of a run.
+
+    Spans time units of work (exports, imports, replacements...) per thread. Every
+    HTTP request sent through the GitLab sessions is counted per host, method, endpoint
+    and status, together with the bytes sent and received. Both can be written as a
+    Chrome trace (chrome://tracing, Perfetto) or as Prometheus text metrics.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        self.requests: Dict[tuple, int] = defaultdict(int)
+        self.bytes: Dict[tuple, int] = defaultdict(int)
+
+    @contextmanager
+    def span(self, name: str, **args):
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            end = time.perf_counter()
+            record = {'name': name, 'start': start - self._origin, 'duration': end - start,
+                      'thread': threading.get_ident(), 'args': args}
+            if error:
+                record['args'] = {**args, 'error': error}
+            with self._lock:
+                self.spans.append(record)
+
+    def record_request(self, host: str, method: str, path: str, status: int, sent: int, received: int):
+        with self._lock:
+            self.requests[(host, method, endpoint(path), status)] += 1
+            self.bytes[(host, 'sent')] += sent
+            self.bytes[(host, 'received')] += received
+
+    def summary(self) -> Dict[str, int]:
+        """Total API calls and bytes sent and received over all hosts"""
+        with self._lock:
+            return {
+                'requests': sum(self.requests.values()),
+                'sent': sum(count for (_, direction), count in self.bytes.items() if direction == 'sent'),
+                'received': sum(count for (_, direction), count in self.bytes.items() if direction == 'received')
+            }
+
+    def chrome_trace(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = list(self.spans)
+        threads = {thread: index for index, thread in enumerate(dict.fromkeys(span['thread'] for span in spans))}
+        return {'traceEvents': [{
+            'name': span['name'],
+            'ph': 'X',
+            'ts': round(span['start'] * 1e6),
+            'dur': round(span['duration'] * 1e6),
+            'pid': os.getpid(),
+            'tid': threads[span['thread']],
+            'args': span['args']
+        } for span in spans], 'displayTimeUnit': 'ms'}
+
+    def prometheus(self) -> str:
+        with self._lock:
+            requests = dict(self.requests)
+            transferred = dict(self.bytes)
+            spans = list(self.spans)
+        lines = ['# HELP glare_api_requests_total HTTP requests sent to GitLab',
+                 '# TYPE glare_api_requests_total counter']
+        for (host, method, path, status), count in sorted(requests.items()):
+            lines.append(f'glare_api_requests_total{{host="{_escape(host)}",method="{method}",'
+                         f'endpoint="{_escape(path)}",status="{status}"}} {count}')
+        lines += ['# HELP glare_http_bytes_total Bytes of HTTP bodies sent to and received from GitLab',
+                  '# TYPE glare_http_bytes_total counter']
+        for (host, direction), count in sorted(transferred.items()):
+            lines.append(f'glare_http_bytes_total{{host="{_escape(host)}",direction="{direction}"}} {count}')
+
+        totals = defaultdict(lambda: [0, 0.0])
+        for span in spans:
+            totals[span['name']][0] += 1
+            totals[span['name']][1] += span['duration']
+        lines += ['# HELP glare_span_seconds Time spent in instrumented operations',
+                  '# TYPE glare_span_seconds summary']
+        for name, (count, seconds) in sorted(totals.items()):
+            lines.append(f'glare_span_seconds_count{{name="{name}"}} {count}')
+            lines.append(f'glare_span_seconds_sum{{name="{name}"}} {seconds:.6f}')
+        return '\n'.join(lines) + '\n'
+
+    def write_chrome_trace(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+    def write_prometheus(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(self.prometheus())
+
+
+_telemetry = Telemetry()
+
+
+def get_telemetry() -> Telemetry:
+    """Return the telemetry shared by the process"""
+    return _telemetry
+
+def span(name: str, **args):
+    return _telemetry.span(name, **args)
+
+def traced(*fields: str, name: Optional[str] = None) -> Callable:
+    """
+    Record every call of the decorated function as a span named after it, labelled
+    with the given arguments (dicts and GitLab objects are labelled with their ID).
+    """
+    def decorator(func: Callable) -> Callable:
+        signature = inspect.signature(func)
+        span_name = name or func.__name__.lstrip('_')
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            labels = {}
+            if fields:
+                arguments = signature.bind_partial(*args, **kwargs).arguments
+                labels = {field: _label(arguments.get(field)) for field in fields}
+            with _telemetry.span(span_name, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
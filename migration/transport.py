@@ -0,0 +1,148 @@
+import time
+import logging
+import threading
+import requests
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from typing import Dict, Optional
+from migration.telemetry import get_telemetry
+
+DEFAULT_RATE = 20.0
+MIN_RATE = 0.5
+POOL_HEADROOM = 8
+
+
+class TokenBucket:
+    """
+    Token bucket limiting the request rate to a single host.
+
+    Args:
+        rate: Maximum number of requests per second, 0 means unlimited
+        burst: Number of requests that may be sent at once after an idle period
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif not self.rate:
+                    return
+                else:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Hold every request for the given time, e.g. after a 429 response"""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+    def adjust(self, rate: float):
+        """Change the rate, never above the configured maximum"""
+        with self._lock:
+            if self.max_rate:
+                rate = min(rate, self.max_rate)
+            self.rate = max(rate, MIN_RATE)
+
+
+def _retry_after(value: str) -> Optional[float]:
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class ThrottledSession(requests.Session):
+    """
+    requests session with a connection pool sized to the number of workers and a
+    token bucket per host.
+
+    The rate of a host follows the `RateLimit-Remaining`/`RateLimit-Reset` headers it
+    returns, spreading the remaining requests over the rest of the window. A 429
+    response pauses every request to the host for `Retry-After` seconds and halves
+    its rate.
+
+    Args:
+        rate: Maximum number of requests per second per host, 0 means unlimited
+        pool_size: Number of connections kept open per host
+    """
+
+    def __init__(self, rate: float = DEFAULT_RATE, pool_size: int = 10):
+        super().__init__()
+        self.rate = rate
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def bucket(self, host: str) -> TokenBucket:
+        with self._lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self.rate, max(self.rate, 1) * 2)
+            return self._buckets[host]
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        host = urlparse(request.url).netloc
+        bucket = self.bucket(host)
+        bucket.acquire()
+        response = super().send(request, **kwargs)
+        self._adapt(host, bucket, response)
+        self._record(host, request, response, kwargs.get('stream', False))
+        return response
+
+    def _record(self, host: str, request: requests.PreparedRequest, response: requests.Response,
+                streamed: bool):
+        sent = int(request.headers.get('Content-Length') or 0)
+        received = response.headers.get('Content-Length')
+        if received is None and not streamed:
+            received = len(response.content)
+        get_telemetry().record_request(host, request.method, urlparse(request.url).path,
+                                       response.status_code, sent, int(received or 0))
+
+    def _adapt(self, host: str, bucket: TokenBucket, response: requests.Response):
+        headers = response.headers
+        if response.status_code == 429:
+            retry_after = _retry_after(headers.get('Retry-After', '')) or 1
+            logging.warning(f'Rate limited by {host}, pausing requests for {retry_after:.0f}s')
+            bucket.pause(retry_after)
+            bucket.adjust(bucket.rate / 2 if bucket.rate else self.rate or DEFAULT_RATE)
+            return
+
+        remaining = headers.get('RateLimit-Remaining')
+        reset = headers.get('RateLimit-Reset')
+        if remaining is None or reset is None:
+            return
+        try:
+            remaining = int(remaining)
+            window = max(float(reset) - time.time(), 1)
+        except ValueError:
+            return
+        bucket.adjust(remaining / window)
+
+
+def create_session(rate: Optional[float] = None, workers: int = 1) -> ThrottledSession:
+    """Session for one GitLab instance, with enough connections for `workers` threads"""
+    return ThrottledSession(DEFAULT_RATE if rate is None else rate, workers + POOL_HEADROOM)
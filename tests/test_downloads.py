@@ -0,0 +1,119 @@
+import os
+import time
+import gitlab
+import pytest
+from benchmarks.mock_gitlab import MockGitLab, MockConfig
+from migration.downloads import DownloadManifest, download_resumable
+
+MB = 1024 ** 2
+CHUNK = 256 * 1024
+
+
+@pytest.fixture
+def source(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    mock = MockGitLab(MockConfig(export_seconds=0))
+    mock.start()
+    project = mock.add_project('group', 'service', 2 * MB)
+    # Exported a while ago, so a new export gets another Last-Modified
+    mock.project_exports[project['id']] = time.monotonic() - 60
+    yield mock, project
+    mock.stop()
+
+
+def _download(mock: MockGitLab, project, manifest: DownloadManifest, statuses: list = None,
+              interrupt_after: int = None):
+    """Download the export of a project, recording the status of every download response"""
+    gl = gitlab.Gitlab(mock.url, private_token='test')
+    http_request = gl.http_request
+    statuses = [] if statuses is None else statuses
+
+    def recorded(verb, *args, **kwargs):
+        if verb != 'get':
+            return http_request(verb, *args, **kwargs)
+        try:
+            response = http_request(verb, *args, **kwargs)
+        except gitlab.exceptions.GitlabHttpError as e:
+            statuses.append(e.response_code)
+            raise
+        statuses.append(response.status_code)
+        if interrupt_after is None:
+            return response
+        iter_content = response.iter_content
+
+        def broken(chunk_size):
+            for number, chunk in enumerate(iter_content(chunk_size=chunk_size)):
+                if number == interrupt_after:
+                    raise ConnectionError('Connection reset by peer')
+                yield chunk
+
+        response.iter_content = broken
+        return response
+
+    gl.http_request = recorded
+    return download_resumable(gl, f"/projects/{project['id']}/export/download", 'exports/1-export.tgz',
+                              CHUNK, manifest)
+
+
+def test_interrupted_download_resumes(source):
+    mock, project = source
+    manifest = DownloadManifest(None)
+    with pytest.raises(ConnectionError):
+        _download(mock, project, manifest, interrupt_after=2)
+    assert os.path.getsize('exports/1-export.tgz.part') == 2 * CHUNK
+    statuses = []
+
+    entry = _download(mock, project, manifest, statuses)
+
+    assert statuses == [206]
+    assert entry['size'] == project['size']
+    assert manifest.verify('exports/1-export.tgz')
+    assert not os.path.exists('exports/1-export.tgz.part.validator')
+
+
+def test_changed_file_restarts_download(source):
+    mock, project = source
+    manifest = DownloadManifest(None)
+    with pytest.raises(ConnectionError):
+        _download(mock, project, manifest, interrupt_after=2)
+    mock.project_exports[project['id']] = time.monotonic()
+    statuses = []
+
+    entry = _download(mock, project, manifest, statuses)
+
+    assert statuses == [200]
+    assert entry['size'] == project['size']
+
+
+def test_partial_without_validator_restarts_download(source):
+    mock, project = source
+    manifest = DownloadManifest(None)
+    with pytest.raises(ConnectionError):
+        _download(mock, project, manifest, interrupt_after=2)
+    os.remove('exports/1-export.tgz.part.validator')
+    statuses = []
+
+    entry = _download(mock, project, manifest, statuses)
+
+    assert statuses == [200]
+    assert entry['size'] == project['size']
+
+
+def test_complete_partial_file_is_not_downloaded_again(source):
+    mock, project = source
+    manifest = DownloadManifest(None)
+    _download(mock, project, manifest)
+    # Crash after the last byte was written, before the file was renamed
+    os.replace('exports/1-export.tgz', 'exports/1-export.tgz.part')
+    gl = gitlab.Gitlab(mock.url, private_token='test')
+    last_modified = gl.http_head(f"/projects/{project['id']}/export/download")['Last-Modified']
+    with open('exports/1-export.tgz.part.validator', 'w') as f:
+        f.write(last_modified)
+    manifest.remove('exports/1-export.tgz')
+    statuses = []
+
+    entry = _download(mock, project, manifest, statuses)
+
+    assert statuses == [416]
+    assert entry['size'] == project['size']
+    assert manifest.verify('exports/1-export.tgz')
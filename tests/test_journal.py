@@ -0,0 +1,31 @@
+from migration.journal import Journal, DONE, FAILED, PENDING
+
+
+def test_run_without_resume_keeps_previous_state(tmp_path):
+    path = str(tmp_path / 'journal.jsonl')
+    journal = Journal(path)
+    journal.done('project:1:import')
+    journal.fail('project:2:import', 'boom')
+
+    other = Journal(path)
+    assert other.state('project:1:import') == PENDING
+    other.done('group:target:import')
+
+    resumed = Journal(path, resume=True)
+    assert resumed.is_done('project:1:import')
+    assert resumed.state('project:2:import') == FAILED
+    assert resumed.state('group:target:import') == DONE
+
+
+def test_resume_ignores_line_cut_short(tmp_path):
+    path = tmp_path / 'journal.jsonl'
+    Journal(str(path)).done('project:1:import')
+    with open(path, 'a') as f:
+        f.write('{"key": "project:2:imp')
+
+    Journal(str(path)).done('project:3:import')
+
+    resumed = Journal(str(path), resume=True)
+    assert resumed.is_done('project:1:import')
+    assert resumed.is_done('project:3:import')
+    assert resumed.state('project:2:import') == PENDING
@@ -0,0 +1,144 @@
+import time
+import tempfile
+import gitlab
+import pytest
+from benchmarks.mock_gitlab import MockGitLab, MockConfig
+from migration import projects_manager
+from migration.journal import Journal
+from migration.export_cache import ExportCache
+
+MB = 1024 ** 2
+
+
+class RecordingSpool(tempfile.SpooledTemporaryFile):
+    instances = []
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        RecordingSpool.instances.append(self)
+
+
+@pytest.fixture
+def instances(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(projects_manager.tempfile, 'SpooledTemporaryFile', RecordingSpool)
+    RecordingSpool.instances = []
+    config = MockConfig(export_seconds=0, import_seconds=0)
+    source, destination = MockGitLab(config), MockGitLab(config)
+    source.start()
+    destination.start()
+    destination.add_group('target')
+    yield source, destination
+    source.stop()
+    destination.stop()
+
+
+def _stream(source: MockGitLab, destination: MockGitLab, size: int, spool_mb: int):
+    project = source.add_project('group', 'service', size)
+    source_gl = gitlab.Gitlab(source.url, private_token='test')
+    dest_gl = gitlab.Gitlab(destination.url, private_token='test')
+    export = source_gl.projects.get(project['id']).exports.create()
+    project_info = {'id': project['id'], 'path': 'service', 'name': 'service'}
+    projects_manager.stream_project(export, dest_gl, project_info, 'target', spool_mb)
+    return export, dest_gl, project_info
+
+
+def test_stream_keeps_small_archive_in_memory(instances):
+    source, destination = instances
+    _stream(source, destination, 5 * MB, spool_mb=256)
+
+    spool, = RecordingSpool.instances
+    assert not spool._rolled
+    assert [project['path'] for project in destination.projects.values()] == ['service']
+
+
+def test_stream_spills_large_archive(instances):
+    source, destination = instances
+    _stream(source, destination, 2 * MB, spool_mb=1)
+
+    spool, = RecordingSpool.instances
+    assert spool._rolled
+    assert len(destination.projects) == 1
+
+
+@pytest.fixture
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr('retry.api.time.sleep', lambda seconds: None)
+
+
+def test_stream_does_not_take_over_existing_project(instances, no_retry_delay):
+    source, destination = instances
+    export, dest_gl, project_info = _stream(source, destination, MB, spool_mb=256)
+
+    with pytest.raises(gitlab.exceptions.GitlabImportError):
+        projects_manager.stream_project(export, dest_gl, project_info, 'target')
+
+    assert len(destination.projects) == 1
+
+
+def test_stream_retry_uses_project_of_unanswered_upload(instances, monkeypatch, no_retry_delay):
+    source, destination = instances
+    start_import = projects_manager._start_import
+    calls = []
+
+    def lose_first_answer(*args):
+        calls.append(args)
+        project_id = start_import(*args)
+        if len(calls) == 1:
+            raise ConnectionError('Connection reset by peer')
+        return project_id
+
+    monkeypatch.setattr(projects_manager, '_start_import', lose_first_answer)
+    imported = []
+    project = source.add_project('group', 'service', MB)
+    export = gitlab.Gitlab(source.url, private_token='test').projects.get(project['id']).exports.create()
+    dest_gl = gitlab.Gitlab(destination.url, private_token='test')
+    projects_manager.stream_project(export, dest_gl, {'id': project['id'], 'path': 'service', 'name': 'service'},
+                                    'target', on_upload=imported.append)
+
+    assert len(calls) == 1
+    assert imported == [project_id for project_id, p in destination.projects.items() if p['path'] == 'service']
+
+
+def test_wait_for_import_fails_without_import(instances):
+    _, destination = instances
+    project = destination.add_project('target', 'manual', MB)
+    dest_gl = gitlab.Gitlab(destination.url, private_token='test')
+
+    with pytest.raises(RuntimeError, match='ended with status failed'):
+        projects_manager._wait_for_import(dest_gl, project['id'], 'manual')
+
+
+def _export_info(source: MockGitLab):
+    project = source.add_project('group', 'service', MB)
+    source_project = gitlab.Gitlab(source.url, private_token='test').projects.get(project['id'])
+    return {'id': project['id'], 'project': source_project, 'last_activity_at': project['last_activity_at']}
+
+
+def test_failed_server_export_is_replaced(instances):
+    source, _ = instances
+    project_info = _export_info(source)
+    cache = ExportCache('cache/exports')
+    journal = Journal(None)
+    projects_manager._start_export(project_info, journal, cache)
+    source.failed_exports.add(project_info['id'])
+
+    export = projects_manager._start_export(project_info, journal, cache)
+
+    assert source.requests[('POST', '/projects/:id/export')] == 2
+    export.refresh()
+    assert export.export_status == 'finished'
+
+
+def test_server_export_older_than_request_is_replaced(instances):
+    source, _ = instances
+    project_info = _export_info(source)
+    cache = ExportCache('cache/exports')
+    projects_manager._start_export(project_info, Journal(None), cache)
+    projects_manager._start_export(project_info, Journal(None), cache)
+    assert source.requests[('POST', '/projects/:id/export')] == 1
+
+    cache.record_server_export(project_info, time.time() + 3600)
+    projects_manager._start_export(project_info, Journal(None), cache)
+
+    assert source.requests[('POST', '/projects/:id/export')] == 2
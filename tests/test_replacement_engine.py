@@ -0,0 +1,67 @@
+import os
+import pytest
+from migration import replacement_engine
+from migration.replacement_engine import ReplacementEngine, replace_in_directory, PARALLEL_THRESHOLD
+
+
+def test_longest_overlapping_key_wins():
+    engine = ReplacementEngine({'gitlab.com': 'git.example.org',
+                                'registry.gitlab.com': 'registry.example.org'})
+
+    content, counts = engine.replace_bytes(b'image: registry.gitlab.com/app\nurl: https://gitlab.com/app\n')
+
+    assert content == b'image: registry.example.org/app\nurl: https://git.example.org/app\n'
+    assert counts == {'registry.gitlab.com': 1, 'gitlab.com': 1}
+
+
+def test_replacements_are_not_matched_again():
+    engine = ReplacementEngine({'old.example.com': 'new.example.com', 'new.example.com': 'other.example.com'})
+
+    content, _ = engine.replace_bytes(b'old.example.com new.example.com')
+
+    assert content == b'new.example.com other.example.com'
+
+
+def test_content_not_utf8_is_left_alone():
+    engine = ReplacementEngine({'gitlab.com': 'git.example.org'})
+    content = b'gitlab.com \xff\xfe'
+
+    assert engine.replace_bytes(content) == (content, {})
+
+
+@pytest.mark.parametrize('name, matches', [
+    ('config.YAML', True),
+    ('Dockerfile', True),
+    ('build.Dockerfile', True),
+    ('.gitlab-ci.yml', True),
+    ('pom.xml', True),
+    ('other.xml', False),
+    ('README.md', False),
+])
+def test_file_patterns_match_suffixes_case_insensitively(name, matches):
+    assert ReplacementEngine({'a': 'b'}).matches_file(name) is matches
+
+
+def _repository(path, files: int) -> str:
+    os.makedirs(path / '.git')
+    (path / '.git' / 'config.yml').write_text('url: gitlab.com\n')
+    (path / 'README.md').write_text('url: gitlab.com\n')
+    (path / 'unchanged.yml').write_text('name: app\n')
+    for number in range(files):
+        (path / f'service-{number}.yml').write_text('url: gitlab.com\nimage: registry.gitlab.com/app\n')
+    return str(path)
+
+
+@pytest.mark.parametrize('files, workers', [(3, 1), (PARALLEL_THRESHOLD, 2)])
+def test_replace_in_directory(tmp_path, files, workers):
+    directory = _repository(tmp_path, files)
+    engine = ReplacementEngine({'gitlab.com': 'git.example.org', 'registry.gitlab.com': 'registry.example.org'})
+
+    changed = replace_in_directory(engine, directory, workers)
+
+    assert sorted(changed) == sorted(os.path.join(directory, f'service-{number}.yml') for number in range(files))
+    assert (tmp_path / 'service-0.yml').read_text() == 'url: git.example.org\nimage: registry.example.org/app\n'
+    assert (tmp_path / 'README.md').read_text() == 'url: gitlab.com\n'
+    assert (tmp_path / '.git' / 'config.yml').read_text() == 'url: gitlab.com\n'
+    if workers > 1:
+        assert replacement_engine._process_pool is not None
@@ -0,0 +1,72 @@
+import gitlab
+import pytest
+from benchmarks.mock_gitlab import MockGitLab, MockConfig
+from migration.secrets_manager import migrate_group_variables
+
+
+@pytest.fixture
+def instances(monkeypatch):
+    source, destination = MockGitLab(MockConfig()), MockGitLab(MockConfig())
+    source.start()
+    destination.start()
+    monkeypatch.setenv('GITLAB_SOURCE_URL', source.url)
+    monkeypatch.setenv('GITLAB_TARGET_URL', destination.url)
+    group = source.add_group('group')
+    source.add_variable('group', group['id'], 'TOKEN', 'secret')
+    source.add_variable('group', group['id'], 'API_URL', f'{source.url}/api', 'production')
+    source.add_variable('group', group['id'], 'API_URL', f'{source.url}/staging-api', 'staging')
+    target = destination.add_group('target')
+    yield source, destination, group, target
+    source.stop()
+    destination.stop()
+
+
+def _migrate(source: MockGitLab, destination: MockGitLab, delete: bool = False):
+    destination.requests.clear()
+    source_gl = gitlab.Gitlab(source.url, private_token='test')
+    dest_gl = gitlab.Gitlab(destination.url, private_token='test')
+    results = migrate_group_variables(source_gl, dest_gl, 'group', 'target', sync=True, delete=delete)
+    writes = {method: sum(count for (verb, _), count in destination.requests.items() if verb == method)
+              for method in ('POST', 'PUT', 'DELETE')}
+    return results, writes
+
+
+def test_rerun_without_changes_makes_no_writes(instances):
+    source, destination, _, target = instances
+    _, writes = _migrate(source, destination)
+    assert writes == {'POST': 3, 'PUT': 0, 'DELETE': 0}
+    assert destination.variables[('group', target['id'])][('API_URL', 'staging')]['value'] == \
+        f'{destination.url}/staging-api'
+
+    results, writes = _migrate(source, destination)
+
+    assert writes == {'POST': 0, 'PUT': 0, 'DELETE': 0}
+    assert results[0]['status'] == 'migrated'
+
+
+def test_changed_variable_is_updated(instances):
+    source, destination, group, target = instances
+    _migrate(source, destination)
+    source.add_variable('group', group['id'], 'API_URL', f'{source.url}/v2', 'production')
+
+    _, writes = _migrate(source, destination)
+
+    assert writes == {'POST': 0, 'PUT': 1, 'DELETE': 0}
+    variables = destination.variables[('group', target['id'])]
+    assert variables[('API_URL', 'production')]['value'] == f'{destination.url}/v2'
+    assert variables[('API_URL', 'staging')]['value'] == f'{destination.url}/staging-api'
+
+
+def test_extra_variable_is_deleted_only_when_asked(instances):
+    source, destination, _, target = instances
+    _migrate(source, destination)
+    destination.add_variable('group', target['id'], 'LEGACY', 'value')
+
+    _, writes = _migrate(source, destination)
+    assert writes == {'POST': 0, 'PUT': 0, 'DELETE': 0}
+
+    _, writes = _migrate(source, destination, delete=True)
+
+    assert writes == {'POST': 0, 'PUT': 0, 'DELETE': 1}
+    assert ('LEGACY', '*') not in destination.variables[('group', target['id'])]
+    assert len(destination.variables[('group', target['id'])]) == 3
@@ -0,0 +1,37 @@
+import pytest
+from migration.status_poller import StatusPoller, FINISHED
+
+
+def _statuses(*outcomes):
+    """Status check returning or raising the given outcomes in turn, then 'finished'"""
+    remaining = list(outcomes)
+
+    def refresh():
+        outcome = remaining.pop(0) if remaining else FINISHED
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    return refresh
+
+
+def test_failed_status_checks_are_retried():
+    poller = StatusPoller(initial_delay=0.01, max_delay=0.01)
+    refresh = _statuses('started', ConnectionError('reset'), IOError('502 Bad Gateway'), 'started')
+
+    assert poller.wait_for('Import of project', refresh, timeout=10) == FINISHED
+
+
+def test_consecutive_failed_status_checks_fail_the_job():
+    poller = StatusPoller(initial_delay=0.01, max_delay=0.01, max_errors=3)
+    refresh = _statuses('started', *[ConnectionError('reset')] * 3)
+
+    with pytest.raises(RuntimeError, match='3 status checks failed in a row'):
+        poller.wait_for('Import of project', refresh, timeout=10)
+
+
+def test_failed_status_ends_the_job():
+    poller = StatusPoller(initial_delay=0.01, max_delay=0.01)
+
+    with pytest.raises(RuntimeError, match='ended with status failed'):
+        poller.wait_for('Import of project', _statuses('started', 'failed'), timeout=10)